@@ -9,6 +9,8 @@ from api_routes import api
 from web_routes import web  
 from base import Base
 from config import config
+from last_values import last_value_cache
+import serializers
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
@@ -26,9 +28,11 @@ def create_app():
     allowed_origins = app.config.get('CORS_ALLOWED_ORIGINS', [])
     CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
     db.init_app(app)
+    serializers.init_app(app)
     register_blueprints(app)  
     with app.app_context():
-        Base.metadata.create_all(bind=engine)
+        init_db()
+    last_value_cache.warm()
     return app
 
 def register_blueprints(app):
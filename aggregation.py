@@ -0,0 +1,259 @@
+import logging
+import re
+
+import numpy as np
+from sqlalchemy import BigInteger, func, literal_column, type_coerce
+
+from blocks import block_columns
+from database import db_session_scope
+from models import SensorRollup
+from ring_buffers import to_micros
+from samples import readings
+import rollups
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SIMPLE_FUNCTIONS = ("avg", "min", "max", "count", "sum")
+PERCENTILE_PATTERN = re.compile(r"^p(\d{1,2}(?:\.\d+)?)$")
+FILL_MODES = ("none", "null", "zero", "previous", "linear")
+DURATION_PATTERN = re.compile(r"^(\d+)([smhd]?)$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class AggregationError(ValueError):
+    """Raised for aggregation requests that cannot be answered as asked."""
+    pass
+
+
+def parse_duration(value):
+    """Parse a bucket width such as '300', '5m', '1h' or '1d' into seconds."""
+    match = DURATION_PATTERN.match(str(value).strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        raise AggregationError(f"Invalid bucket width: {value}")
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_functions(value):
+    """
+    Parse a comma separated list of aggregate functions.
+    Percentiles are written pNN, e.g. p50 or p99.9.
+    """
+    functions = [f.strip().lower() for f in (value or "avg").split(",") if f.strip()]
+    for name in functions:
+        if name in SIMPLE_FUNCTIONS:
+            continue
+        match = PERCENTILE_PATTERN.match(name)
+        if not match or not 0 <= float(match.group(1)) <= 100:
+            raise AggregationError(f"Unsupported function: {name}")
+    return functions
+
+
+def epoch_seconds(column):
+    """SQL expression for an epoch-millisecond column as integer epoch seconds."""
+    return type_coerce(column, BigInteger) // 1000
+
+
+def floor_to(expression, width):
+    """Round an integer SQL expression down to a multiple of width, staying in integer arithmetic."""
+    return expression - expression % width
+
+
+def aggregate(metric, start, end, bucket, functions, device_id=None, fill="none", as_arrays=False):
+    """
+    Aggregate one metric over [start, end) into fixed-width time buckets.
+    Plain functions are computed with SQL GROUP BY, over the rollups when the
+    bucket width is a multiple of a rollup resolution and over raw rows
+    otherwise. Percentiles are computed with NumPy from values sorted by SQL.
+    When compacted blocks overlap the range, raw-row work is done in NumPy over
+    the raw rows merged with the decoded blocks (rollups already include them).
+    :param as_arrays: Return NumPy arrays (NaN for missing) instead of JSON-ready lists.
+    :return: Dict of column name -> list, always including "t" (bucket start, epoch seconds).
+    """
+    if fill not in FILL_MODES:
+        raise AggregationError(f"Unsupported fill mode: {fill}")
+    start_s = rollups.to_epoch(start)
+    end_s = rollups.to_epoch(end)
+    simple = [f for f in functions if f in SIMPLE_FUNCTIONS]
+    percentiles = [f for f in functions if f not in SIMPLE_FUNCTIONS]
+
+    with db_session_scope(readonly=True) as session:
+        resolution = rollup_resolution(start_s, end_s, bucket)
+        merged = None
+        if not resolution or percentiles:
+            compacted = block_columns(session, to_micros(start), to_micros(end) - 1, device_id, metric)
+            if len(compacted["timestamp_us"]):
+                merged = _merged_values(session, metric, start, end, bucket, device_id, compacted)
+        if resolution:
+            buckets, columns = _aggregate_rollups(session, metric, start_s, end_s, bucket, simple, resolution, device_id)
+        elif merged is not None:
+            buckets, columns = _aggregate_values(*merged, simple)
+        else:
+            buckets, columns = _aggregate_raw(session, metric, start, end, bucket, simple, device_id)
+        for name in percentiles:
+            if merged is not None:
+                p_buckets, p_values = _sorted_percentile(*merged, float(name[1:]))
+            else:
+                p_buckets, p_values = _percentile(session, metric, start, end, bucket, float(name[1:]), device_id)
+            columns[name] = _align(buckets, p_buckets, p_values)
+
+    result = {"t": buckets}
+    result.update({name: columns[name] for name in functions})
+    if fill != "none":
+        result = gap_fill(result, start_s // bucket * bucket, end_s, bucket, fill)
+    if as_arrays:
+        return {name: values.astype(np.int64) if name == "count" else values for name, values in result.items()}
+    return {name: _to_list(values, integer=name in ("t", "count")) for name, values in result.items()}
+
+
+def rollup_resolution(start_s, end_s, bucket):
+    """Coarsest rollup whose buckets tile the requested buckets and range exactly, or None."""
+    fitting = [r for r in rollups.RESOLUTIONS if bucket % r == 0 and start_s % r == 0 and end_s % r == 0]
+    return max(fitting) if fitting else None
+
+
+def _aggregate_rollups(session, metric, start_s, end_s, bucket, functions, resolution, device_id):
+    bucket_expr = floor_to(SensorRollup.bucket, bucket)
+    expressions = {
+        "avg": func.sum(SensorRollup.sum) / func.sum(SensorRollup.count),
+        "min": func.min(SensorRollup.min),
+        "max": func.max(SensorRollup.max),
+        "count": func.sum(SensorRollup.count),
+        "sum": func.sum(SensorRollup.sum),
+    }
+    query = session.query(bucket_expr.label("t"), *[expressions[f].label(f) for f in functions]).filter(
+        SensorRollup.resolution == resolution,
+        SensorRollup.metric == metric,
+        SensorRollup.bucket >= start_s,
+        SensorRollup.bucket < end_s,
+    )
+    if device_id is not None:
+        query = query.filter(SensorRollup.device_id == device_id)
+    return _columns(query.group_by(literal_column("t")).order_by(literal_column("t")).all(), functions)
+
+
+def _aggregate_raw(session, metric, start, end, bucket, functions, device_id):
+    stored = readings(start, end, device_id, metric)
+    bucket_expr = floor_to(epoch_seconds(stored.c.timestamp), bucket)
+    expressions = {
+        "avg": func.avg(stored.c.value),
+        "min": func.min(stored.c.value),
+        "max": func.max(stored.c.value),
+        "count": func.count(stored.c.value),
+        "sum": func.sum(stored.c.value),
+    }
+    query = session.query(bucket_expr.label("t"), *[expressions[f].label(f) for f in functions])
+    return _columns(query.group_by(literal_column("t")).order_by(literal_column("t")).all(), functions)
+
+
+def _columns(rows, functions):
+    if not rows:
+        return np.array([], dtype=np.int64), {f: np.array([], dtype=np.float64) for f in functions}
+    buckets = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    columns = {}
+    for i, name in enumerate(functions, start=1):
+        columns[name] = np.fromiter((row[i] for row in rows), dtype=np.float64, count=len(rows))
+    return buckets, columns
+
+
+def _percentile(session, metric, start, end, bucket, q, device_id):
+    """Per-bucket percentile with linear interpolation, from values sorted by (bucket, value) in SQL."""
+    stored = readings(start, end, device_id, metric)
+    bucket_expr = floor_to(epoch_seconds(stored.c.timestamp), bucket)
+    query = session.query(bucket_expr.label("t"), stored.c.value).filter(stored.c.value.isnot(None))
+    rows = query.order_by(literal_column("t"), stored.c.value).all()
+    keys = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    return _sorted_percentile(keys, values, q)
+
+
+def _sorted_percentile(keys, values, q):
+    """Per-bucket percentile of values sorted by (bucket key, value)."""
+    if not len(keys):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    buckets, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    positions = starts + (q / 100.0) * (counts - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    weight = positions - lower
+    return buckets, values[lower] + (values[upper] - values[lower]) * weight
+
+
+def _merged_values(session, metric, start, end, bucket, device_id, compacted):
+    """
+    Raw and compacted readings in [start, end) that have a value.
+    :return: Tuple of (bucket keys, values), sorted by (bucket key, value).
+    """
+    stored = readings(start, end, device_id, metric)
+    rows = session.query(type_coerce(stored.c.timestamp, BigInteger), stored.c.value).filter(
+        stored.c.value.isnot(None)
+    ).all()
+    raw_times = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)) * 1000
+    raw_values = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    present = ~np.isnan(compacted["value"])
+    times = np.concatenate((compacted["timestamp_us"][present], raw_times))
+    values = np.concatenate((compacted["value"][present], raw_values))
+    keys = times // 1_000_000 // bucket * bucket
+    order = np.lexsort((values, keys))
+    return keys[order], values[order]
+
+
+def _aggregate_values(keys, values, functions):
+    """NumPy equivalent of _aggregate_raw over values sorted by bucket key."""
+    if not len(keys):
+        return np.array([], dtype=np.int64), {f: np.array([], dtype=np.float64) for f in functions}
+    buckets, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    sums = np.add.reduceat(values, starts)
+    computed = {
+        "avg": lambda: sums / counts,
+        "min": lambda: np.minimum.reduceat(values, starts),
+        "max": lambda: np.maximum.reduceat(values, starts),
+        "count": lambda: counts.astype(np.float64),
+        "sum": lambda: sums,
+    }
+    return buckets, {f: computed[f]() for f in functions}
+
+
+def _align(buckets, other_buckets, other_values):
+    """Place other_values on the buckets grid, NaN where a bucket has no value."""
+    aligned = np.full(len(buckets), np.nan)
+    if len(other_buckets) and len(buckets):
+        index = np.searchsorted(buckets, other_buckets)
+        index = np.clip(index, 0, len(buckets) - 1)
+        hit = buckets[index] == other_buckets
+        aligned[index[hit]] = other_values[hit]
+    return aligned
+
+
+def gap_fill(result, first_bucket, end_s, bucket, mode):
+    """
+    Expand a columnar result to every bucket between first_bucket and end_s.
+    mode is one of null, zero, previous or linear; count columns are always zero-filled.
+    """
+    grid = np.arange(first_bucket, end_s, bucket, dtype=np.int64)
+    present = np.isin(grid, result["t"])
+    filled = {"t": grid}
+    for name, values in result.items():
+        if name == "t":
+            continue
+        column = np.full(len(grid), np.nan)
+        column[present] = values
+        if name == "count" or mode == "zero":
+            column[~present] = 0
+        elif mode == "previous":
+            index = np.where(present, np.arange(len(grid)), -1)
+            np.maximum.accumulate(index, out=index)
+            column = np.where(index >= 0, column[np.maximum(index, 0)], np.nan)
+        elif mode == "linear" and present.any():
+            known = ~np.isnan(column)
+            column[~known] = np.interp(grid[~known], grid[known], column[known], left=np.nan, right=np.nan)
+        filled[name] = column
+    return filled
+
+
+def _to_list(values, integer=False):
+    """Convert a column to JSON-ready values, with None for missing points."""
+    if values.dtype.kind != "f":
+        return values.tolist()
+    convert = int if integer else float
+    return [None if np.isnan(v) else convert(v) for v in values]
@@ -1,18 +1,26 @@
-from flask import Blueprint, jsonify, render_template, request, current_app
+from flask import Blueprint, jsonify, render_template, request, current_app, url_for
 from flask_jwt_extended import jwt_required
 from sqlalchemy.exc import SQLAlchemyError
-from bleak import BleakClient, BleakError
-from bokeh.embed import components
+from bleak import BleakError
 from bokeh.resources import CDN
 from datetime import datetime
 from threading import Thread
-import asyncio
 import logging
 
-from models import SensorData, DeviceMetadata
-from visualization import create_bar_chart
-from data_ops import extract_data_from_queue
-from database import Session as db
+from models import DeviceMetadata
+from aggregation import parse_duration
+from config import config
+from pagination import clamp_limit
+import charts
+from conditional import conditional_get
+from watermarks import DEVICES
+import decimation
+from data_ops import bulk_writer, extract_data_from_queue, notification_stream
+from ble_connections import ble_connections
+from ble_polling import poll_scheduler
+from loop_thread import background_loop
+from gatt_cache import gatt_cache
+from sensor_service import add_new_device_record
 import services
 import background_tasks
 
@@ -63,6 +71,45 @@ def discover_characteristics():
     else:
         return api_response({"error": "Failed to interact with BLE device"}), 500
 
+@api.route("/ble/connections", methods=["GET"])
+def ble_connection_states():
+    """
+    State of the pooled BLE links, one entry per device the process has connected to.
+    Query params: address (optional) to narrow it to one device.
+    """
+    return api_response(True, data=ble_connections.states(request.args.get("address")))
+
+@api.route("/ble/notifications", methods=["GET"])
+def ble_notification_stats():
+    """
+    Notification streaming counters and each device's collection mode (notify or poll).
+    """
+    return api_response(True, data=notification_stream.stats())
+
+@api.route("/ble/sweeps/last", methods=["GET"])
+def ble_last_sweep():
+    """
+    Report of the latest polling sweep: duration, success rate, errors and per-device latency.
+    """
+    report = poll_scheduler.last_report
+    return api_response(True, data=report.as_dict() if report else None)
+
+@api.route("/ble/gatt/<address>", methods=["GET"])
+def ble_gatt_table(address):
+    """
+    Cached GATT table of a device (services, characteristics, properties and handles).
+    Query params: refresh=1 to rediscover it over the radio.
+    """
+    refresh = request.args.get("refresh") == "1"
+    try:
+        table = background_loop.run(gatt_cache.load(address, refresh=refresh), config.ASYNC_CALL_TIMEOUT)
+    except TimeoutError:
+        return api_response(False, error="BLE device did not respond in time", status_code=504)
+    except Exception as e:
+        log_error("ble_gatt_table - BLE interaction", e)
+        return api_response(False, error="Failed to interact with BLE device", status_code=502)
+    return api_response(True, data=table.as_dict())
+
 @api.route("/select_characteristic", methods=["POST"])
 @jwt_required()
 def select_characteristic():
@@ -71,7 +118,7 @@ def select_characteristic():
         return api_response({"error": "Invalid or missing UUID"}), 400
     try:     
         current_app.config['CHARACTERISTIC_UUID'] = characteristic_uuid  
-        available_characteristics = asyncio.run(services.get_all_characteristics())
+        available_characteristics = background_loop.run(services.get_all_characteristics(), config.ASYNC_CALL_TIMEOUT)
         if not characteristic_uuid:
             return "Characteristic UUID is required", 400
         if characteristic_uuid not in available_characteristics:
@@ -85,21 +132,33 @@ def select_characteristic():
     except BleakError as e:
         log_error(f"BLE error: {e}")
         return api_response({"error": "Failed to interact with BLE device"}), 500
+    except TimeoutError as e:
+        log_error("select_characteristic - BLE interaction", e)
+        return api_response({"error": "BLE device did not respond in time"}), 504
 
 @api.route("/chart", methods=["GET"])
 @jwt_required()
 def get_chart():
-    sensor_data = SensorData.query.all()
-    data = [
-        {
-            "timestamp": record.timestamp.isoformat(),
-            "temperature": record.temperature,
-            "humidity": record.humidity,
-        }
-        for record in sensor_data
-    ]
-    plot = create_bar_chart(data, "timestamp", "temperature", "Temperature over Time")
-    script, div = components(plot)
+    """
+    Render a time-axis line chart of one metric over a window.
+    Query params: metric (default temperature), device_id, window (e.g. 15m, 24h, 7d),
+    end (ISO timestamp, default now), points (target points per series),
+    method (lttb or minmax) and live=1 to poll /chart/updates for new points.
+    Rendered components are cached until the series receives new data.
+    """
+    metric = request.args.get("metric", "temperature")
+    device_id = request.args.get("device_id", type=int)
+    method = request.args.get("method", "lttb")
+    if method not in decimation.METHODS:
+        return api_response(False, error=f"Unsupported method: {method}", status_code=400)
+    try:
+        window = parse_duration(request.args.get("window", config.CHART_WINDOW_DEFAULT))
+        end = datetime.fromisoformat(request.args["end"]) if "end" in request.args else None
+    except ValueError as e:
+        return api_response(False, error=str(e), status_code=400)
+    points = clamp_limit(request.args.get("points", type=int), config.CHART_POINTS_DEFAULT, config.CHART_POINTS_MAX)
+    updates_url = url_for("api.get_chart_updates") if request.args.get("live") == "1" else None
+    script, div = charts.render_chart(window, end, metric, device_id, points, method, updates_url)
     return render_template(
         "chart.html",
         script=script,
@@ -108,7 +167,21 @@ def get_chart():
         cdn_css=CDN.css_files[0] if CDN.css_files else None,
     )
 
+@api.route("/chart/updates", methods=["GET"])
+@jwt_required()
+def get_chart_updates():
+    """
+    Points of one series newer than since (epoch ms), for AjaxDataSource polling.
+    """
+    metric = request.args.get("metric", "temperature")
+    device_id = request.args.get("device_id", type=int)
+    since = request.args.get("since", type=int)
+    if since is None:
+        return api_response(False, error="since (epoch milliseconds) is required", status_code=400)
+    return jsonify(charts.fetch_updates(metric, device_id, since, config.CHART_POINTS_MAX))
+
 @api.route('/devices', methods=['GET'])
+@conditional_get(scope=lambda req: DEVICES)
 def get_devices():
     devices = services.fetch_all_devices()
     if devices:
@@ -126,22 +199,22 @@ def discover_and_store_devices():
         return api_response({"error": message}), 500
 
 @api.route('/api/get_device_data/<device_name>', methods=['GET'])
-async def get_device_data(device_name):
+def get_device_data(device_name):
     timestamp = datetime.now()
     try:     
-        data = await services.fetch_device_data(device_name, current_app.config['CHARACTERISTIC_UUID'])
+        data = background_loop.run(
+            services.fetch_device_data(device_name, current_app.config['CHARACTERISTIC_UUID']), config.ASYNC_CALL_TIMEOUT
+        )
         try:
             device = DeviceMetadata.query.filter_by(name=device_name).first()
             if not device:
                 return api_response(success=False, error="Device not found"), 404
             characteristic_uuid = current_app.config['CHARACTERISTIC_UUID']
-            data_raw = None
-            async with BleakClient(device) as client:
-                try:
-                    data_raw = await client.read_gatt_char(characteristic_uuid)
-                except Exception as e:
-                    logger.error(f"Error reading from BLE device: {e}")
-                    return api_response(success=False, error=str(e)), 500
+            try:
+                data_raw = background_loop.run(ble_connections.read(device, characteristic_uuid), config.ASYNC_CALL_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error reading from BLE device: {e}")
+                return api_response(success=False, error=str(e)), 500
             data = extract_data_from_queue(data_raw)
             if not (temperature := data.get('temperature')) or type(temperature) is not float:
                 logger.error("Invalid temperature value")
@@ -150,11 +223,7 @@ async def get_device_data(device_name):
                 logger.error("Invalid humidity value")
                 return api_response(success=False, error="Invalid humidity value"), 400
             try:
-                sensor_data = SensorData(
-                    timestamp=timestamp, temperature=temperature, humidity=humidity
-                )
-                db.session.add(sensor_data)
-                db.session.commit()
+                bulk_writer.write_batch([{"timestamp": timestamp, "temperature": temperature, "humidity": humidity}])
             except Exception as e:
                 return api_response(success=False, error=f"Database error: {str(e)}"), 500
             return api_response(success=True, data=data)
@@ -185,7 +254,7 @@ def add_device_record_route():
     try:
         temperature_value = request.args.get('temperature')
         humidity_value = request.args.get('humidity')
-        services.add_new_device_record(temperature_value, humidity_value)
+        add_new_device_record(temperature_value, humidity_value)
         return api_response({"message": "Record added successfully"}), 200
     except SQLAlchemyError as e:
         log_error(f"Database error: {e}")
@@ -1,16 +1,9 @@
-import asyncio
 from data_ops import connect_to_gateway
+from loop_thread import background_loop
 
-def run_async(func, *args):
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
-        result = new_loop.run_until_complete(func(*args))
-        new_loop.close()
-    else:
-        result = loop.run_until_complete(func(*args))
-    return result
+def run_async(func, *args, timeout=None):
+    """Run func(*args) on the shared background loop and wait up to timeout seconds for its result."""
+    return background_loop.run(func(*args), timeout)
 
 # Usage in services.py
 from async_utils import run_async
@@ -2,7 +2,8 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from flask import current_app
 import logging
 import services 
-from data_ops import fetch_process_and_store_data
+from data_ops import fetch_process_and_store_data, start_sensor_streaming
+from config import config
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +15,9 @@ def validate_discovered_device(device):
 
 def schedule_data_collection():
     try:
+        if config.BLE_COLLECTION_MODE == "notify":
+            start_sensor_streaming()
+            return
         scheduler = BackgroundScheduler()
         scheduler.add_job(fetch_process_and_store_data, "interval", minutes=1)  # Fixed the function reference
         scheduler.start()
@@ -0,0 +1,428 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import logging
+import sys
+import time
+
+from bleak import BleakClient
+
+from config import config
+from loop_thread import background_loop
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONNECTING = "connecting"
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+FAILED = "failed"
+
+
+class SubscriptionLimitReached(Exception):
+    """Raised when another subscription would pin every connection slot."""
+
+
+def device_address(address_or_device):
+    """Normalized MAC address of an address string or a BLEDevice-like object."""
+    return getattr(address_or_device, "address", address_or_device).upper()
+
+
+class DeviceLink:
+    """Connection state and counters of one peripheral."""
+
+    def __init__(self, address):
+        self.address = address
+        self.client = None
+        self.state = DISCONNECTED
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.last_used = None
+        self.connected_at = None
+        self.connects = 0
+        self.drops = 0
+        self.evictions = 0
+        self.failures = 0
+        self.last_error = None
+        self.subscriptions = {}
+        self.resubscriber = None
+
+    def snapshot(self):
+        return {
+            "address": self.address,
+            "state": self.state,
+            "in_use": self.users > 0,
+            "subscriptions": sorted(self.subscriptions),
+            "connected_at": self.connected_at.isoformat() if self.connected_at else None,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+            "connects": self.connects,
+            "drops": self.drops,
+            "evictions": self.evictions,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class BleConnectionManager:
+    """
+    Process-wide pool of BLE links keyed by MAC address.
+    A link stays connected after use, so later reads skip the 1-5 s connect.
+    GATT operations on one link are serialized; different devices run
+    concurrently. At most max_connections links are open at once, which should
+    stay within what the adapter allows: a new device first evicts the least
+    recently used idle link and otherwise waits for one to free up. Links idle
+    for idle_timeout seconds are disconnected, and a link that dropped is
+    reconnected on its next use. Links with notification subscriptions are
+    pinned: they are never evicted, and after a drop they are reconnected and
+    re-subscribed in the background.
+    Everything runs on one event loop, in the app the shared background loop
+    (loop_thread.py). The manager binds to the loop it is first used from; used
+    from another loop, it forgets the links of the old one.
+    :param client_factory: Called as client_factory(address, disconnected_callback=...);
+        BleakClient, or FakeBleakBackend.client to run without radios.
+    """
+
+    def __init__(self, client_factory=BleakClient, max_connections=5, idle_timeout=120.0, connect_timeout=10.0):
+        self.client_factory = client_factory
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._links = {}
+        self._loop = None
+        self._slots = None
+        self._reaper = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        if self._loop is not None:
+            logger.warning(f"BLE connection manager moved to a new event loop; dropping {len(self._links)} links")
+        self._loop = loop
+        self._links = {}
+        self._slots = asyncio.Condition()
+        self._reaper = loop.create_task(self._reap())
+
+    def _link(self, address):
+        link = self._links.get(address)
+        if link is None:
+            link = self._links[address] = DeviceLink(address)
+        return link
+
+    def _open_links(self):
+        return sum(1 for link in self._links.values() if link.state in (CONNECTING, CONNECTED))
+
+    async def _notify_slots(self):
+        async with self._slots:
+            self._slots.notify_all()
+
+    def _on_disconnect(self, link, client):
+        # Bleak calls this for our own disconnects too; those have already detached the client.
+        if link.client is not client:
+            return
+        link.client = None
+        link.state = DISCONNECTED
+        link.drops += 1
+        logger.warning(f"BLE link to {link.address} dropped")
+        self._loop.create_task(self._notify_slots())
+        if link.subscriptions and (link.resubscriber is None or link.resubscriber.done()):
+            link.resubscriber = self._loop.create_task(self._resubscribe(link))
+
+    async def _resubscribe(self, link, delay=1.0):
+        while link.subscriptions and link.client is None and self._links.get(link.address) is link:
+            await asyncio.sleep(delay)
+            if self._loop is not asyncio.get_running_loop():
+                return
+            try:
+                await self.connect(link.address)
+            except Exception as e:
+                delay = min(delay * 2, 60)
+                logger.warning(f"Reconnecting subscribed link {link.address} failed ({e}); retrying in {delay:.0f}s")
+
+    async def _reserve_slot(self, link):
+        async with self._slots:
+            while self._open_links() >= self.max_connections:
+                idle = [
+                    other for other in self._links.values()
+                    if other.state == CONNECTED and other.users == 0 and not other.subscriptions
+                ]
+                if idle:
+                    victim = min(idle, key=lambda other: other.last_used or 0)
+                    victim.evictions += 1
+                    await self._close(victim, f"evicted for {link.address}")
+                    continue
+                await self._slots.wait()
+            link.state = CONNECTING
+
+    async def _close(self, link, reason):
+        client, link.client = link.client, None
+        link.state = DISCONNECTED
+        if client is None:
+            return
+        logger.info(f"Disconnecting BLE link to {link.address} ({reason})")
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting from {link.address}: {e}")
+
+    async def _abandon(self, client):
+        """Drop a client whose connect did not complete and wake the waiters for its slot."""
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.debug(f"Disconnecting an unfinished BLE connect failed: {e}")
+        await self._notify_slots()
+
+    async def _ensure_connected(self, link):
+        if link.client is not None and link.client.is_connected:
+            return link.client
+        if link.state in (CONNECTING, CONNECTED):
+            link.state = DISCONNECTED
+        await self._reserve_slot(link)
+        client = self.client_factory(link.address, disconnected_callback=lambda c: self._on_disconnect(link, c))
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.connect(), self.connect_timeout)
+        except asyncio.CancelledError:
+            # Cancelled by a caller's deadline: give the slot back, or it stays taken for good.
+            link.state = DISCONNECTED
+            await asyncio.shield(self._abandon(client))
+            raise
+        except Exception as e:
+            link.state = FAILED
+            link.failures += 1
+            link.last_error = str(e) or type(e).__name__
+            await asyncio.shield(self._abandon(client))
+            logger.error(f"BLE connect to {link.address} failed: {link.last_error}")
+            raise
+        link.client = client
+        link.state = CONNECTED
+        link.connects += 1
+        link.connected_at = datetime.utcnow()
+        link.last_error = None
+        logger.info(f"Connected to {link.address} in {time.perf_counter() - started:.2f}s (connect #{link.connects})")
+        for characteristic_uuid, callback in link.subscriptions.items():
+            try:
+                await client.start_notify(characteristic_uuid, callback)
+            except Exception as e:
+                logger.error(f"Re-subscribing to {characteristic_uuid} on {link.address} failed: {e}")
+        return client
+
+    @asynccontextmanager
+    async def connection(self, address_or_device):
+        """
+        Connected client of a device, reused across calls:
+            async with ble_connections.connection(address) as client:
+                data = await client.read_gatt_char(uuid)
+        The link is held exclusively inside the block and stays connected after it.
+        """
+        self._bind()
+        link = self._link(device_address(address_or_device))
+        link.users += 1
+        try:
+            async with link.lock:
+                client = await self._ensure_connected(link)
+                link.last_used = time.monotonic()
+                try:
+                    yield client
+                except Exception as e:
+                    link.last_error = str(e) or type(e).__name__
+                    if not client.is_connected and link.client is client:
+                        self._on_disconnect(link, client)
+                    raise
+                finally:
+                    link.last_used = time.monotonic()
+        finally:
+            link.users -= 1
+            await self._notify_slots()
+
+    async def _with_retry(self, address_or_device, operation, retries):
+        address = device_address(address_or_device)
+        for attempt in range(retries + 1):
+            try:
+                async with self.connection(address) as client:
+                    return await operation(client)
+            except Exception as e:
+                link = self._links.get(address)
+                # Only a link that dropped or never came up is worth another attempt.
+                if attempt >= retries or (link is not None and link.state == CONNECTED):
+                    raise
+                logger.warning(f"BLE operation on {address} failed ({e}); reconnecting ({attempt + 1}/{retries})")
+
+    async def connect(self, address_or_device):
+        """Open (or reuse) the link to a device. :return: True once connected."""
+        async with self.connection(address_or_device):
+            return True
+
+    async def read(self, address_or_device, characteristic_uuid, retries=1):
+        """Read a characteristic over the pooled link, reconnecting up to retries times if the link drops."""
+        return await self._with_retry(
+            address_or_device, lambda client: client.read_gatt_char(characteristic_uuid), retries
+        )
+
+    async def write(self, address_or_device, characteristic_uuid, data, response=False, retries=1):
+        return await self._with_retry(
+            address_or_device, lambda client: client.write_gatt_char(characteristic_uuid, data, response), retries
+        )
+
+    async def get_services(self, address_or_device, retries=1):
+        """GATT services of a device, as resolved by the client when it connected."""
+
+        async def services(client):
+            return client.services
+
+        return await self._with_retry(address_or_device, services, retries)
+
+    async def subscribe(self, address_or_device, characteristic_uuid, callback):
+        """
+        Start notifications of a characteristic and pin the link until unsubscribe().
+        At least one connection slot is always left for reads of other devices.
+        :param callback: Called as callback(characteristic, data) on the manager's loop.
+        :raises SubscriptionLimitReached: When every other slot is already pinned.
+        """
+        self._bind()
+        address = device_address(address_or_device)
+        pinned = sum(1 for link in self._links.values() if link.subscriptions and link.address != address)
+        if pinned >= self.max_connections - 1:
+            raise SubscriptionLimitReached(f"{pinned} of {self.max_connections} BLE links already carry subscriptions")
+        async with self.connection(address) as client:
+            await client.start_notify(characteristic_uuid, callback)
+            self._links[address].subscriptions[characteristic_uuid] = callback
+        logger.info(f"Subscribed to {characteristic_uuid} notifications of {address}")
+
+    async def unsubscribe(self, address_or_device, characteristic_uuid):
+        """Stop notifications of a characteristic; the link is unpinned once it has no subscriptions left."""
+        self._bind()
+        link = self._links.get(device_address(address_or_device))
+        if link is None or link.subscriptions.pop(characteristic_uuid, None) is None:
+            return
+        async with link.lock:
+            if link.client is not None and link.client.is_connected:
+                try:
+                    await link.client.stop_notify(characteristic_uuid)
+                except Exception as e:
+                    logger.warning(f"Error stopping notifications of {characteristic_uuid} on {link.address}: {e}")
+
+    async def disconnect(self, address_or_device):
+        self._bind()
+        link = self._links.get(device_address(address_or_device))
+        if link is None:
+            return
+        async with link.lock:
+            await self._close(link, "requested")
+        await self._notify_slots()
+
+    async def evict_idle(self, now=None):
+        """
+        Disconnect links unused for idle_timeout seconds.
+        :return: Number of links closed.
+        """
+        now = time.monotonic() if now is None else now
+        closed = 0
+        for link in list(self._links.values()):
+            if link.subscriptions or link.state != CONNECTED or link.users:
+                continue
+            if now - (link.last_used or 0) >= self.idle_timeout:
+                await self._close(link, f"idle for {now - link.last_used:.0f}s")
+                closed += 1
+        if closed:
+            await self._notify_slots()
+        return closed
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Idle BLE link eviction failed: {e}")
+
+    async def close(self):
+        """Disconnect every link and stop idle eviction."""
+        if self._loop is None:
+            return
+        if self._reaper:
+            self._reaper.cancel()
+        for link in list(self._links.values()):
+            link.subscriptions.clear()
+            await self._close(link, "shutdown")
+        self._loop = None
+
+    def states(self, address=None):
+        """
+        Per-device connection state, safe to call from any thread.
+        :return: List of dicts (address, state, in_use, connected_at, idle_seconds and counters).
+        """
+        links = list(self._links.values())
+        if address is not None:
+            links = [link for link in links if link.address == device_address(address)]
+        return [link.snapshot() for link in links]
+
+
+def create_client_factory(backend):
+    if backend == "fake":
+        from ble_fake import FakeBleakBackend
+        return FakeBleakBackend(max_connections=config.BLE_MAX_CONNECTIONS, auto_create=True).client
+    if backend != "bleak":
+        raise ValueError(f"Unknown BLE backend: {backend}")
+    return BleakClient
+
+
+ble_connections = BleConnectionManager(
+    create_client_factory(config.BLE_BACKEND),
+    max_connections=config.BLE_MAX_CONNECTIONS,
+    idle_timeout=config.BLE_IDLE_TIMEOUT,
+    connect_timeout=config.BLE_CONNECT_TIMEOUT,
+)
+background_loop.add_shutdown_hook(ble_connections.close)
+
+
+def benchmark(reads=60, devices=4, connect_delay=0.5, read_delay=0.02, max_connections=5):
+    """
+    Read devices round-robin against a fake adapter, once with a new client per
+    read (connect, read, disconnect, as the old code paths did) and once
+    through a BleConnectionManager.
+    :return: List of (case, seconds, reads per second, connects).
+    """
+    from ble_fake import FakeBleakBackend
+
+    uuid = "00002a6e-0000-1000-8000-00805f9b34fb"
+    addresses = [f"AA:BB:CC:DD:EE:{i:02X}" for i in range(devices)]
+
+    def backend():
+        fake = FakeBleakBackend(max_connections=max_connections, connect_delay=connect_delay, read_delay=read_delay)
+        for address in addresses:
+            fake.add_device(address, {uuid: b"\x15\x2d"})
+        return fake
+
+    async def per_read(fake):
+        for i in range(reads):
+            async with fake.client(addresses[i % devices]) as client:
+                await client.read_gatt_char(uuid)
+
+    async def pooled(fake):
+        manager = BleConnectionManager(fake.client, max_connections=max_connections)
+        for i in range(reads):
+            await manager.read(addresses[i % devices], uuid)
+        await manager.close()
+
+    results = []
+    for case, run in (("connect per read", per_read), ("pooled", pooled)):
+        fake = backend()
+        started = time.perf_counter()
+        asyncio.run(run(fake))
+        elapsed = time.perf_counter() - started
+        results.append((case, elapsed, reads / elapsed, sum(d.connects for d in fake.devices.values())))
+    return results
+
+
+if __name__ == "__main__":
+    # python ble_connections.py bench [reads] [devices]    fake adapter, no radio needed
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "bench":
+        args = [int(arg) for arg in sys.argv[2:4]]
+        print(f"{'case':<18} {'seconds':>8} {'reads/s':>8} {'connects':>9}")
+        for case, elapsed, rate, connects in benchmark(*args):
+            print(f"{case:<18} {elapsed:>8.2f} {rate:>8.1f} {connects:>9}")
+    else:
+        sys.exit(f"Unknown command: {command}")
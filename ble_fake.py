@@ -0,0 +1,238 @@
+import asyncio
+import itertools
+import logging
+import random
+
+from bleak.exc import BleakError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environmental Sensing service; unknown characteristics of auto-created devices live under it.
+DEFAULT_SERVICE_UUID = "0000181a-0000-1000-8000-00805f9b34fb"
+
+
+def sensor_payload():
+    """Two bytes in the layout get_discovered_data expects: temperature (C), then humidity (%)."""
+    return bytes((random.randint(18, 26), random.randint(35, 65)))
+
+
+class FakeCharacteristic:
+    def __init__(self, uuid, handle, service_uuid, properties=("read", "notify")):
+        self.uuid = uuid
+        self.handle = handle
+        self.service_uuid = service_uuid
+        self.properties = list(properties)
+
+
+class FakeService:
+    def __init__(self, uuid, handle, characteristics):
+        self.uuid = uuid
+        self.handle = handle
+        self.characteristics = characteristics
+
+
+class FakeDevice:
+    """One simulated peripheral: its GATT table, timings and injected faults."""
+
+    def __init__(self, address, characteristics, name=None, connect_delay=0.0, read_delay=0.0,
+                 connect_failures=0, services=None, properties=None):
+        self.address = address
+        self.name = name or f"Fake_{address[-5:].replace(':', '')}"
+        self.values = characteristics
+        self.connect_delay = connect_delay
+        self.read_delay = read_delay
+        self.connect_failures = connect_failures
+        self.connects = 0
+        self.reads = 0
+        self.clients = set()
+        handles = itertools.count(1)
+        properties = properties or {}
+        layout = services or {DEFAULT_SERVICE_UUID: list(self.values)}
+        self.services = []
+        for service_uuid, uuids in layout.items():
+            service_handle = next(handles)
+            self.services.append(FakeService(service_uuid, service_handle, [
+                FakeCharacteristic(uuid, next(handles), service_uuid, properties.get(uuid, ("read", "notify")))
+                for uuid in uuids
+            ]))
+
+    def value(self, uuid):
+        if uuid not in self.values:
+            raise BleakError(f"Characteristic {uuid} was not found!")
+        value = self.values[uuid]
+        return bytearray(value() if callable(value) else value)
+
+
+class FakeBleakBackend:
+    """
+    In-memory stand-in for the BLE adapter and its peripherals, so the connection
+    manager, streaming and polling code can run without radios.
+    Its client() method is a drop-in client factory for BleakClient. The adapter
+    refuses connections past max_connections, like a real controller does.
+    :param auto_create: Unknown addresses connect as devices serving sensor_payload()
+        on every characteristic, which lets the whole app run with BLE_BACKEND=fake.
+    """
+
+    def __init__(self, max_connections=7, auto_create=False, connect_delay=0.0, read_delay=0.0):
+        self.max_connections = max_connections
+        self.auto_create = auto_create
+        self.connect_delay = connect_delay
+        self.read_delay = read_delay
+        self.devices = {}
+        self.pending = 0
+
+    def add_device(self, address, characteristics=None, **options):
+        """
+        Register a peripheral.
+        :param characteristics: Dict of characteristic UUID -> bytes, or a callable returning bytes per read.
+        :param options: name, connect_delay, read_delay, connect_failures (connects to fail first), services
+            or properties (characteristic UUID -> GATT properties, default read and notify).
+        """
+        options.setdefault("connect_delay", self.connect_delay)
+        options.setdefault("read_delay", self.read_delay)
+        device = FakeDevice(address.upper(), {} if characteristics is None else characteristics, **options)
+        self.devices[device.address] = device
+        return device
+
+    def device(self, address):
+        address = address.upper()
+        if address not in self.devices and self.auto_create:
+            self.add_device(address, _AutoValues())
+        return self.devices.get(address)
+
+    def connected(self):
+        return [client for device in self.devices.values() for client in device.clients]
+
+    def drop(self, address):
+        """Simulate link loss: every client of the device disconnects and gets its callback."""
+        device = self.devices[address.upper()]
+        for client in list(device.clients):
+            client._lost()
+
+    async def notify(self, address, uuid, data):
+        """Deliver a notification to every client of the device subscribed to uuid."""
+        for client in list(self.devices[address.upper()].clients):
+            callback = client._subscriptions.get(uuid)
+            if callback is not None:
+                result = callback(client._characteristic(uuid), bytearray(data))
+                if asyncio.iscoroutine(result):
+                    await result
+
+    def client(self, address_or_device, disconnected_callback=None, timeout=10.0, **kwargs):
+        return FakeBleakClient(self, address_or_device, disconnected_callback, timeout)
+
+
+class _AutoValues(dict):
+    """Characteristic table of an auto-created device: every UUID reads as a sensor payload."""
+
+    def __contains__(self, uuid):
+        return True
+
+    def __getitem__(self, uuid):
+        return sensor_payload
+
+
+class FakeBleakClient:
+    """The subset of BleakClient this project uses, served by a FakeBleakBackend."""
+
+    def __init__(self, backend, address_or_device, disconnected_callback=None, timeout=10.0):
+        self.backend = backend
+        self.address = getattr(address_or_device, "address", address_or_device).upper()
+        self._disconnected_callback = disconnected_callback
+        self._timeout = timeout
+        self._connected = False
+        self._subscriptions = {}
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    @property
+    def services(self):
+        return self._device().services
+
+    def _device(self):
+        device = self.backend.device(self.address)
+        if device is None:
+            raise BleakError(f"Device with address {self.address} was not found.")
+        return device
+
+    def _characteristic(self, uuid):
+        for service in self.services:
+            for characteristic in service.characteristics:
+                if characteristic.uuid == uuid:
+                    return characteristic
+        return FakeCharacteristic(uuid, 0, DEFAULT_SERVICE_UUID)
+
+    def _require_connection(self):
+        if not self._connected:
+            raise BleakError("Not connected")
+
+    def _lost(self):
+        if not self._connected:
+            return
+        self._connected = False
+        self._subscriptions.clear()
+        self._device().clients.discard(self)
+        if self._disconnected_callback:
+            self._disconnected_callback(self)
+
+    async def connect(self, **kwargs):
+        device = self._device()
+        if self._connected:
+            return True
+        if len(self.backend.connected()) + self.backend.pending >= self.backend.max_connections:
+            raise BleakError(f"Adapter connection limit ({self.backend.max_connections}) reached")
+        self.backend.pending += 1
+        try:
+            await asyncio.sleep(device.connect_delay)
+            if device.connect_failures:
+                device.connect_failures -= 1
+                raise BleakError(f"Connection to {self.address} failed")
+        finally:
+            self.backend.pending -= 1
+        device.connects += 1
+        device.clients.add(self)
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        self._lost()
+        return True
+
+    async def get_services(self, **kwargs):
+        self._require_connection()
+        return self.services
+
+    async def read_gatt_char(self, char_specifier, **kwargs):
+        self._require_connection()
+        device = self._device()
+        await asyncio.sleep(device.read_delay)
+        # Checked again: the link may drop during the read.
+        self._require_connection()
+        device.reads += 1
+        return device.value(str(getattr(char_specifier, "uuid", char_specifier)))
+
+    async def write_gatt_char(self, char_specifier, data, response=False):
+        self._require_connection()
+        self._device().values[str(getattr(char_specifier, "uuid", char_specifier))] = bytes(data)
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        self._require_connection()
+        uuid = str(getattr(char_specifier, "uuid", char_specifier))
+        self._device().value(uuid)
+        properties = self._characteristic(uuid).properties
+        if "notify" not in properties and "indicate" not in properties:
+            raise BleakError(f"Characteristic {uuid} does not support notifications")
+        self._subscriptions[uuid] = callback
+
+    async def stop_notify(self, char_specifier):
+        self._subscriptions.pop(str(getattr(char_specifier, "uuid", char_specifier)), None)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
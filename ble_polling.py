@@ -0,0 +1,233 @@
+from datetime import datetime
+import asyncio
+import logging
+import statistics
+import sys
+import time
+
+from ble_connections import device_address
+from config import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def device_adapter(device, default="hci0"):
+    """BlueZ adapter (hci0, hci1, ...) a scanned BLEDevice was seen on, or default for plain addresses."""
+    details = getattr(device, "details", None)
+    path = details.get("path") if isinstance(details, dict) else None
+    if isinstance(path, str) and path.startswith("/org/bluez/"):
+        return path.split("/")[3]
+    return default
+
+
+class SweepReport:
+    """Outcome of one sweep: duration, success rate and per-device latency."""
+
+    def __init__(self, started):
+        self.started = started
+        self.duration = 0.0
+        self.results = {}
+        self.latencies = {}
+        self.waits = {}
+        self.attempts = {}
+        self.errors = {}
+        self.timed_out = set()
+
+    @property
+    def devices(self):
+        return len(self.attempts)
+
+    @property
+    def succeeded(self):
+        return len(self.results)
+
+    @property
+    def success_rate(self):
+        return self.succeeded / self.devices if self.devices else 1.0
+
+    def as_dict(self):
+        return {
+            "started": self.started.isoformat(),
+            "duration": round(self.duration, 3),
+            "devices": self.devices,
+            "succeeded": self.succeeded,
+            "success_rate": round(self.success_rate, 3),
+            "timed_out": sorted(self.timed_out),
+            "errors": dict(self.errors),
+            "latency": {address: round(seconds, 3) for address, seconds in self.latencies.items()},
+            "wait": {address: round(seconds, 3) for address, seconds in self.waits.items()},
+            "attempts": dict(self.attempts),
+        }
+
+    def summary(self):
+        text = f"{self.devices} devices in {self.duration:.2f}s: {self.succeeded} ok ({self.success_rate:.0%})"
+        if self.errors:
+            text += f", {len(self.errors)} failed ({len(self.timed_out)} timed out)"
+        if self.latencies:
+            latencies = list(self.latencies.values())
+            slowest = max(self.latencies, key=self.latencies.get)
+            text += f", latency p50 {statistics.median(latencies):.2f}s max {max(latencies):.2f}s ({slowest})"
+        return text
+
+
+class PollScheduler:
+    """
+    Runs one operation against many BLE devices concurrently.
+    At most max_concurrency operations run at once overall and at most
+    adapter_concurrency per adapter, so no adapter is asked for more links than
+    it can hold. Each attempt gets deadline seconds; a device that fails or
+    times out is queued again behind every device still waiting, up to retries
+    times, so a slow or unreachable device only ever holds one slot.
+    Devices are started in fair order: least recently finished first,
+    interleaved across adapters.
+    """
+
+    def __init__(self, max_concurrency=8, adapter_concurrency=5, deadline=10.0, retries=0, default_adapter="hci0"):
+        self.max_concurrency = max_concurrency
+        self.adapter_concurrency = adapter_concurrency
+        self.deadline = deadline
+        self.retries = retries
+        self.default_adapter = default_adapter
+        self.last_report = None
+        self._last_done = {}
+
+    def _order(self, devices):
+        by_adapter = {}
+        for device in sorted(devices, key=lambda device: self._last_done.get(device_address(device), 0.0)):
+            by_adapter.setdefault(device_adapter(device, self.default_adapter), []).append(device)
+        queues = list(by_adapter.values())
+        ordered = []
+        for turn in range(max((len(queue) for queue in queues), default=0)):
+            ordered.extend(queue[turn] for queue in queues if turn < len(queue))
+        return ordered
+
+    async def sweep(self, devices, operation, retries=None, deadline=None):
+        """
+        Run operation(device) once for every device and wait for all of them.
+        :param devices: Addresses or BLEDevice objects; duplicates are polled once.
+        :param operation: Coroutine function taking one device and returning its result.
+        :return: SweepReport with the results of the devices that succeeded.
+        """
+        retries = self.retries if retries is None else retries
+        deadline = self.deadline if deadline is None else deadline
+        unique = {}
+        for device in devices:
+            unique.setdefault(device_address(device), device)
+        report = SweepReport(datetime.utcnow())
+        overall = asyncio.Semaphore(self.max_concurrency)
+        adapters = {}
+        started = time.perf_counter()
+
+        async def run(device):
+            address = device_address(device)
+            adapter = adapters.setdefault(
+                device_adapter(device, self.default_adapter), asyncio.Semaphore(self.adapter_concurrency)
+            )
+            queued = time.perf_counter()
+            for attempt in range(retries + 1):
+                report.attempts[address] = attempt + 1
+                # Adapter first: waiting for the adapter must not hold one of the overall slots.
+                async with adapter:
+                    async with overall:
+                        began = time.perf_counter()
+                        report.waits[address] = began - queued
+                        try:
+                            result = await asyncio.wait_for(operation(device), deadline)
+                        except asyncio.TimeoutError:
+                            report.errors[address] = f"No response within {deadline:g}s"
+                            report.timed_out.add(address)
+                        except Exception as e:
+                            report.errors[address] = str(e) or type(e).__name__
+                            report.timed_out.discard(address)
+                        else:
+                            report.results[address] = result
+                            report.errors.pop(address, None)
+                            report.timed_out.discard(address)
+                            return
+                        finally:
+                            report.latencies[address] = time.perf_counter() - began
+                            self._last_done[address] = time.monotonic()
+                if attempt < retries:
+                    logger.warning(f"Polling {address} failed ({report.errors[address]}); retrying ({attempt + 1}/{retries})")
+                    queued = time.perf_counter()
+                    # Yield so devices already waiting get the slots first.
+                    await asyncio.sleep(0)
+
+        await asyncio.gather(*(run(device) for device in self._order(unique.values())))
+        report.duration = time.perf_counter() - started
+        self.last_report = report
+        level = logging.INFO if not report.errors else logging.WARNING
+        logger.log(level, f"Poll sweep of {report.summary()}")
+        return report
+
+
+poll_scheduler = PollScheduler(
+    max_concurrency=config.BLE_POLL_CONCURRENCY,
+    adapter_concurrency=config.BLE_ADAPTER_CONCURRENCY,
+    deadline=config.BLE_POLL_DEADLINE,
+    retries=config.BLE_POLL_RETRIES,
+)
+if config.BLE_POLL_DEADLINE <= config.BLE_CONNECT_TIMEOUT:
+    logger.warning(
+        f"BLE_POLL_DEADLINE ({config.BLE_POLL_DEADLINE:g}s) does not exceed BLE_CONNECT_TIMEOUT "
+        f"({config.BLE_CONNECT_TIMEOUT:g}s); slow connects will be cut off by the poll deadline"
+    )
+
+
+def benchmark(devices=40, connect_delay=0.5, read_delay=0.05, slow=2, max_connections=5):
+    """
+    Read fake devices, a few of which never answer, once one at a time with
+    three tries each (as the old discovery walk did) and once through a
+    PollScheduler with a 2 s deadline and one retry.
+    :return: List of (case, seconds, devices ok, devices).
+    """
+    from ble_connections import BleConnectionManager
+    from ble_fake import FakeBleakBackend
+
+    uuid = "00002a6e-0000-1000-8000-00805f9b34fb"
+    addresses = [f"AA:BB:CC:DD:{i // 256:02X}:{i % 256:02X}" for i in range(devices)]
+
+    def backend():
+        fake = FakeBleakBackend(max_connections=max_connections, connect_delay=connect_delay, read_delay=read_delay)
+        for i, address in enumerate(addresses):
+            fake.add_device(address, {uuid: b"\x15\x2d"}, read_delay=30.0 if i < slow else read_delay)
+        return fake
+
+    async def serial(fake):
+        ok = 0
+        for address in addresses:
+            for _ in range(3):
+                try:
+                    async with fake.client(address) as client:
+                        await asyncio.wait_for(client.read_gatt_char(uuid), 2)
+                    ok += 1
+                    break
+                except Exception:
+                    continue
+        return ok
+
+    async def scheduled(fake):
+        manager = BleConnectionManager(fake.client, max_connections=max_connections, connect_timeout=5)
+        scheduler = PollScheduler(max_concurrency=8, adapter_concurrency=max_connections, deadline=2.0, retries=1)
+        report = await scheduler.sweep(addresses, lambda address: manager.read(address, uuid, retries=0))
+        await manager.close()
+        return report.succeeded
+
+    results = []
+    for case, run in (("serial walk", serial), ("scheduler", scheduled)):
+        started = time.perf_counter()
+        ok = asyncio.run(run(backend()))
+        results.append((case, time.perf_counter() - started, ok, devices))
+    return results
+
+
+if __name__ == "__main__":
+    # python ble_polling.py bench [devices]    fake adapter, no radio needed
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "bench":
+        print(f"{'case':<12} {'seconds':>8} {'ok':>5} {'devices':>8}")
+        for case, elapsed, ok, total in benchmark(*[int(arg) for arg in sys.argv[2:3]]):
+            print(f"{case:<12} {elapsed:>8.2f} {ok:>5} {total:>8}")
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -0,0 +1,315 @@
+from collections import deque
+from datetime import datetime
+from functools import partial
+import asyncio
+import logging
+import statistics
+import sys
+import time
+
+from ble_connections import device_address
+from ble_polling import PollScheduler
+from loop_thread import background_loop
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NOTIFY = "notify"
+POLL = "poll"
+
+
+def decode_sensor_payload(data):
+    """Temperature (C) and humidity (%) from the two-byte payload the sensors send."""
+    if len(data) < 2:
+        raise ValueError(f"Unexpected payload length {len(data)}")
+    return {"temperature": float(data[0]), "humidity": float(data[1])}
+
+
+def characteristic_properties(services, characteristic_uuid):
+    """GATT properties of a characteristic in a client's service table, or None if it is not listed."""
+    for service in services or ():
+        for characteristic in service.characteristics:
+            if str(characteristic.uuid).lower() == characteristic_uuid.lower():
+                return set(characteristic.properties)
+    return None
+
+
+class DeviceStream:
+    """Collection mode and counters of one device."""
+
+    def __init__(self, address, device_id=None):
+        self.address = address
+        self.device_id = device_id
+        self.mode = None
+        self.notify_supported = None
+        self.notifications = 0
+        self.polls = 0
+        self.decode_errors = 0
+        self.last_received = None
+        self.last_error = None
+
+    def snapshot(self):
+        return {
+            "address": self.address,
+            "device_id": self.device_id,
+            "mode": self.mode,
+            "notifications": self.notifications,
+            "polls": self.polls,
+            "decode_errors": self.decode_errors,
+            "last_received": self.last_received.isoformat() if self.last_received else None,
+            "last_error": self.last_error,
+        }
+
+
+class NotificationStream:
+    """
+    Sensor collection over GATT notifications instead of periodic reads.
+    Each device is subscribed once to the sensor characteristic through the
+    connection manager, which pins the link and re-subscribes after a drop.
+    Every notification becomes a reading stamped with its receive time and its
+    device; readings of all devices are coalesced and handed to submit in
+    batches of up to max_batch readings, at most max_delay seconds after the
+    first one arrived. Devices whose characteristic has no notify/indicate
+    property, or that cannot be subscribed, are read every poll_interval
+    seconds instead, in concurrent sweeps of the poll scheduler.
+    start() runs it on the shared background loop, next to the pooled links.
+    :param submit: Blocking callable taking a list of readings, e.g. ingest_pipeline.submit_batch.
+        If it raises, the batch is kept and retried; at most max_buffered readings are held.
+    """
+
+    def __init__(self, manager, submit, characteristic_uuid, decode=decode_sensor_payload,
+                 max_batch=200, max_delay=0.5, poll_interval=10.0, max_buffered=10000, scheduler=None):
+        self.manager = manager
+        self.submit = submit
+        self.characteristic_uuid = characteristic_uuid
+        self.decode = decode
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.max_buffered = max_buffered
+        self.scheduler = scheduler or PollScheduler()
+        self._devices = {}
+        self._buffer = deque()
+        self._loop = None
+        self._tasks = []
+        self._wake = None
+        self._full = None
+        self._counters = {"readings": 0, "batches": 0, "submitted": 0, "submit_errors": 0, "dropped": 0}
+
+    def start(self, devices):
+        """
+        Open the stream if needed and add devices, from any thread.
+        :param devices: Dict of MAC address -> device id (or None).
+        :return: concurrent.futures.Future resolved with {address: mode} once every device is set up.
+        """
+        return background_loop.submit(self._start(devices))
+
+    async def _start(self, devices):
+        if not self.is_running():
+            await self.open()
+            logger.info(f"BLE notification stream started on {self.characteristic_uuid}")
+        return await self.add_devices(devices)
+
+    def is_running(self):
+        return bool(self._tasks)
+
+    def stop(self, timeout=10):
+        """Unsubscribe every device and hand buffered readings to submit."""
+        if self.is_running():
+            background_loop.run(self.aclose(), timeout)
+            logger.info(f"BLE notification stream stopped: {self.stats()}")
+
+    async def open(self):
+        """Start the flush and poll tasks on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._tasks = [self._loop.create_task(self._flusher()), self._loop.create_task(self._poller())]
+
+    async def aclose(self):
+        for stream in list(self._devices.values()):
+            await self.remove_device(stream.address)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._buffer:
+            if not await self._submit_next():
+                break
+
+    async def add_devices(self, devices):
+        modes = await asyncio.gather(*(self.add_device(address, device_id) for address, device_id in devices.items()))
+        return dict(zip((device_address(address) for address in devices), modes))
+
+    async def add_device(self, address, device_id=None):
+        """
+        Subscribe to a device, or poll it when it cannot notify.
+        Devices already streaming, or known not to support notify, are left as they are.
+        :return: The device's mode, "notify" or "poll".
+        """
+        address = device_address(address)
+        stream = self._devices.get(address)
+        if stream is None:
+            stream = self._devices[address] = DeviceStream(address, device_id)
+        stream.device_id = device_id if device_id is not None else stream.device_id
+        if stream.mode == NOTIFY or stream.notify_supported is False:
+            return stream.mode
+        try:
+            async with self.manager.connection(address) as client:
+                properties = characteristic_properties(client.services, self.characteristic_uuid)
+            if properties is not None and not properties & {"notify", "indicate"}:
+                stream.notify_supported = False
+                stream.mode = POLL
+                logger.info(f"{address} cannot notify {self.characteristic_uuid}; polling it every {self.poll_interval}s")
+                return stream.mode
+            await self.manager.subscribe(address, self.characteristic_uuid, partial(self._on_notification, stream))
+            stream.mode = NOTIFY
+        except Exception as e:
+            stream.last_error = str(e) or type(e).__name__
+            stream.mode = POLL
+            logger.warning(f"Subscribing to {address} failed ({stream.last_error}); polling it instead")
+        return stream.mode
+
+    async def remove_device(self, address):
+        stream = self._devices.pop(device_address(address), None)
+        if stream is not None and stream.mode == NOTIFY:
+            await self.manager.unsubscribe(stream.address, self.characteristic_uuid)
+
+    def _on_notification(self, stream, characteristic, data):
+        stream.notifications += 1
+        self._ingest(stream, data)
+
+    def _ingest(self, stream, data):
+        received = datetime.utcnow()
+        stream.last_received = received
+        try:
+            values = self.decode(data)
+        except Exception as e:
+            stream.decode_errors += 1
+            stream.last_error = f"Undecodable payload: {e}"
+            logger.warning(f"Dropped payload from {stream.address}: {e}")
+            return
+        reading = {"timestamp": received.isoformat(), "device_address": stream.address, **values}
+        if stream.device_id is not None:
+            reading["device_id"] = stream.device_id
+        if len(self._buffer) >= self.max_buffered:
+            self._buffer.popleft()
+            self._counters["dropped"] += 1
+        self._buffer.append(reading)
+        self._counters["readings"] += 1
+        self._wake.set()
+        if len(self._buffer) >= self.max_batch:
+            self._full.set()
+
+    async def _flusher(self):
+        while True:
+            await self._wake.wait()
+            # Hold the first reading up to max_delay so other devices' readings share its write.
+            if len(self._buffer) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            self._full.clear()
+            while self._buffer:
+                if not await self._submit_next():
+                    await asyncio.sleep(1)
+
+    async def _submit_next(self):
+        batch = [self._buffer.popleft() for _ in range(min(self.max_batch, len(self._buffer)))]
+        try:
+            await self._loop.run_in_executor(None, self.submit, batch)
+        except Exception as e:
+            self._counters["submit_errors"] += 1
+            logger.warning(f"Submitting {len(batch)} BLE readings failed ({e}); will retry")
+            self._buffer.extendleft(reversed(batch))
+            while len(self._buffer) > self.max_buffered:
+                self._buffer.popleft()
+                self._counters["dropped"] += 1
+            return False
+        self._counters["batches"] += 1
+        self._counters["submitted"] += len(batch)
+        return True
+
+    async def _poller(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            polled = {stream.address: stream for stream in self._devices.values() if stream.mode == POLL}
+            if not polled:
+                continue
+            report = await self.scheduler.sweep(polled, lambda address: self._poll(polled[address]))
+            for address, error in report.errors.items():
+                polled[address].last_error = error
+
+    async def _poll(self, stream):
+        data = await self.manager.read(stream.address, self.characteristic_uuid)
+        stream.polls += 1
+        self._ingest(stream, data)
+
+    def stats(self):
+        """Counters and per-device modes, safe to call from any thread."""
+        stats = dict(self._counters)
+        stats["buffered"] = len(self._buffer)
+        stats["running"] = self.is_running()
+        stats["devices"] = [stream.snapshot() for stream in list(self._devices.values())]
+        return stats
+
+
+def benchmark(devices=20, seconds=3.0, rate=5.0, read_delay=0.05, max_connections=32):
+    """
+    Collect from fake devices that produce rate readings per second, once by
+    notification and once by polling each device at the same rate.
+    :return: List of (mode, readings, write batches, GATT reads, median and max
+        seconds from arrival to submit).
+    """
+    from ble_connections import BleConnectionManager
+    from ble_fake import FakeBleakBackend, sensor_payload
+
+    uuid = "00002a6e-0000-1000-8000-00805f9b34fb"
+    addresses = [f"AA:BB:CC:DD:{i // 256:02X}:{i % 256:02X}" for i in range(devices)]
+
+    async def run(mode):
+        fake = FakeBleakBackend(max_connections=max_connections, read_delay=read_delay)
+        properties = ("read", "notify") if mode == NOTIFY else ("read",)
+        for address in addresses:
+            fake.add_device(address, {uuid: sensor_payload}, properties={uuid: properties})
+        manager = BleConnectionManager(fake.client, max_connections=max_connections)
+        latencies = []
+        batches = []
+
+        def submit(batch):
+            now = datetime.utcnow()
+            batches.append(len(batch))
+            latencies.extend((now - datetime.fromisoformat(reading["timestamp"])).total_seconds() for reading in batch)
+
+        stream = NotificationStream(manager, submit, uuid, poll_interval=1 / rate)
+        await stream.open()
+        await stream.add_devices({address: i for i, address in enumerate(addresses)})
+        deadline = time.monotonic() + seconds
+        if mode == NOTIFY:
+            while time.monotonic() < deadline:
+                for address in addresses:
+                    await fake.notify(address, uuid, sensor_payload())
+                await asyncio.sleep(1 / rate)
+        else:
+            await asyncio.sleep(seconds)
+        await stream.aclose()
+        await manager.close()
+        reads = sum(device.reads for device in fake.devices.values())
+        return mode, sum(batches), len(batches), reads, statistics.median(latencies), max(latencies)
+
+    return [asyncio.run(run(mode)) for mode in (NOTIFY, POLL)]
+
+
+if __name__ == "__main__":
+    # python ble_streaming.py bench [devices] [seconds]    fake adapter, no radio needed
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "bench":
+        args = [int(sys.argv[2])] if len(sys.argv) > 2 else []
+        args += [float(sys.argv[3])] if len(sys.argv) > 3 else []
+        print(f"{'mode':<7} {'readings':>9} {'batches':>8} {'reads':>7} {'p50 s':>7} {'max s':>7}")
+        for mode, readings, batches, reads, median, worst in benchmark(*args):
+            print(f"{mode:<7} {readings:>9} {batches:>8} {reads:>7} {median:>7.3f} {worst:>7.3f}")
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -0,0 +1,384 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import case, create_engine, func, insert, select
+
+from config import config
+from database import db_session_scope
+from gorilla import decode_block, encode_block
+from metric_dictionary import metric_dictionary
+from models import Device, Metric, SensorBlock, SensorData, SensorSample
+from ring_buffers import EPOCH, to_micros
+from samples import SAMPLE_METRICS
+from watermarks import ALL, ingest_watermarks
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Blocks hold one series within one span-aligned window, so every point of a block
+# lies within SPAN_US of its start. The span may grow once blocks exist, never shrink.
+SPAN_US = config.BLOCK_SPAN_SECONDS * 1_000_000
+DELETE_CHUNK = 500
+# Long-shape id of a compacted reading: -(BLOCK_ID_BASE + block id * BLOCK_ID_SLOTS + index in block).
+# Below every sample id, so (timestamp, id) stays unique across raw rows, samples and blocks.
+BLOCK_ID_BASE = 2 ** 62
+BLOCK_ID_SLOTS = 2 ** 24
+
+# A compacted reading shaped like the rows of samples.reading_selects.
+BlockRow = namedtuple("BlockRow", "id timestamp device_id metric_id value")
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=int(micros))
+
+
+def _series_filter(query, device_id, metric_id):
+    query = query.filter(SensorData.device_id.is_(None) if device_id is None else SensorData.device_id == device_id)
+    return query.filter(SensorData.metric_id.is_(None) if metric_id is None else SensorData.metric_id == metric_id)
+
+
+def compact(older_than=None):
+    """
+    Move raw readings older than older_than into Gorilla-encoded blocks, one
+    block per series (device, metric and unit) and span-aligned window. Each window is written and
+    its raw rows deleted in one transaction. Sample rows are split into one
+    block per sample metric. The newest reading of every series stays raw, so
+    last-value and latest-timestamp lookups keep working on the raw tables
+    alone. Readings arriving late for a compacted window end up in an extra
+    block on the next run.
+    :param older_than: Naive UTC cutoff; defaults to COMPACT_AFTER_DAYS ago.
+    :return: Tuple of (blocks written, points compacted).
+    """
+    if older_than is None:
+        older_than = datetime.utcnow() - timedelta(days=config.COMPACT_AFTER_DAYS)
+    with db_session_scope(readonly=True) as session:
+        series = (
+            session.query(SensorData.device_id, SensorData.metric_id, func.max(SensorData.timestamp))
+            .group_by(SensorData.device_id, SensorData.metric_id)
+            .having(func.min(SensorData.timestamp) < older_than)
+            .all()
+        )
+        # Newest timestamp per sample column, so no column loses its newest reading.
+        sample_devices = (
+            session.query(SensorSample.device_id, *[
+                func.max(case((getattr(SensorSample, metric).isnot(None), SensorSample.timestamp)))
+                for metric in SAMPLE_METRICS
+            ])
+            .group_by(SensorSample.device_id)
+            .having(func.min(SensorSample.timestamp) < older_than)
+            .all()
+        )
+    blocks = points = 0
+    for device_id, metric_id, newest in series:
+        written, compacted = _compact_series(device_id, metric_id, min(older_than, newest))
+        blocks += written
+        points += compacted
+    for device_id, *newest in sample_devices:
+        cutoff = min([older_than, *(timestamp for timestamp in newest if timestamp is not None)])
+        written, compacted = _compact_samples(device_id, cutoff)
+        blocks += written
+        points += compacted
+    if blocks:
+        # Readings left the raw table; listings over it must not be served from stale ETags.
+        ingest_watermarks.bump([ALL])
+    logger.info(
+        f"Compacted {points} readings of {len(series)} series and {len(sample_devices)} sample devices "
+        f"into {blocks} blocks"
+    )
+    return blocks, points
+
+
+def _compact_series(device_id, metric_id, cutoff):
+    metric, unit = metric_dictionary.lookup(metric_id)
+    blocks = points = 0
+    while True:
+        with db_session_scope() as session:
+            first = _series_filter(
+                session.query(func.min(SensorData.timestamp)), device_id, metric_id
+            ).filter(SensorData.timestamp < cutoff).scalar()
+            if first is None:
+                return blocks, points
+            window_start = to_micros(first) // SPAN_US * SPAN_US
+            window_end = min(from_micros(window_start + SPAN_US), cutoff)
+            rows = _series_filter(
+                session.query(SensorData.id, SensorData.timestamp, SensorData.value), device_id, metric_id
+            ).filter(
+                SensorData.timestamp >= from_micros(window_start), SensorData.timestamp < window_end
+            ).order_by(SensorData.timestamp, SensorData.id).all()
+
+            timestamps = np.array([to_micros(r.timestamp) for r in rows], dtype=np.int64)
+            values = np.array([np.nan if r.value is None else r.value for r in rows], dtype=np.float64)
+            session.add(SensorBlock(
+                device_id=device_id, metric=metric, unit=unit,
+                start_us=int(timestamps[0]), end_us=int(timestamps[-1]), count=len(rows),
+                data=encode_block(timestamps, values),
+            ))
+            ids = [r.id for r in rows]
+            for i in range(0, len(ids), DELETE_CHUNK):
+                session.query(SensorData).filter(SensorData.id.in_(ids[i:i + DELETE_CHUNK])).delete(
+                    synchronize_session=False
+                )
+        blocks += 1
+        points += len(rows)
+
+
+def _compact_samples(device_id, cutoff):
+    device_filter = SensorSample.device_id.is_(None) if device_id is None else SensorSample.device_id == device_id
+    blocks = points = 0
+    while True:
+        with db_session_scope() as session:
+            first = session.query(func.min(SensorSample.timestamp)).filter(
+                device_filter, SensorSample.timestamp < cutoff
+            ).scalar()
+            if first is None:
+                return blocks, points
+            window_start = to_micros(first) // SPAN_US * SPAN_US
+            window_end = min(from_micros(window_start + SPAN_US), cutoff)
+            rows = session.query(
+                SensorSample.id, SensorSample.timestamp, *[getattr(SensorSample, metric) for metric in SAMPLE_METRICS]
+            ).filter(
+                device_filter, SensorSample.timestamp >= from_micros(window_start), SensorSample.timestamp < window_end
+            ).order_by(SensorSample.timestamp, SensorSample.id).all()
+
+            timestamps = np.array([to_micros(r.timestamp) for r in rows], dtype=np.int64)
+            for metric, unit in SAMPLE_METRICS.items():
+                values = np.array([getattr(r, metric) for r in rows], dtype=np.float64)
+                present = ~np.isnan(values)
+                if not present.any():
+                    continue
+                session.add(SensorBlock(
+                    device_id=device_id, metric=metric, unit=unit,
+                    start_us=int(timestamps[present][0]), end_us=int(timestamps[present][-1]),
+                    count=int(present.sum()), data=encode_block(timestamps[present], values[present]),
+                ))
+                blocks += 1
+                points += int(present.sum())
+            ids = [r.id for r in rows]
+            for i in range(0, len(ids), DELETE_CHUNK):
+                session.query(SensorSample).filter(SensorSample.id.in_(ids[i:i + DELETE_CHUNK])).delete(
+                    synchronize_session=False
+                )
+
+
+def overlapping_blocks(session, start_us, end_us, device_id=None, metric=None):
+    """Query of blocks with points in [start_us, end_us], ordered by start."""
+    query = session.query(
+        SensorBlock.device_id, SensorBlock.metric, SensorBlock.unit, SensorBlock.start_us, SensorBlock.data
+    ).filter(
+        SensorBlock.start_us > start_us - SPAN_US,
+        SensorBlock.start_us <= end_us,
+        SensorBlock.end_us >= start_us,
+    )
+    if device_id is not None:
+        query = query.filter(SensorBlock.device_id == device_id)
+    if metric is not None:
+        query = query.filter(SensorBlock.metric == metric)
+    return query.order_by(SensorBlock.start_us, SensorBlock.id)
+
+
+def _clip(data, start_us, end_us):
+    timestamps, values = decode_block(data)
+    lo = int(np.searchsorted(timestamps, start_us, side="left"))
+    hi = int(np.searchsorted(timestamps, end_us, side="right"))
+    return timestamps[lo:hi], values[lo:hi]
+
+
+def _columns(blocks, start_us, end_us):
+    parts = []
+    for block in blocks:
+        timestamps, values = _clip(block.data, start_us, end_us)
+        if len(timestamps):
+            parts.append((block, timestamps, values))
+    if not parts:
+        return {
+            "timestamp_us": np.empty(0, dtype=np.int64),
+            "device_id": np.empty(0, dtype=np.int64),
+            "metric": np.empty(0, dtype=object),
+            "unit": np.empty(0, dtype=object),
+            "value": np.empty(0, dtype=np.float64),
+        }
+    columns = {
+        "timestamp_us": np.concatenate([t for _, t, _ in parts]),
+        "device_id": np.concatenate([
+            np.full(len(t), -1 if b.device_id is None else b.device_id, dtype=np.int64) for b, t, _ in parts
+        ]),
+        "metric": np.concatenate([np.full(len(t), b.metric, dtype=object) for b, t, _ in parts]),
+        "unit": np.concatenate([np.full(len(t), b.unit, dtype=object) for b, t, _ in parts]),
+        "value": np.concatenate([v for _, _, v in parts]),
+    }
+    order = np.argsort(columns["timestamp_us"], kind="stable")
+    return {name: values[order] for name, values in columns.items()}
+
+
+def block_columns(session, start_us, end_us, device_id=None, metric=None):
+    """
+    Compacted readings with start_us <= timestamp <= end_us, sorted by time.
+    :return: Dict with timestamp_us (int64), device_id (int64, -1 for none),
+        metric and unit (object) and value (float64, NaN for none) arrays.
+    """
+    return _columns(overlapping_blocks(session, start_us, end_us, device_id, metric), start_us, end_us)
+
+
+def iter_block_rows(session, start_us, end_us, device_id=None, metric=None, yield_per=100):
+    """
+    Stream compacted readings in [start_us, end_us] oldest first, decoding one
+    span window of blocks at a time so memory stays bounded by a single window.
+    :return: Generator of (timestamp, device_id, metric, value, unit) tuples.
+    """
+    window, pending = None, []
+
+    def flush():
+        columns = _columns(pending, start_us, end_us)
+        timestamps = columns["timestamp_us"].astype("datetime64[us]").tolist()
+        for timestamp, device, metric_name, value, unit in zip(
+            timestamps, columns["device_id"].tolist(), columns["metric"].tolist(),
+            columns["value"].tolist(), columns["unit"].tolist(),
+        ):
+            yield timestamp, None if device < 0 else device, metric_name, None if value != value else value, unit
+
+    for block in overlapping_blocks(session, start_us, end_us, device_id, metric).yield_per(yield_per):
+        if block.start_us // SPAN_US != window and pending:
+            yield from flush()
+            pending = []
+        window = block.start_us // SPAN_US
+        pending.append(block)
+    if pending:
+        yield from flush()
+
+
+def seek_block_rows(session, limit, timestamp=None, row_id=None, direction="next"):
+    """
+    Keyset seeker over compacted readings for pagination.merged_keyset_page:
+    readings past the (timestamp, row_id) position, newest first for "next"
+    and oldest first for "prev". Decodes one span window of blocks at a time
+    and stops at the first window boundary once limit readings are found.
+    :return: List of at most limit BlockRow tuples in page order.
+    """
+    newer = direction == "prev"
+    query = session.query(
+        SensorBlock.id, SensorBlock.device_id, SensorBlock.metric, SensorBlock.unit, SensorBlock.start_us, SensorBlock.data
+    )
+    position = None
+    if timestamp is not None:
+        position = (to_micros(timestamp), row_id)
+        if newer:
+            query = query.filter(SensorBlock.start_us > position[0] - SPAN_US)
+        else:
+            query = query.filter(SensorBlock.start_us <= position[0])
+    if newer:
+        query = query.order_by(SensorBlock.start_us.asc(), SensorBlock.id.asc())
+    else:
+        query = query.order_by(SensorBlock.start_us.desc(), SensorBlock.id.desc())
+
+    found, window = [], None
+    for block in query.yield_per(100):
+        if block.start_us // SPAN_US != window:
+            # Every point of a block lies in its window, so later windows are all past the ones read.
+            if len(found) >= limit:
+                break
+            window = block.start_us // SPAN_US
+        timestamps, values = decode_block(block.data)
+        metric_id = metric_dictionary.find_id(block.metric, block.unit)
+        for index, (micros, value) in enumerate(zip(timestamps.tolist(), values.tolist())):
+            key = (micros, -(BLOCK_ID_BASE + block.id * BLOCK_ID_SLOTS + index))
+            if position is not None and (key <= position if newer else key >= position):
+                continue
+            found.append((key, block.device_id, metric_id, None if value != value else value))
+    found.sort(key=lambda point: point[0], reverse=not newer)
+    return [
+        BlockRow(point_id, from_micros(micros), device_id, metric_id, value)
+        for (micros, point_id), device_id, metric_id, value in found[:limit]
+    ]
+
+
+def benchmark(points=200_000, series=10, interval_s=10):
+    """
+    Compare the raw sensor_data table with compacted blocks on a scratch SQLite
+    database: bytes per point on disk (tables and indexes, after VACUUM) and
+    points per second for a full scan into timestamp/value arrays.
+    :return: List of (case, bytes per point, points per second).
+    """
+    rng = np.random.default_rng(0)
+    per_series = points // series
+    start_us = to_micros(datetime(2024, 1, 1))
+    jitter = rng.integers(-200_000, 200_000, per_series)
+    timestamps = start_us + np.arange(per_series, dtype=np.int64) * interval_s * 1_000_000 + jitter
+    path = os.path.join(tempfile.mkdtemp(), "blocks-bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    SensorData.metadata.create_all(
+        engine, tables=[Device.__table__, Metric.__table__, SensorData.__table__, SensorBlock.__table__]
+    )
+
+    datetimes = timestamps.astype("datetime64[us]").tolist()
+    with engine.begin() as connection:
+        connection.execute(insert(Metric), [{"id": 1, "name": "temperature", "unit": "C"}])
+        for device_id in range(series):
+            values = np.round(21 + np.cumsum(rng.normal(0, 0.05, per_series)), 1)
+            connection.execute(insert(SensorData), [
+                {"timestamp": t, "value": v, "metric_id": 1, "device_id": device_id}
+                for t, v in zip(datetimes, values.tolist())
+            ])
+            bounds = [0, *(np.flatnonzero(np.diff(timestamps // SPAN_US)) + 1).tolist(), per_series]
+            connection.execute(insert(SensorBlock), [
+                {"device_id": device_id, "metric": "temperature", "unit": "C",
+                 "start_us": int(timestamps[lo]), "end_us": int(timestamps[hi - 1]), "count": hi - lo,
+                 "data": encode_block(timestamps[lo:hi], values[lo:hi])}
+                for lo, hi in zip(bounds, bounds[1:])
+            ])
+
+    def table_bytes(connection, tables):
+        sizes = connection.exec_driver_sql(
+            "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"
+        ).all()
+        return sum(size for name, size in sizes if any(name == t or name.startswith(f"ix_{t}") for t in tables))
+
+    results = []
+    with engine.connect() as connection:
+        connection.exec_driver_sql("VACUUM")
+        try:
+            raw_bytes = table_bytes(connection, ["sensor_data"])
+            block_bytes = table_bytes(connection, ["sensor_blocks"])
+        except Exception:
+            # SQLite built without dbstat: fall back to the payload size of the blocks alone.
+            raw_bytes = None
+            block_bytes = connection.execute(select(func.sum(func.length(SensorBlock.data)))).scalar()
+        total = per_series * series
+
+        started = time.perf_counter()
+        rows = connection.execute(select(SensorData.timestamp, SensorData.value).order_by(
+            SensorData.device_id, SensorData.metric_id, SensorData.timestamp
+        )).all()
+        np.array([to_micros(r[0]) for r in rows], dtype=np.int64)
+        np.array([r[1] for r in rows], dtype=np.float64)
+        results.append(("raw rows", raw_bytes / total if raw_bytes else None, total / (time.perf_counter() - started)))
+
+        started = time.perf_counter()
+        decoded = 0
+        for (data,) in connection.execute(select(SensorBlock.data).order_by(SensorBlock.start_us)):
+            decoded += len(decode_block(data)[0])
+        assert decoded == total
+        results.append(("gorilla blocks", block_bytes / total, total / (time.perf_counter() - started)))
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    # python blocks.py compact            move readings older than COMPACT_AFTER_DAYS into blocks
+    # python blocks.py bench [points]     bytes per point and scan throughput on a scratch database
+    command = sys.argv[1] if len(sys.argv) > 1 else "compact"
+    if command == "compact":
+        compact()
+    elif command == "bench":
+        total_points = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+        print(f"{'case':<16} {'bytes/point':>12} {'points/s':>14}")
+        for case, size, rate in benchmark(total_points):
+            print(f"{case:<16} {'n/a' if size is None else f'{size:.2f}':>12} {rate:>14,.0f}")
+    else:
+        sys.exit(f"Unknown command: {command}")
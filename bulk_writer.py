@@ -0,0 +1,248 @@
+from datetime import datetime, timezone
+import logging
+import queue
+import threading
+import time
+
+from database import db_session_scope
+from metric_dictionary import metric_dictionary
+from models import SensorData, SensorSample
+from samples import SAMPLE_METRICS, split_rows
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metrics carried as top-level keys on a reading and the unit stored with them.
+# These are the sensor_samples columns, so such readings are stored one row per sample.
+METRIC_UNITS = SAMPLE_METRICS
+
+_FLUSH = object()
+_STOP = object()
+
+
+def reading_to_mappings(reading):
+    """
+    Expand one reading into SensorData insert mappings, one row per metric.
+    :param reading: Dict with a timestamp and either metric/value or temperature/humidity keys.
+    :return: List of dicts suitable for bulk_insert_mappings.
+    """
+    timestamp = reading.get("timestamp") or datetime.utcnow()
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    # Stored as epoch milliseconds; truncate here so listeners see what the database holds.
+    timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+    device_id = reading.get("device_id")
+    rows = []
+    if "metric" in reading and reading.get("value") is not None:
+        rows.append({
+            "timestamp": timestamp,
+            "device_id": device_id,
+            "metric": reading["metric"],
+            "unit": reading.get("unit"),
+            "value": float(reading["value"]),
+        })
+    for metric, unit in METRIC_UNITS.items():
+        if reading.get(metric) is not None:
+            rows.append({
+                "timestamp": timestamp,
+                "device_id": device_id,
+                "metric": metric,
+                "unit": unit,
+                "value": float(reading[metric]),
+            })
+    return rows
+
+
+class BulkWriter:
+    """
+    Drains readings from a queue and writes them in batches.
+    A batch is flushed when it reaches max_batch_size rows or when its oldest
+    row has waited max_delay seconds, whichever comes first. Each batch is
+    written inside one transaction: sample metrics as one sensor_samples row
+    per device and timestamp, everything else as sensor_data rows. Listeners
+    always see the long SensorData mappings.
+    """
+
+    def __init__(self, max_batch_size=500, max_delay=0.2, max_pending=10000):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue(max_pending)
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._listeners = []
+        self._commit_listeners = []
+        self._stats = {
+            "batches": 0,
+            "rows": 0,
+            "failed_batches": 0,
+            "failed_rows": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def add_listener(self, listener):
+        """
+        Register a callable run as listener(session, rows) inside every write transaction,
+        after the rows are inserted. An exception from a listener rolls the batch back.
+        """
+        self._listeners.append(listener)
+
+    def add_commit_listener(self, listener):
+        """
+        Register a callable run as listener(rows) after every committed batch.
+        Meant for in-memory views of fresh data; exceptions are logged and do not affect the write.
+        """
+        self._commit_listeners.append(listener)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="bulk-writer", daemon=True)
+            self._thread.start()
+            logger.info(f"Bulk writer started (batch={self.max_batch_size}, delay={self.max_delay}s)")
+
+    def submit(self, reading, timeout=None):
+        """
+        Queue a reading for the next batch.
+        Blocks for up to timeout seconds when the pending queue is full and raises queue.Full after that.
+        """
+        if self._closed:
+            raise RuntimeError("Bulk writer is closed")
+        self.start()
+        # A reading's rows travel together so its sample is not split across batches.
+        rows = reading_to_mappings(reading)
+        if rows:
+            self._queue.put(rows, timeout=timeout)
+
+    def write_batch(self, readings):
+        """
+        Write a group of readings immediately in one transaction, bypassing the queue.
+        :return: Number of rows written.
+        """
+        rows = []
+        for reading in readings:
+            rows.extend(reading_to_mappings(reading))
+        return self.write_rows(rows)
+
+    def write_rows(self, rows):
+        """Write already expanded SensorData mappings immediately in one transaction."""
+        if rows:
+            self._write(rows, raise_errors=True)
+        return len(rows)
+
+    def flush(self, timeout=None):
+        """
+        Write everything queued so far and wait until it is committed.
+        :return: False if that did not happen within timeout seconds.
+        """
+        if not self._thread or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((_FLUSH, done), timeout=timeout)
+        except queue.Full:
+            logger.warning(f"Bulk writer flush not queued within {timeout}s; {self._queue.qsize()} readings pending.")
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5):
+        """Flush pending rows and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread and self._thread.is_alive():
+            try:
+                self._queue.put((_STOP, None), timeout=timeout)
+            except queue.Full:
+                logger.warning(f"Bulk writer stop not queued within {timeout}s; {self._queue.qsize()} readings pending.")
+                return
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"Bulk writer did not stop within {timeout}s; {self._queue.qsize()} readings pending.")
+        logger.info(f"Bulk writer closed: {self.stats()}")
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = stats["rows"] / stats["batches"] if stats["batches"] else 0.0
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["batches"] if stats["batches"] else 0.0
+        stats["pending"] = self.pending()
+        return stats
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple) and item[0] in (_FLUSH, _STOP):
+                marker, done = item
+                if batch:
+                    self._write(batch)
+                    batch, deadline = [], None
+                if marker is _STOP:
+                    return
+                done.set()
+                continue
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.max_delay
+                batch.extend(item)
+            if batch and (len(batch) >= self.max_batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _write(self, rows, raise_errors=False):
+        started = time.perf_counter()
+        try:
+            with self._write_lock:
+                # New metric ids are committed on their own before the batch transaction starts.
+                samples, long_rows = split_rows(rows)
+                stored = metric_dictionary.to_storage(long_rows)
+                with db_session_scope() as session:
+                    if samples:
+                        session.bulk_insert_mappings(SensorSample, samples)
+                    if stored:
+                        session.bulk_insert_mappings(SensorData, stored)
+                    for listener in self._listeners:
+                        listener(session, rows)
+        except Exception as e:
+            logger.error(f"Bulk write of {len(rows)} rows failed: {e}")
+            with self._stats_lock:
+                self._stats["failed_batches"] += 1
+                self._stats["failed_rows"] += len(rows)
+            if raise_errors:
+                raise
+            return False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["rows"] += len(rows)
+            self._stats["last_batch_size"] = len(rows)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(rows))
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+            self._stats["total_flush_ms"] += elapsed_ms
+        logger.debug(f"Flushed {len(rows)} rows in {elapsed_ms:.1f} ms")
+        for listener in self._commit_listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                logger.error(f"Commit listener {getattr(listener, '__name__', listener)} failed: {e}")
+        return True
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import logging
+import threading
+
+import numpy as np
+from bokeh.embed import components
+
+from config import config
+from sensor_service import fetch_sensor_data_columns
+from visualization import create_line_chart
+from watermarks import ALL, device_scope, ingest_watermarks
+import decimation
+import rollups
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Read rollups when they still give this many input points per output point,
+# so decimation has real shape to pick from without scanning raw rows.
+OVERSAMPLE = 8
+
+
+class RenderCache:
+    """
+    Thread-safe LRU cache of rendered chart components.
+    Bounded by entry count and by the total size of the cached script and div strings.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def entry_size(value):
+        return sum(len(part) for part in value)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.entry_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self.entry_size(old)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self.entry_size(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+render_cache = RenderCache(config.CHART_CACHE_MAX_BYTES, config.CHART_CACHE_MAX_ENTRIES)
+
+
+def series_label(device):
+    return f"device {device}" if device >= 0 else "unassigned"
+
+
+def load_series(start, end, metric, device_id=None, points=1500, method="lttb"):
+    """
+    Load one metric over a window and decimate it per device.
+    Long windows are read from the finest rollup that keeps about
+    points * OVERSAMPLE input points; short ones from raw rows.
+    :return: Tuple of (list of (device, x epoch ms, y) with device -1 for none, rollup resolution or None).
+    """
+    resolution = rollups.choose_resolution(start, end, max_points=points * OVERSAMPLE)
+    if resolution:
+        columns = rollups.fetch_rollup_columns(start, end, resolution, device_id, metric)
+        timestamps = columns["t"] * 1000
+        values = columns["avg"]
+        if method == "minmax":
+            # Each bucket contributes its extremes; let min/max decimation pick among them.
+            timestamps = np.repeat(timestamps, 2)
+            values = np.column_stack((columns["min"], columns["max"])).ravel()
+            devices = np.repeat(columns["device_id"], 2)
+        else:
+            devices = columns["device_id"]
+    else:
+        columns = fetch_sensor_data_columns(start, end, device_id, metric)
+        timestamps, values, devices = columns["timestamp_ms"], columns["value"], columns["device_id"]
+
+    series = []
+    for device in np.unique(devices):
+        mask = devices == device
+        x, y = decimation.decimate(timestamps[mask], values[mask], points, method)
+        series.append((int(device), x, y))
+    logger.info(
+        f"Chart series for {metric}: {len(timestamps)} input points from "
+        f"{f'{resolution}s rollups' if resolution else 'raw rows'}, {sum(len(x) for _, x, _ in series)} plotted"
+    )
+    return series, resolution
+
+
+def build_chart(start, end, metric, device_id=None, points=1500, method="lttb", updates_url=None):
+    """
+    Build the time-series line chart figure for a window.
+    :param updates_url: Base URL of the incremental updates endpoint; when given, each
+        device line polls it for points newer than the last one drawn.
+    """
+    series, _ = load_series(start, end, metric, device_id, points, method)
+    update_urls = None
+    if updates_url:
+        start_ms = rollups.to_epoch(start) * 1000
+        update_urls = [
+            f"{updates_url}?" + urlencode({
+                "metric": metric,
+                "device_id": device,
+                "since": int(x[-1]) if len(x) else start_ms,
+            }) if device >= 0 else None
+            for device, x, _ in series
+        ]
+    return create_line_chart(
+        [(series_label(device), x, y) for device, x, y in series],
+        f"{metric.capitalize()} over time",
+        y_label=metric,
+        update_urls=update_urls,
+        polling_interval=config.CHART_POLL_INTERVAL_MS,
+        max_size=points,
+    )
+
+
+def render_chart(window, end, metric, device_id=None, points=1500, method="lttb", updates_url=None):
+    """
+    Rendered (script, div) components for a chart, served from render_cache while
+    the ingest watermark of its device is unchanged. The watermark moves on every
+    committed write, so backfilled readings older than the newest one invalidate
+    the entry too. Without shared watermarks every call renders.
+    :param window: Window length in seconds.
+    :param end: Window end, or None for a window ending now. "Now" is rounded up to a
+        whole plotted-point step so polls within one step share a cache entry.
+    """
+    if end is None:
+        step = max(window // points, 1)
+        now = rollups.to_epoch(datetime.utcnow())
+        end = rollups.from_epoch(-(-now // step) * step)
+    key = None
+    if ingest_watermarks.shared:
+        mark = ingest_watermarks.get(ALL if device_id is None else device_scope(device_id))
+        key = (device_id, metric, window, end, points, method, updates_url, mark)
+        cached = render_cache.get(key)
+        if cached is not None:
+            return cached
+    plot = build_chart(end - timedelta(seconds=window), end, metric, device_id, points, method, updates_url)
+    rendered = components(plot)
+    if key is not None:
+        render_cache.put(key, rendered)
+    return rendered
+
+
+def fetch_updates(metric, device_id, since_ms, max_points):
+    """
+    Points of one series newer than since_ms, oldest first, decimated to max_points.
+    :return: Dict with x (epoch ms) and y lists, the shape AjaxDataSource appends.
+    """
+    start = rollups.EPOCH + timedelta(milliseconds=since_ms + 1)
+    columns = fetch_sensor_data_columns(start, datetime.max, device_id, metric)
+    x, y = decimation.decimate(columns["timestamp_ms"], columns["value"], max_points, "lttb")
+    return {"x": x.tolist(), "y": y.tolist()}
@@ -0,0 +1,178 @@
+import json
+import struct
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON_MIMETYPE = "application/json"
+PACKED_MIMETYPE = "application/vnd.iotserver.columns"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# Packed column layout, version 1. Everything is little-endian.
+#
+#   header       <4sHHQI   magic b"IOTC", version, column count, row count, metadata length
+#   metadata     UTF-8 JSON object, metadata length bytes
+#   descriptors  per column: <BB type code and name length, then the UTF-8 name
+#   padding      zero bytes up to a multiple of 8, so numeric columns are 8-byte aligned
+#   columns      in descriptor order:
+#                  INT64      row count int64 values
+#                  FLOAT64    row count float64 values, NaN for missing
+#                  DICTIONARY <I entry count, per entry <H length and UTF-8 bytes,
+#                             then row count int32 codes (-1 for missing),
+#                             then zero padding up to a multiple of 8
+MAGIC = b"IOTC"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQI")
+DESCRIPTOR = struct.Struct("<BB")
+ENTRY = struct.Struct("<H")
+COUNT = struct.Struct("<I")
+INT64, FLOAT64, DICTIONARY = 1, 2, 3
+
+
+def offered_mimetypes():
+    """Response types the read endpoints can produce, JSON first so it wins for */*."""
+    offered = [JSON_MIMETYPE, PACKED_MIMETYPE]
+    if pa is not None:
+        offered.append(ARROW_MIMETYPE)
+    return offered
+
+
+def negotiate(accept_mimetypes):
+    """
+    Pick the response type for a request.
+    :param accept_mimetypes: werkzeug MIMEAccept from request.accept_mimetypes.
+    """
+    return accept_mimetypes.best_match(offered_mimetypes(), default=JSON_MIMETYPE)
+
+
+def column_type(values):
+    kind = values.dtype.kind
+    if kind in "iub":
+        return INT64
+    if kind == "f":
+        return FLOAT64
+    return DICTIONARY
+
+
+def _pad(size):
+    return b"\0" * (-size % 8)
+
+
+def dictionary_encode(values):
+    """:return: Tuple of (list of distinct strings, int32 codes with -1 for None)."""
+    present = np.fromiter((v is not None for v in values), dtype=bool, count=len(values))
+    codes = np.full(len(values), -1, dtype=np.int32)
+    if not present.any():
+        return [], codes
+    entries, inverse = np.unique(values[present].astype(str), return_inverse=True)
+    codes[present] = inverse
+    return entries.tolist(), codes
+
+
+def encode_packed(columns, metadata=None):
+    """
+    Encode equal-length column arrays into the packed layout.
+    :param columns: Dict of name -> NumPy array (numeric, or object for strings).
+    """
+    rows = len(next(iter(columns.values()))) if columns else 0
+    meta = json.dumps(metadata or {}, separators=(",", ":")).encode("utf-8")
+    parts = [HEADER.pack(MAGIC, VERSION, len(columns), rows, len(meta)), meta]
+    for name, values in columns.items():
+        encoded = name.encode("utf-8")
+        parts.append(DESCRIPTOR.pack(column_type(values), len(encoded)) + encoded)
+    size = sum(len(p) for p in parts)
+    parts.append(_pad(size))
+    for values in columns.values():
+        kind = column_type(values)
+        if kind == INT64:
+            parts.append(values.astype("<i8", copy=False).tobytes())
+        elif kind == FLOAT64:
+            parts.append(values.astype("<f8", copy=False).tobytes())
+        else:
+            entries, codes = dictionary_encode(values)
+            blob = [COUNT.pack(len(entries))]
+            for entry in entries:
+                data = entry.encode("utf-8")
+                blob.append(ENTRY.pack(len(data)) + data)
+            blob.append(codes.astype("<i4", copy=False).tobytes())
+            blob = b"".join(blob)
+            parts.append(blob + _pad(len(blob)))
+    return b"".join(parts)
+
+
+def decode_packed(buffer):
+    """
+    Decode a packed payload, mainly for clients and tests.
+    Numeric columns are zero-copy views of buffer; dictionary columns are object arrays.
+    :return: Tuple of (dict of name -> array, metadata dict).
+    """
+    magic, version, ncols, rows, meta_len = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a packed column payload (magic={magic!r}, version={version})")
+    offset = HEADER.size
+    metadata = json.loads(bytes(buffer[offset:offset + meta_len]).decode("utf-8"))
+    offset += meta_len
+    descriptors = []
+    for _ in range(ncols):
+        kind, name_len = DESCRIPTOR.unpack_from(buffer, offset)
+        offset += DESCRIPTOR.size
+        descriptors.append((kind, bytes(buffer[offset:offset + name_len]).decode("utf-8")))
+        offset += name_len
+    offset += -offset % 8
+    columns = {}
+    for kind, name in descriptors:
+        if kind in (INT64, FLOAT64):
+            dtype = "<i8" if kind == INT64 else "<f8"
+            columns[name] = np.frombuffer(buffer, dtype=dtype, count=rows, offset=offset)
+            offset += rows * 8
+            continue
+        start = offset
+        (count,) = COUNT.unpack_from(buffer, offset)
+        offset += COUNT.size
+        entries = []
+        for _ in range(count):
+            (length,) = ENTRY.unpack_from(buffer, offset)
+            offset += ENTRY.size
+            entries.append(bytes(buffer[offset:offset + length]).decode("utf-8"))
+            offset += length
+        codes = np.frombuffer(buffer, dtype="<i4", count=rows, offset=offset)
+        offset += rows * 4
+        offset += -(offset - start) % 8
+        lookup = np.array(entries + [None], dtype=object)
+        columns[name] = lookup[codes]
+    return columns, metadata
+
+
+def encode_arrow(columns, metadata=None):
+    """Encode column arrays as an Arrow IPC stream. Requires pyarrow."""
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+    arrays = []
+    for values in columns.values():
+        kind = column_type(values)
+        if kind == DICTIONARY:
+            arrays.append(pa.array(values, type=pa.string(), from_pandas=True).dictionary_encode())
+        elif kind == FLOAT64:
+            arrays.append(pa.array(values, mask=np.isnan(values)))
+        else:
+            arrays.append(pa.array(values))
+    schema = pa.schema(
+        [pa.field(name, array.type) for name, array in zip(columns, arrays)],
+        metadata={"metadata": json.dumps(metadata or {})},
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+    return sink.getvalue().to_pybytes()
+
+
+def encode(columns, mimetype, metadata=None):
+    if mimetype == ARROW_MIMETYPE:
+        return encode_arrow(columns, metadata)
+    if mimetype == PACKED_MIMETYPE:
+        return encode_packed(columns, metadata)
+    raise ValueError(f"Unsupported columnar type: {mimetype}")
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+import functools
+import hashlib
+
+from flask import Response, make_response, request
+
+from config import config
+from serializers import available_encodings
+from watermarks import ALL, ingest_watermarks, device_scope
+
+
+def scope_from_device_arg(req):
+    """Watermark scope for endpoints filtered by an optional device_id argument."""
+    device_id = req.args.get("device_id", type=int)
+    return ALL if device_id is None else device_scope(device_id)
+
+
+def range_end_arg(req):
+    """End of the range an endpoint was asked for, from the end argument, or None."""
+    try:
+        return datetime.fromisoformat(req.args["end"])
+    except (KeyError, ValueError):
+        return None
+
+
+def make_etag(*parts):
+    return hashlib.blake2b("|".join(str(p) for p in parts).encode(), digest_size=16).hexdigest()
+
+
+def conditional_get(scope=lambda req: ALL, range_end=None):
+    """
+    Answer If-None-Match / If-Modified-Since from an ingest watermark, with 304
+    before the view runs.
+    The ETag covers the full path, the Accept header and the watermark of the
+    scope. A range ending more than HTTP_CLOSED_RANGE_GRACE seconds ago is
+    treated as closed: its ETag ignores the watermark and the response may be
+    cached publicly for HTTP_CLOSED_RANGE_MAX_AGE seconds. Open ranges get no
+    validators at all when the watermarks are not shared by every worker.
+    :param scope: Callable(request) -> watermark scope.
+    :param range_end: Optional callable(request) -> end datetime (naive UTC) of the requested range.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            end = range_end(request) if range_end else None
+            closed = end is not None and end < datetime.utcnow() - timedelta(seconds=config.HTTP_CLOSED_RANGE_GRACE)
+            if not closed and not ingest_watermarks.shared:
+                # Another worker's writes would not move this process's mark; never answer 304.
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.no_cache = True
+                return response
+            if closed:
+                mark = None
+                last_modified = end.replace(tzinfo=timezone.utc)
+            else:
+                mark = ingest_watermarks.get(scope(request))
+                last_modified = datetime.fromtimestamp(mark / 1_000_000, tz=timezone.utc)
+            etag = make_etag(request.full_path, request.headers.get("Accept", ""), mark)
+
+            matched = None
+            if request.if_none_match:
+                # Compressed responses carry the encoding as an ETag suffix.
+                variants = [etag] + [f"{etag}-{encoding}" for encoding in available_encodings()]
+                matched = next((tag for tag in variants if request.if_none_match.contains(tag)), None)
+                not_modified = matched is not None
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and last_modified.replace(microsecond=0) <= since
+            response = Response(status=304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(matched or etag)
+                response.last_modified = last_modified
+                response.vary.add("Accept")
+                if closed:
+                    response.cache_control.public = True
+                    response.cache_control.max_age = config.HTTP_CLOSED_RANGE_MAX_AGE
+                else:
+                    response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -11,10 +11,118 @@ class Config:
     PORT = 8080
     DEVICE_NAME = None
     TARGET_MAC_ADDRESS = None
-    CHARACTERISTIC_UUID = None
+    CHARACTERISTIC_UUID = os.environ.get('CHARACTERISTIC_UUID')
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
     CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', ["http://localhost:3000"])
     LOGGING_LEVEL = logging.INFO
+    # Applied to every SQLite connection. The writer connection also switches the file to WAL,
+    # which lets the read-only reader pool run while a write is in progress.
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    }
+    SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE', 4))
+    # SensorData rows are written in batches of up to BULK_WRITER_BATCH_SIZE rows
+    # or every BULK_WRITER_MAX_DELAY seconds, whichever comes first.
+    BULK_WRITER_BATCH_SIZE = int(os.environ.get('BULK_WRITER_BATCH_SIZE', 500))
+    BULK_WRITER_MAX_DELAY = float(os.environ.get('BULK_WRITER_MAX_DELAY', 0.2))
+    BULK_WRITER_MAX_PENDING = int(os.environ.get('BULK_WRITER_MAX_PENDING', 10000))
+    # Batch ingest is rate limited per reading rather than per request.
+    BATCH_MAX_READINGS = int(os.environ.get('BATCH_MAX_READINGS', 10000))
+    BATCH_READINGS_RATE_LIMIT = os.environ.get('BATCH_READINGS_RATE_LIMIT', "30000 per minute")
+    # In-process ingest pipeline: workers per stage and capacity of each stage queue.
+    INGEST_STAGE_CONCURRENCY = {"decode": 1, "validate": 2, "enrich": 2, "persist": 1}
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 1000))
+    INGEST_PERSIST_BATCH_SIZE = int(os.environ.get('INGEST_PERSIST_BATCH_SIZE', 500))
+    INGEST_RETRY_AFTER = int(os.environ.get('INGEST_RETRY_AFTER', 1))
+    # Crash-safe spool in front of the database. When enabled, ingest acknowledges a
+    # reading once it is appended to the spool and a replayer bulk-loads it later.
+    # Each process needs its own SPOOL_DIR.
+    SPOOL_ENABLED = os.environ.get('SPOOL_ENABLED', 'false').lower() == 'true'
+    SPOOL_DIR = os.environ.get('SPOOL_DIR', 'spool')
+    SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))
+    SPOOL_FSYNC = os.environ.get('SPOOL_FSYNC', 'true').lower() == 'true'
+    SPOOL_USE_MMAP = os.environ.get('SPOOL_USE_MMAP', 'false').lower() == 'true'
+    SPOOL_REPLAY_BATCH_SIZE = int(os.environ.get('SPOOL_REPLAY_BATCH_SIZE', 5000))
+    SPOOL_REPLAY_INTERVAL = float(os.environ.get('SPOOL_REPLAY_INTERVAL', 0.5))
+    INGEST_ACK_TIMEOUT = float(os.environ.get('INGEST_ACK_TIMEOUT', 5))
+    AGGREGATE_MAX_BUCKETS = int(os.environ.get('AGGREGATE_MAX_BUCKETS', 10000))
+    # Cursor pagination page sizes for sensor data listings.
+    PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', 10))
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 500))
+    # Streaming export: rows fetched per cursor round trip, rows per response chunk, gzip level.
+    EXPORT_YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', 5000))
+    EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 1000))
+    EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', 6))
+    # /api/chart window and decimation defaults.
+    CHART_WINDOW_DEFAULT = os.environ.get('CHART_WINDOW_DEFAULT', '24h')
+    CHART_POINTS_DEFAULT = int(os.environ.get('CHART_POINTS_DEFAULT', 1500))
+    CHART_POINTS_MAX = int(os.environ.get('CHART_POINTS_MAX', 5000))
+    CHART_POLL_INTERVAL_MS = int(os.environ.get('CHART_POLL_INTERVAL_MS', 5000))
+    # Rendered chart components cache, bounded by total size and entry count.
+    CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    CHART_CACHE_MAX_ENTRIES = int(os.environ.get('CHART_CACHE_MAX_ENTRIES', 256))
+    # Last-value cache for /latest_data: "local" (per process) or "redis" (shared by all workers).
+    LAST_VALUE_BACKEND = os.environ.get('LAST_VALUE_BACKEND', 'local')
+    LAST_VALUE_REDIS_URL = os.environ.get('LAST_VALUE_REDIS_URL', 'redis://localhost:6379/1')
+    # Ingest watermarks behind ETag/Last-Modified; use "redis" when several processes write.
+    INGEST_WATERMARK_BACKEND = os.environ.get('INGEST_WATERMARK_BACKEND', LAST_VALUE_BACKEND)
+    INGEST_WATERMARK_REDIS_URL = os.environ.get('INGEST_WATERMARK_REDIS_URL', LAST_VALUE_REDIS_URL)
+    # Processes serving the app (e.g. gunicorn workers). Local watermarks only see their own
+    # process's writes, so with more than one, conditional GET, the chart cache and the
+    # recent-window rings are bypassed.
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))
+    # Ranges ending longer ago than the grace period are treated as immutable and cacheable.
+    HTTP_CLOSED_RANGE_GRACE = int(os.environ.get('HTTP_CLOSED_RANGE_GRACE', 3600))
+    HTTP_CLOSED_RANGE_MAX_AGE = int(os.environ.get('HTTP_CLOSED_RANGE_MAX_AGE', 86400))
+    # JSON encoder behind jsonify: "auto" (orjson when installed), "orjson" or "json".
+    JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'auto')
+    # Responses of at least COMPRESS_MIN_BYTES are brotli/gzip encoded when the client accepts it.
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+    # In-memory rings of recent readings per (device, metric), float32 values.
+    # Memory is bounded by RECENT_WINDOW_MAX_SERIES * RECENT_WINDOW_CAPACITY * 12 bytes.
+    RECENT_WINDOW_SECONDS = int(os.environ.get('RECENT_WINDOW_SECONDS', 1800))
+    RECENT_WINDOW_CAPACITY = int(os.environ.get('RECENT_WINDOW_CAPACITY', 4096))
+    RECENT_WINDOW_MAX_SERIES = int(os.environ.get('RECENT_WINDOW_MAX_SERIES', 1000))
+    # Raw readings older than COMPACT_AFTER_DAYS move into compressed blocks of BLOCK_SPAN_SECONDS.
+    BLOCK_SPAN_SECONDS = int(os.environ.get('BLOCK_SPAN_SECONDS', 3600))
+    COMPACT_AFTER_DAYS = float(os.environ.get('COMPACT_AFTER_DAYS', 7))
+    COMPACT_INTERVAL_SECONDS = int(os.environ.get('COMPACT_INTERVAL_SECONDS', 3600))
+    # Seconds before metric name -> id filters reread the metrics dictionary table.
+    METRIC_DICTIONARY_TTL = int(os.environ.get('METRIC_DICTIONARY_TTL', 60))
+    # Pooled BLE links (ble_connections.py). BLE_BACKEND is "bleak", or "fake" to run without radios.
+    # Keep BLE_MAX_CONNECTIONS within what the adapter supports (BlueZ controllers often allow 5-7).
+    BLE_BACKEND = os.environ.get('BLE_BACKEND', 'bleak')
+    BLE_MAX_CONNECTIONS = int(os.environ.get('BLE_MAX_CONNECTIONS', 5))
+    BLE_IDLE_TIMEOUT = float(os.environ.get('BLE_IDLE_TIMEOUT', 120))
+    BLE_CONNECT_TIMEOUT = float(os.environ.get('BLE_CONNECT_TIMEOUT', 10))
+    # Sensor collection: "poll" reads CHARACTERISTIC_UUID on a schedule, "notify" subscribes once per
+    # device and streams notifications (ble_streaming.py); devices that cannot notify are polled
+    # every BLE_POLL_INTERVAL seconds. Notifications are written in batches of up to
+    # BLE_NOTIFY_BATCH_SIZE readings, at most BLE_NOTIFY_MAX_DELAY seconds after arrival.
+    BLE_COLLECTION_MODE = os.environ.get('BLE_COLLECTION_MODE', 'poll')
+    BLE_POLL_INTERVAL = float(os.environ.get('BLE_POLL_INTERVAL', 10))
+    BLE_NOTIFY_BATCH_SIZE = int(os.environ.get('BLE_NOTIFY_BATCH_SIZE', 200))
+    BLE_NOTIFY_MAX_DELAY = float(os.environ.get('BLE_NOTIFY_MAX_DELAY', 0.5))
+    # Concurrent polling sweeps (ble_polling.py): operations in flight overall and per adapter,
+    # seconds each attempt may take, and how often a failed device is queued again.
+    # An attempt on a device without a pooled link includes the connect, so the deadline
+    # must leave room for BLE_CONNECT_TIMEOUT plus the read itself.
+    BLE_POLL_CONCURRENCY = int(os.environ.get('BLE_POLL_CONCURRENCY', 8))
+    BLE_ADAPTER_CONCURRENCY = int(os.environ.get('BLE_ADAPTER_CONCURRENCY', BLE_MAX_CONNECTIONS))
+    BLE_POLL_DEADLINE = float(os.environ.get('BLE_POLL_DEADLINE', BLE_CONNECT_TIMEOUT + 20))
+    BLE_POLL_RETRIES = int(os.environ.get('BLE_POLL_RETRIES', 1))
+    # Seconds a route or job waits for a coroutine on the shared background loop (loop_thread.py).
+    ASYNC_CALL_TIMEOUT = float(os.environ.get('ASYNC_CALL_TIMEOUT', 30))
+    # Seconds a cached GATT table (gatt_cache.py) is trusted before the device's
+    # Database Hash / Firmware Revision is checked again.
+    GATT_CACHE_TTL = float(os.environ.get('GATT_CACHE_TTL', 86400))
 
 # Development Configuration
 class DevelopmentConfig(Config):
@@ -26,11 +134,20 @@ class DevelopmentConfig(Config):
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('PROD_SQLALCHEMY_DATABASE_URI', "sqlite:///sensor_data_prod.db")
     LOGGING_LEVEL = logging.INFO
+    SQLITE_PRAGMAS = dict(
+        Config.SQLITE_PRAGMAS,
+        busy_timeout=10000,
+        cache_size=-64000,
+        mmap_size=256 * 1024 * 1024,
+        wal_autocheckpoint=2000,
+    )
+    SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE', 8))
     
 # Testing Configuration
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_SQLALCHEMY_DATABASE_URI', "sqlite:///sensor_data_test.db")
+    SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS, synchronous="OFF")
 
 # Dynamically set the configuration based on the ENVIRONMENT variable
 environment = os.environ.get('ENVIRONMENT', 'development')
@@ -1,16 +1,26 @@
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 import datetime
 import logging
+import json
 
 logger = logging.getLogger(__name__)
 MAX_QUEUE_SIZE = 1000 
 data_queue = Queue(MAX_QUEUE_SIZE)
+queue_stats = {"queued": 0, "dropped": 0}
 
-def add_to_queue(data):
-    if data_queue.qsize() < MAX_QUEUE_SIZE:
-        data_queue.put(data)
-    else:
-        logger.warning("Data queue is full. Consider processing data or increasing queue size.")
+def add_to_queue(data, timeout=1):
+    """
+    Put data on the shared queue, waiting up to timeout seconds for room.
+    :return: True if queued, False if the queue stayed full (counted in queue_stats["dropped"]).
+    """
+    try:
+        data_queue.put(data, timeout=timeout)
+        queue_stats["queued"] += 1
+        return True
+    except Full:
+        queue_stats["dropped"] += 1
+        logger.warning(f"Data queue is full; dropped item ({queue_stats['dropped']} dropped so far).")
+        return False
 
 def get_from_queue():
     try:
@@ -52,3 +62,60 @@ def validate_data(data):
     if "value" in data and not isinstance(data["value"], (int, float)):
         return False
     return True
+
+def validate_reading(item):
+    """
+    Validate and normalize a single reading from an ingest request.
+    :param item: Decoded JSON object for one reading.
+    :return: Tuple of (reading, None) when valid or (None, error message) when not.
+    """
+    if not isinstance(item, dict):
+        return None, "Reading must be a JSON object"
+    reading = {}
+    timestamp = item.get("timestamp")
+    if timestamp is None:
+        reading["timestamp"] = datetime.datetime.utcnow().isoformat()
+    else:
+        try:
+            reading["timestamp"] = datetime.datetime.fromisoformat(str(timestamp)).isoformat()
+        except ValueError:
+            return None, "Invalid timestamp format"
+    if item.get("device_id") is not None:
+        if not isinstance(item["device_id"], int) or isinstance(item["device_id"], bool):
+            return None, "device_id must be an integer"
+        reading["device_id"] = item["device_id"]
+    if item.get("device_address"):
+        reading["device_address"] = str(item["device_address"])
+    has_value = False
+    for field in ("temperature", "humidity", "value"):
+        if field in item:
+            value = item[field]
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return None, f"{field} must be a number"
+            reading[field] = value
+            has_value = True
+    if "value" in reading:
+        if not item.get("metric"):
+            return None, "metric is required with value"
+        reading["metric"] = str(item["metric"])
+        if item.get("unit") is not None:
+            reading["unit"] = str(item["unit"])
+    if not has_value:
+        return None, "Reading has no temperature, humidity or value"
+    return reading, None
+
+def iter_ndjson(lines):
+    """
+    Decode newline-delimited JSON lazily.
+    Yields the decoded object for each non-blank line, or a ValueError instance for lines that fail to parse.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
@@ -1,12 +1,24 @@
 from database import db_session_scope
-from models import SensorData
+from models import Device, SensorData
 from utils import is_data_valid
 from data_helpers import extract_data, process_data, data_queue
-from config import CELERY_BROKER_URL
+from config import CELERY_BROKER_URL, config
+from bulk_writer import BulkWriter
+from ingest_pipeline import IngestPipeline
+from spool import Spool, SpoolReplayer
+import rollups
+from last_values import last_value_cache
+from watermarks import ingest_watermarks
+from ring_buffers import recent_window
+from ble_connections import ble_connections
+from ble_streaming import NotificationStream
+from ble_polling import poll_scheduler
+from loop_thread import background_loop
 from __init__ import create_app
 
 import logging
-import threading
+import atexit
+from functools import partial
 from bleak import BleakScanner, BleakClient
 from datetime import datetime
 import queue
@@ -17,27 +29,82 @@ from flask import current_app
 from flask import copy_current_request_context
 from celery import Celery
 
-db_write_lock = threading.Lock()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 app = create_app()
 
 celery_app = Celery('data_ops', broker=CELERY_BROKER_URL)  # Use the imported broker URL
 
+bulk_writer = BulkWriter(
+    max_batch_size=config.BULK_WRITER_BATCH_SIZE,
+    max_delay=config.BULK_WRITER_MAX_DELAY,
+    max_pending=config.BULK_WRITER_MAX_PENDING,
+)
+bulk_writer.add_listener(rollups.apply_rows)
+bulk_writer.add_commit_listener(last_value_cache.apply_rows)
+
+
+def publish_committed(rows):
+    """Commit listener: bump the ingest watermarks, then fill the recent-window rings with the new marks."""
+    recent_window.apply_rows(rows, ingest_watermarks.apply_rows(rows))
+
+
+bulk_writer.add_commit_listener(publish_committed)
+
+spool = None
+spool_replayer = None
+persist_readings = bulk_writer.write_batch
+if config.SPOOL_ENABLED:
+    spool = Spool(
+        config.SPOOL_DIR,
+        segment_bytes=config.SPOOL_SEGMENT_BYTES,
+        fsync=config.SPOOL_FSYNC,
+        use_mmap=config.SPOOL_USE_MMAP,
+    )
+    spool_replayer = SpoolReplayer(
+        spool,
+        load=bulk_writer.write_rows,
+        batch_size=config.SPOOL_REPLAY_BATCH_SIZE,
+        interval=config.SPOOL_REPLAY_INTERVAL,
+    )
+    spool_replayer.start()
+    persist_readings = spool.append
+
+ingest_pipeline = IngestPipeline(
+    persist=persist_readings,
+    concurrency=config.INGEST_STAGE_CONCURRENCY,
+    queue_size=config.INGEST_QUEUE_SIZE,
+    persist_batch_size=config.INGEST_PERSIST_BATCH_SIZE,
+    retry_after=config.INGEST_RETRY_AFTER,
+)
+
+notification_stream = NotificationStream(
+    ble_connections,
+    partial(ingest_pipeline.submit_batch, source="ble-notify"),
+    config.CHARACTERISTIC_UUID,
+    max_batch=config.BLE_NOTIFY_BATCH_SIZE,
+    max_delay=config.BLE_NOTIFY_MAX_DELAY,
+    poll_interval=config.BLE_POLL_INTERVAL,
+    scheduler=poll_scheduler,
+)
+
+# atexit runs handlers last-in first-out: drain the pipeline, then the spool, then the writer.
+atexit.register(bulk_writer.close)
+if spool_replayer:
+    atexit.register(spool.close)
+    atexit.register(spool_replayer.stop)
+atexit.register(ingest_pipeline.stop)
+# Registered last so it runs first: the stream flushes its buffered readings into the pipeline.
+background_loop.add_shutdown_hook(notification_stream.aclose)
+atexit.register(background_loop.stop)
+
 @celery_app.task
 def store_data_background(data):
-    with db_write_lock:
-        logger.info(f"Storing data: {data}")
-        try:
-            timestamp = datetime.fromisoformat(data["timestamp"])
-            temperature = data["temperature"]
-            humidity = data["humidity"]
-            record = SensorData(timestamp=timestamp, temperature=temperature, humidity=humidity)
-            with db_session_scope() as session:
-                session.add(record)
-            logger.info("Data has been stored successfully in the background!")
-        except Exception as e:
-            logger.error(f"Error storing data: {e}")
+    logger.debug(f"Queueing data for storage: {data}")
+    try:
+        bulk_writer.submit(data)
+    except Exception as e:
+        logger.error(f"Error storing data: {e}")
 
 async def main_async_operations():
     with app.app_context():
@@ -55,9 +122,9 @@ async def main_async_operations():
         else:
             logger.warning("Target device not found!")
 
-def extract_data_from_queue():
+def extract_data_from_queue(timeout=0):
     try:
-        data = data_queue.get(timeout=10)
+        data = data_queue.get(timeout=timeout) if timeout else data_queue.get_nowait()
         logger.info("Data successfully extracted from the queue.")
     except queue.Empty:
         logging.warning("Queue is empty. No data to process.")
@@ -71,16 +138,11 @@ async def connect_to_device(device):
     with app.app_context():
         characteristic_uuid = current_app.config.get('CHARACTERISTIC_UUID')
         try:
-            client = BleakClient(device.address)
-            await client.connect()
-            if not client.is_connected:
-                logger.error("Failed to connect to the device!")
-                return {"status": "failure", "error": "Failed to connect"}
-            data = await client.read_gatt_char(characteristic_uuid)
+            # The link stays open in the pool for the next read.
+            data = await ble_connections.read(device, characteristic_uuid)
             if not is_data_valid(data):  # Assuming this function returns a boolean
                 logger.warning("Received invalid data from the device.")
                 return {"status": "failure", "error": "Invalid data received"}
-            await client.disconnect()
             return {"status": "success", "data": data}
         except Exception as e:
             logger.error(f"Error connecting to device: {e}")
@@ -132,8 +194,7 @@ async def discover_devices():
 @Celery.task
 def fetch_process_and_store_data():
     try:
-        # This function should be an async function or use asyncio.run if it's calling async functions
-        data = asyncio.run(connect_to_gateway())
+        data = background_loop.run(connect_to_gateway())
         if not data:
             logger.error("No data received from the gateway.")
             return
@@ -147,6 +208,19 @@ def fetch_process_and_store_data():
     except Exception as e:
         logger.error(f"Error processing or storing data: {e}")
 
+def start_sensor_streaming():
+    """
+    Subscribe to notifications of every known device (BLE_COLLECTION_MODE=notify).
+    Safe to call again: devices added since the last call are picked up.
+    :return: Future resolved with {address: mode}, or None when no characteristic is configured.
+    """
+    if not config.CHARACTERISTIC_UUID:
+        logger.error("CHARACTERISTIC_UUID is not configured; cannot stream BLE notifications.")
+        return None
+    with db_session_scope(readonly=True) as session:
+        devices = {device.address: device.id for device in session.query(Device)}
+    return notification_stream.start(devices)
+
 def main_data_ops():
     with app.app_context():
         raw_data = data_queue.get(timeout=10)
@@ -154,4 +228,4 @@ def main_data_ops():
         store_data_background(data)
 
 if __name__ == "__main__":
-    asyncio.run(main_async_operations())
+    background_loop.run(main_async_operations())
@@ -1,45 +1,154 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, g
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
 
-from data_ops import store_data_background
+from data_ops import ingest_pipeline
+from ingest_pipeline import PipelineOverloaded
+from data_helpers import validate_reading, iter_ndjson
 from database import Session as db
 from utils import is_data_valid
+from config import config
 import services
+import rollups
+import aggregation
+import export
+import columnar
+from conditional import conditional_get, range_end_arg, scope_from_device_arg
+from pagination import InvalidCursor, clamp_limit
+from sensor_service import fetch_sensor_data_page, fetch_sensor_data_columns, fetch_sample_records
+from ring_buffers import recent_window
 
 from __init__ import limiter 
 
 data = Blueprint('data', __name__)
 
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+
+def columnar_response(columns, mimetype, metadata=None):
+    response = Response(columnar.encode(columns, mimetype, metadata), mimetype=mimetype)
+    response.headers["Vary"] = "Accept"
+    return response
+
 @data.route("/iotdata", methods=["POST"])
 @limiter.limit("5 per minute") 
 def receive_iot_data():
     data = request.get_json()
     if not data or 'temperature' not in data:
         return jsonify({"error": "Invalid or incomplete data"}), 400
-    processed_data = is_data_valid(data)
-    if processed_data:  
-        store_data_background.delay(processed_data)
-        return jsonify({"status": "success"}), 200
-    else:
+    if not is_data_valid(data):
         return jsonify({"error": "Invalid data format"}), 400
+    try:
+        future = ingest_pipeline.submit(data)
+    except PipelineOverloaded as e:
+        return overloaded_response(e)
+    error_response = await_durable_ack(future)
+    if error_response:
+        return error_response
+    return jsonify({"status": "success"}), 200
+
+def overloaded_response(error):
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, error.status_code
+
+def await_durable_ack(future):
+    """
+    With the spool enabled, hold the response until the reading is appended to it.
+    :return: An error response, or None once the reading is durable (or when the spool is off).
+    """
+    if not config.SPOOL_ENABLED:
+        return None
+    try:
+        future.result(timeout=config.INGEST_ACK_TIMEOUT)
+    except FutureTimeout:
+        return overloaded_response(PipelineOverloaded("Reading not yet durable", retry_after=config.INGEST_RETRY_AFTER, status_code=503))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to store reading: {e}"}), 500
+    return None
+
+def load_batch():
+    """
+    Decode the batch body once per request, as a JSON array or an NDJSON stream.
+    :return: List of decoded items, or None if the body is not a batch.
+    """
+    if "batch_items" in g:
+        return g.batch_items
+    items = None
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for item in iter_ndjson(request.stream):
+            items.append(item)
+            if len(items) > config.BATCH_MAX_READINGS:
+                break
+    else:
+        body = request.get_json(silent=True)
+        if isinstance(body, list):
+            items = body
+    g.batch_items = items
+    return items
+
+def batch_cost():
+    """Rate limit cost of a batch request: one unit per reading."""
+    items = load_batch()
+    return max(len(items), 1) if items else 1
+
+@data.route("/iotdata/batch", methods=["POST"])
+@limiter.limit(config.BATCH_READINGS_RATE_LIMIT, cost=batch_cost)
+def receive_iot_data_batch():
+    items = load_batch()
+    if not items:
+        return jsonify({"error": "Expected a non-empty JSON array or NDJSON body"}), 400
+    if len(items) > config.BATCH_MAX_READINGS:
+        return jsonify({"error": f"Batch exceeds {config.BATCH_MAX_READINGS} readings"}), 413
+    accepted = []
+    results = []
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            reading, error = None, str(item)
+        else:
+            reading, error = validate_reading(item)
+        if reading is None:
+            results.append({"index": index, "status": "rejected", "error": error})
+        else:
+            accepted.append(reading)
+            results.append({"index": index, "status": "accepted"})
+    if accepted:
+        try:
+            future = ingest_pipeline.submit_batch(accepted)
+        except PipelineOverloaded as e:
+            return overloaded_response(e)
+        error_response = await_durable_ack(future)
+        if error_response:
+            return error_response
+    response = {
+        "status": "success" if accepted else "error",
+        "accepted": len(accepted),
+        "rejected": len(items) - len(accepted),
+        "results": results,
+    }
+    return jsonify(response), 200 if accepted else 400
 
 @data.route("/iotdata", methods=["GET"])
+@conditional_get()
 def get_iot_data():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    with db() as session:
-        sensor_data = services.fetch_all_sensor_data().paginate(page, per_page, error_out=False)
-    data_list = [
-        {
-            "timestamp": record.timestamp.isoformat(),
-            "temperature": record.temperature,
-            "humidity": record.humidity,
-        }
-        for record in sensor_data.items
-    ]
-    return jsonify(data_list)
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', request.args.get('per_page', type=int), type=int)
+    limit = clamp_limit(limit, config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX)
+    try:
+        data_list, next_cursor, prev_cursor = fetch_sensor_data_page(limit, cursor)
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "data": data_list,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "limit": limit,
+    })
 
 @data.route("/filter_data", methods=["GET"])
+@conditional_get(scope=scope_from_device_arg, range_end=range_end_arg)
 def get_filtered_data():
     start_time_str = request.args.get("start")
     end_time_str = request.args.get("end")
@@ -48,18 +157,109 @@ def get_filtered_data():
     try:
         start_time = datetime.fromisoformat(start_time_str)
         end_time = datetime.fromisoformat(end_time_str)
-        filtered_data = services.fetch_filtered_sensor_data(start_time, end_time)
-        return jsonify(
-            [
-                {
-                    "timestamp": record.timestamp.isoformat(),
-                    "temperature": record.temperature,
-                    "humidity": record.humidity,
-                }
-                for record in filtered_data
-            ]
+        device_id = request.args.get("device_id", type=int)
+        metric = request.args.get("metric")
+        mimetype = columnar.negotiate(request.accept_mimetypes)
+        resolution = rollups.choose_resolution(
+            start_time,
+            end_time,
+            resolution=request.args.get("resolution", type=int),
+            max_points=request.args.get("max_points", type=int),
         )
+        if resolution:
+            if mimetype != columnar.JSON_MIMETYPE:
+                columns = rollups.fetch_rollup_columns(start_time, end_time, resolution, device_id, metric)
+                return columnar_response(columns, mimetype, {"resolution": resolution})
+            buckets = rollups.fetch_rollups(
+                start_time,
+                end_time,
+                resolution,
+                device_id=device_id,
+                metric=metric,
+            )
+            for bucket in buckets:
+                bucket["timestamp"] = bucket["timestamp"].isoformat()
+            return jsonify({"resolution": resolution, "data": buckets})
+        if mimetype != columnar.JSON_MIMETYPE:
+            columns = fetch_sensor_data_columns(start_time, end_time, device_id, metric)
+            return columnar_response(columns, mimetype)
+        return jsonify(fetch_sample_records(start_time, end_time, device_id))
+    except ValueError:
+        return jsonify({"error": "Invalid start or end date format"}), 400
+
+@data.route("/aggregate", methods=["GET"])
+def get_aggregate():
+    metric = request.args.get("metric")
+    start_time_str = request.args.get("start")
+    end_time_str = request.args.get("end")
+    if not metric or not start_time_str or not end_time_str:
+        return jsonify({"error": "metric, start and end are required"}), 400
+    try:
+        start_time = datetime.fromisoformat(start_time_str)
+        end_time = datetime.fromisoformat(end_time_str)
     except ValueError:
         return jsonify({"error": "Invalid start or end date format"}), 400
+    if end_time <= start_time:
+        return jsonify({"error": "end must be after start"}), 400
+    try:
+        bucket = aggregation.parse_duration(request.args.get("bucket", "5m"))
+        functions = aggregation.parse_functions(request.args.get("fn"))
+        fill = request.args.get("fill", "none")
+        device_id = request.args.get("device_id", type=int)
+        if (end_time - start_time).total_seconds() / bucket > config.AGGREGATE_MAX_BUCKETS:
+            return jsonify({"error": f"More than {config.AGGREGATE_MAX_BUCKETS} buckets requested; use a wider bucket"}), 400
+        mimetype = columnar.negotiate(request.accept_mimetypes)
+        as_arrays = mimetype != columnar.JSON_MIMETYPE
+        columns = aggregation.aggregate(
+            metric, start_time, end_time, bucket, functions, device_id=device_id, fill=fill, as_arrays=as_arrays
+        )
+    except aggregation.AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+    if as_arrays:
+        return columnar_response(columns, mimetype, {"metric": metric, "device_id": device_id, "bucket": bucket, "fill": fill})
+    return jsonify({
+        "metric": metric,
+        "device_id": device_id,
+        "bucket": bucket,
+        "fill": fill,
+        "columns": columns,
+    })
 
-    
+@data.route("/recent_window", methods=["GET"])
+def get_recent_window_stats():
+    return jsonify(recent_window.stats())
+
+@data.route("/export", methods=["GET"])
+def export_data():
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}; use one of {', '.join(export.FORMATS)}"}), 400
+    start_time_str = request.args.get("start")
+    end_time_str = request.args.get("end")
+    if not start_time_str or not end_time_str:
+        return jsonify({"error": "Both start and end times are required"}), 400
+    try:
+        start_time = datetime.fromisoformat(start_time_str)
+        end_time = datetime.fromisoformat(end_time_str)
+    except ValueError:
+        return jsonify({"error": "Invalid start or end date format"}), 400
+    use_gzip = request.args.get("gzip", "1") != "0" and "gzip" in request.accept_encodings
+    body = export.export_stream(
+        fmt,
+        start_time,
+        end_time,
+        device_id=request.args.get("device_id", type=int),
+        metric=request.args.get("metric"),
+        gzip=use_gzip,
+        yield_per=config.EXPORT_YIELD_PER,
+        rows_per_chunk=config.EXPORT_CHUNK_ROWS,
+        gzip_level=config.EXPORT_GZIP_LEVEL,
+    )
+    # No Content-Length, so the body goes out with chunked transfer encoding.
+    response = Response(body, mimetype=export.FORMATS[fmt], direct_passthrough=True)
+    response.headers["Content-Disposition"] = f"attachment; filename=sensor_data_{start_time:%Y%m%dT%H%M%S}.{fmt}"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Accel-Buffering"] = "no"
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
@@ -1,28 +1,99 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 from contextlib import contextmanager
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from config import SQLALCHEMY_DATABASE_URI
+from config import config
 from models import DeviceDetail
 from base import Base
-
-engine = create_engine(SQLALCHEMY_DATABASE_URI)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Session = scoped_session(SessionLocal)
+from migrations import run_migrations
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SQLALCHEMY_DATABASE_URI = config.SQLALCHEMY_DATABASE_URI
+
+# Pragmas that only a writable connection may change.
+WRITER_ONLY_PRAGMAS = {"journal_mode", "wal_autocheckpoint"}
+
+def is_sqlite(uri):
+    return uri.startswith("sqlite")
+
+def sqlite_read_only_uri(uri):
+    """Turn sqlite:///path into a URI that opens the same file read-only."""
+    path = uri.split(":///", 1)[1].split("?", 1)[0]
+    if not path or path == ":memory:":
+        return None
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+def apply_sqlite_pragmas(engine, pragmas, immediate_transactions=False):
+    """
+    Run PRAGMA statements on every new DBAPI connection of the engine.
+    :param immediate_transactions: Start transactions with BEGIN IMMEDIATE so a writer takes
+        the write lock up front instead of failing to upgrade a read lock under contention.
+    """
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if immediate_transactions:
+            # Let SQLAlchemy, not the sqlite3 module, decide when transactions begin.
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    if immediate_transactions:
+        @event.listens_for(engine, "begin")
+        def begin_immediate(connection):
+            if connection.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+def create_engines(uri, pragmas=None, read_pool_size=4):
+    """
+    Build the (writer, reader) engine pair for a database URI.
+    For a SQLite file the writer is a single pooled connection, so writes are
+    serialized in-process instead of contending for the file lock, and readers
+    get their own pool of read-only connections that WAL lets run alongside it.
+    Other databases use one engine for both.
+    """
+    if not is_sqlite(uri):
+        engine = create_engine(uri)
+        return engine, engine
+    pragmas = pragmas or {}
+    busy_timeout = int(pragmas.get("busy_timeout", 5000)) / 1000
+    connect_args = {"check_same_thread": False, "timeout": busy_timeout}
+    writer = create_engine(uri, poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=busy_timeout * 6, connect_args=connect_args)
+    apply_sqlite_pragmas(writer, pragmas, immediate_transactions=True)
+    read_uri = sqlite_read_only_uri(uri)
+    if not read_uri:
+        return writer, writer
+    reader = create_engine(read_uri, poolclass=QueuePool, pool_size=read_pool_size, max_overflow=0, connect_args=connect_args)
+    reader_pragmas = {name: value for name, value in pragmas.items() if name not in WRITER_ONLY_PRAGMAS}
+    reader_pragmas["query_only"] = 1
+    apply_sqlite_pragmas(reader, reader_pragmas)
+    return writer, reader
+
+engine, read_engine = create_engines(
+    SQLALCHEMY_DATABASE_URI,
+    pragmas=getattr(config, "SQLITE_PRAGMAS", None),
+    read_pool_size=getattr(config, "SQLITE_READ_POOL_SIZE", 4),
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Session = scoped_session(SessionLocal)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+ReadSession = scoped_session(ReadSessionLocal)
+
 class DatabaseError(Exception):
     """Custom exception for database-related errors."""
     pass
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 def get_all_device_details():
-    with db_session_scope() as session:
+    with db_session_scope(readonly=True) as session:
         return session.query(DeviceDetail).all()
 
 def validate_device_detail(device_name, status, last_activity):
@@ -33,11 +104,16 @@ def validate_device_detail(device_name, status, last_activity):
 
 
 @contextmanager
-def db_session_scope():
-    session = Session()
+def db_session_scope(readonly=False):
+    """
+    Provide a transactional session.
+    :param readonly: Use a session from the read-only reader pool; nothing is committed.
+    """
+    session = ReadSession() if readonly else Session()
     try:
         yield session
-        session.commit()
+        if not readonly:
+            session.commit()
     except SQLAlchemyError as e:
         logger.error(f"Database error: {e}")
         session.rollback()
@@ -96,7 +172,7 @@ def modify_device_detail(device_name, status=None, last_activity=None):
 
 def get_device_detail_by_name(device_name):
     try:
-        with db_session_scope() as session:
+        with db_session_scope(readonly=True) as session:
             device = session.query(DeviceDetail).filter_by(device_name=device_name).first()
             return device
     except Exception as e:
@@ -4,7 +4,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
 import logging
 
-from database import Session as db
+from database import Session as db, ReadSession
 from models import DeviceMetadata
 
 logging.basicConfig(level=logging.INFO)
@@ -51,7 +51,7 @@ def get_device_details_from_db():
 
 def fetch_all_devices():
     try:
-        with db() as session:
+        with ReadSession() as session:
             devices = session.query(DeviceMetadata).all()
         return devices
     except SQLAlchemyError as e:
@@ -0,0 +1,74 @@
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first and last points and, from each of threshold - 2 equal-count
+    buckets in between, the point forming the largest triangle with the point
+    kept from the previous bucket and the average of the next bucket.
+    :param x: Sorted numeric (or datetime64) array.
+    :param y: Float array of the same length, without NaNs.
+    :return: Tuple of (x, y) with at most threshold points.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    xf = x.astype(np.int64).astype(np.float64) if x.dtype.kind == "M" else x.astype(np.float64)
+    yf = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = xf[edges[i + 1]:edges[i + 2]].mean()
+            next_y = yf[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = xf[n - 1], yf[n - 1]
+        area = np.abs(
+            (xf[a] - next_x) * (yf[start:end] - yf[a])
+            - (xf[a] - xf[start:end]) * (next_y - yf[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def minmax(x, y, threshold):
+    """
+    Keep the minimum and maximum of each of threshold // 2 equal-time buckets,
+    in time order. Preserves spikes that LTTB can smooth over.
+    :return: Tuple of (x, y) with at most threshold points.
+    """
+    n = len(x)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return x, y
+    xi = x.astype(np.int64)
+    span = max(int(xi[-1] - xi[0]), 1)
+    bucket_ids = np.minimum((xi - xi[0]) * buckets // span, buckets - 1)
+    order = np.lexsort((y, bucket_ids))
+    sorted_ids = bucket_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    keep = np.unique(np.concatenate((order[starts], order[ends])))
+    return x[keep], y[keep]
+
+
+def decimate(x, y, threshold, method="lttb"):
+    """
+    Downsample one sorted series to about threshold points, dropping NaN values first.
+    :param method: "lttb" or "minmax".
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unsupported decimation method: {method}")
+    present = ~np.isnan(y)
+    if not present.all():
+        x, y = x[present], y[present]
+    if method == "minmax":
+        return minmax(x, y, threshold)
+    return lttb(x, y, threshold)
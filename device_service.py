@@ -1,6 +1,6 @@
 from flask import jsonify, current_app, render_template
 from flask_bcrypt import Bcrypt
-from bleak import BleakScanner, BleakClient, BleakError
+from bleak import BleakScanner, BleakError
 from sqlalchemy.exc import SQLAlchemyError
 from zeroconf import ServiceListener
 from datetime import timedelta
@@ -11,6 +11,8 @@ import logging
 from uuid import UUID
 
 from background_tasks import start_background_discovery_task
+from ble_connections import ble_connections
+from gatt_cache import gatt_cache
 from models import DeviceMetadata
 from database import Session as db, db_session_scope
 from db_service import add_to_db, handle_db_error
@@ -123,18 +125,9 @@ async def scan_bluetooth_devices(duration=10):
 
 async def get_all_characteristics():
     try:
-        async with BleakClient(current_app.config["GATEWAY_MAC_ADDRESS"]) as client:
-            if client.is_connected:
-                logger.info("Successfully connected to the IoT Gateway.")
-                services = await client.get_services()
-                characteristics = []
-                for service in services:
-                    for characteristic in service.characteristics:
-                        characteristics.append(str(characteristic.uuid))
-                return characteristics
-            else:
-                logger.error("Failed to connect to the IoT Gateway.")
-                return []
+        # Served from the GATT cache; the gateway is only contacted when its table is stale.
+        table = await gatt_cache.load(current_app.config["GATEWAY_MAC_ADDRESS"])
+        return table.characteristic_uuids()
     except Exception as e:  
         logger.error(f"Error: BLE operation failed: {e}")
         return jsonify({"error": "BLE operation failed"}), 500
@@ -189,7 +182,7 @@ def store_device(device):
 def device_exists(mac_address):
     """Check if a device with the given MAC address exists in the database."""
     try:
-        with db_session_scope() as session:
+        with db_session_scope(readonly=True) as session:
             existing_device = session.query(DeviceMetadata).filter_by(address=mac_address).first()
             return bool(existing_device)
     except Exception as e:
@@ -200,12 +193,9 @@ async def select_ble_device(device_name, mac_address):
     if not is_valid_mac_address(mac_address) or not is_valid_device_name(device_name):
         return False, "Invalid MAC address or device name"
     try:
-        async with BleakClient(mac_address) as client:
-            await client.connect()
-            if client.is_connected:
-                return True, "Device selected successfully"
-            else:
-                return False, "Failed to connect to the device"
+        # Connecting through the pool keeps the link up for the reads that follow the selection.
+        await ble_connections.connect(mac_address)
+        return True, "Device selected successfully"
     except BleakError as e:
         return False, f"BLE error: {str(e)}"
     except Exception as e:
@@ -1,4 +1,8 @@
-from data_helpers import data_queue, MAX_QUEUE_SIZE
+from data_helpers import add_to_queue
+from ingest_pipeline import PipelineOverloaded
+from gatt_cache import gatt_cache
+from ble_polling import poll_scheduler
+from loop_thread import background_loop
 from zeroconf import Zeroconf, ServiceBrowser
 import requests
 from bleak import BleakScanner, BleakClient
@@ -6,7 +10,6 @@ import bleak
 import asyncio
 import time
 import logging
-import signal
 
 zeroconf = None
 listener = None
@@ -19,10 +22,7 @@ class MyListener:
     def remove_service(self, zeroconf, type, name, service):
         logger.info(f"Service {name} removed")
         try:
-            if data_queue.qsize() < MAX_QUEUE_SIZE:
-                data_queue.put(name)
-            else:
-                logging.warning("Data queue is full. Consider processing data or increasing queue size.")
+            add_to_queue(name)
         except Exception as e:
             logging.error(f"Error during discovery: {e}")
 
@@ -37,8 +37,12 @@ class MyListener:
             # Fetch data from the device (hypothetical endpoint)
             response = requests.get(f"http://{device_ip}:{device_port}/data_endpoint")
             if response.status_code == 200:
-                data = response.json()
-                data_queue.put(data)
+                # Imported here because data_ops pulls in the app, which imports this module.
+                from data_ops import ingest_pipeline
+                try:
+                    ingest_pipeline.submit(response.json(), source=f"zeroconf:{name}")
+                except PipelineOverloaded as e:
+                    logger.warning(f"Ingest pipeline overloaded, reading from {name} refused: {e}")
             else:
                 logging.warning(f"Failed to fetch data from device {name}")
         except Exception as e:
@@ -104,11 +108,6 @@ async def get_discovered_data():
         logging.error(f"Error fetching discovered data: {e}")
         return None
 
-def graceful_shutdown(signum, frame):
-    logger.info("Gracefully shutting down...")
-    loop = asyncio.get_event_loop()
-    loop.stop()
-
 async def discover_services_and_characteristics():
     try:
         # Callback for discovered devices
@@ -119,38 +118,24 @@ async def discover_services_and_characteristics():
         await asyncio.sleep(5)
         await scanner.stop()
         devices = scanner.discovered_devices
-        for device in devices:
-            MAX_RETRIES = 3
-            for retry in range(MAX_RETRIES):
-                try:
-                    async with BleakClient(device) as client:
-                        services = client.services
-                        for service in services:
-                            logger.info(f"Service: {service.uuid}")
-                            for char in service.characteristics:
-                                logger.info(f"  Characteristic: {char.uuid}")
-                except bleak.exc.BleakError as e:
-                    if retry < MAX_RETRIES - 1:
-                        logger.warning(f"Connection failed. Retrying ({retry + 1}/{MAX_RETRIES})...")
-                    else:
-                        logger.warning(f"Failed to connect after {MAX_RETRIES} attempts.")
-                        break
+        # Devices are walked concurrently; each gets up to three attempts within the poll deadline.
+        # Devices whose cached GATT table is still fresh are not contacted at all.
+        return await poll_scheduler.sweep(devices, log_services, retries=2)
     except bleak.exc.BleakError as e:
         logger.error(f"BleakError encountered: {e}")
 
-def handle_asyncio_exception(loop, context):
-    msg = context.get("exception", context["message"])
-    logger.error(f"Caught exception: {msg}")
-
-loop = asyncio.get_event_loop()
-loop.set_exception_handler(handle_asyncio_exception)
-
-signal.signal(signal.SIGINT, graceful_shutdown)
-signal.signal(signal.SIGTERM, graceful_shutdown)
+async def log_services(device):
+    table = await gatt_cache.load(device)
+    for service in table.services:
+        logger.info(f"{device.address} service: {service['uuid']}")
+        for char in service["characteristics"]:
+            logger.info(f"{device.address}   Characteristic: {char['uuid']} ({', '.join(char['properties'])})")
+    return table
 
 if __name__ == "__main__":
+    background_loop.install_signal_handlers()
     try:
-        asyncio.run(discover_services_and_characteristics())
+        background_loop.run(discover_services_and_characteristics())
     except Exception as e:
         logger.error(f"Error during service and characteristic discovery: {e}")
 
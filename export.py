@@ -0,0 +1,121 @@
+import csv
+import heapq
+import io
+import json
+import logging
+import zlib
+
+from blocks import iter_block_rows
+from database import db_session_scope
+from metric_dictionary import metric_dictionary
+from ring_buffers import to_micros
+from samples import reading_selects
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+CSV_COLUMNS = ("timestamp", "device_id", "metric", "value", "unit")
+
+
+def iter_rows(start, end, device_id=None, metric=None, yield_per=5000):
+    """
+    Stream sensor rows in [start, end), oldest first, sensor_data and sample
+    readings merged with compacted blocks.
+    Each table is read in index order yield_per rows at a time (a server-side
+    cursor on PostgreSQL) and blocks are decoded one span window at a time, so
+    memory stays flat however long the range is. The read session stays open
+    until the generator is exhausted or closed.
+    :return: Generator of (timestamp, device_id, metric, value, unit) tuples.
+    """
+    def raw_rows(query, timestamp_column, id_column):
+        query = query.order_by(timestamp_column, id_column)
+        for _, timestamp, device, metric_id, value in query.yield_per(yield_per):
+            name, unit = metric_dictionary.lookup(metric_id)
+            yield timestamp, device, name, value, unit
+
+    with db_session_scope(readonly=True) as session:
+        stored = [raw_rows(*source) for source in reading_selects(start, end, device_id, metric, session=session)]
+        compacted = iter_block_rows(session, to_micros(start), to_micros(end) - 1, device_id, metric)
+        yield from heapq.merge(compacted, *stored, key=lambda row: row[0])
+
+
+def ndjson_chunks(rows, rows_per_chunk=1000):
+    """Encode rows as newline-delimited JSON, rows_per_chunk lines per yielded string."""
+    lines = []
+    for timestamp, device_id, metric, value, unit in rows:
+        lines.append(json.dumps(
+            {"timestamp": timestamp.isoformat(), "device_id": device_id, "metric": metric, "value": value, "unit": unit},
+            separators=(",", ":"),
+        ))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def csv_chunks(rows, rows_per_chunk=1000):
+    """Encode rows as CSV with a header line, rows_per_chunk rows per yielded string."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    pending = 0
+    for timestamp, device_id, metric, value, unit in rows:
+        writer.writerow((timestamp.isoformat(), device_id, metric, value, unit))
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+            pending = 0
+    yield out.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of text chunks incrementally, without buffering the whole body."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+ENCODERS = {
+    "ndjson": ndjson_chunks,
+    "csv": csv_chunks,
+}
+
+
+def export_stream(fmt, start, end, device_id=None, metric=None, gzip=False,
+                  yield_per=5000, rows_per_chunk=1000, gzip_level=6):
+    """
+    Build the response body for an export as a generator of bytes.
+    If the client disconnects, the WSGI server closes the generator; the
+    GeneratorExit unwinds through iter_rows and releases the read session.
+    """
+    sent = 0
+
+    def counted(rows):
+        nonlocal sent
+        for row in rows:
+            sent += 1
+            yield row
+
+    chunks = ENCODERS[fmt](counted(iter_rows(start, end, device_id, metric, yield_per)), rows_per_chunk)
+    body = gzip_chunks(chunks, gzip_level) if gzip else (chunk.encode("utf-8") for chunk in chunks)
+    try:
+        yield from body
+        logger.info(f"Export of {start.isoformat()}..{end.isoformat()} as {fmt} finished after {sent} rows")
+    except GeneratorExit:
+        logger.info(f"Client disconnected from {fmt} export after {sent} rows")
+        body.close()
+        raise
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated body.
+        logger.error(f"Export of {start.isoformat()}..{end.isoformat()} failed after {sent} rows: {e}")
+        raise
@@ -0,0 +1,239 @@
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import time
+
+from ble_connections import ble_connections, device_address
+from config import config
+from database import db_session_scope
+from models import GattTable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Generic Attribute "Database Hash" (Bluetooth 5.1 GATT caching) and Device Information "Firmware Revision String".
+DATABASE_HASH_UUID = "00002b2a-0000-1000-8000-00805f9b34fb"
+FIRMWARE_REVISION_UUID = "00002a26-0000-1000-8000-00805f9b34fb"
+
+
+def serialize_services(services):
+    """Services of a connected client as JSON-ready dicts: uuid, handle and characteristics (uuid, handle, properties)."""
+    return [
+        {
+            "uuid": str(service.uuid).lower(),
+            "handle": service.handle,
+            "characteristics": [
+                {"uuid": str(char.uuid).lower(), "handle": char.handle, "properties": sorted(char.properties)}
+                for char in service.characteristics
+            ],
+        }
+        for service in services
+    ]
+
+
+def attribute_hash(services):
+    return hashlib.sha256(json.dumps(services, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class CachedTable:
+    """GATT table of one device as last discovered, with the markers it was validated against."""
+
+    def __init__(self, address, services, database_hash=None, firmware=None, discovered_at=None, checked_at=None):
+        self.address = address
+        self.services = services
+        self.attribute_hash = attribute_hash(services)
+        self.database_hash = database_hash
+        self.firmware = firmware
+        self.discovered_at = discovered_at or datetime.utcnow()
+        self.checked_at = checked_at or self.discovered_at
+        self._characteristics = {char["uuid"]: char for service in services for char in service["characteristics"]}
+
+    def characteristic(self, uuid):
+        """:return: Dict with uuid, handle and properties, or None if the device has no such characteristic."""
+        return self._characteristics.get(str(uuid).lower())
+
+    def characteristic_uuids(self):
+        return list(self._characteristics)
+
+    def as_dict(self):
+        return {
+            "address": self.address,
+            "services": self.services,
+            "attribute_hash": self.attribute_hash,
+            "database_hash": self.database_hash,
+            "firmware": self.firmware,
+            "discovered_at": self.discovered_at.isoformat(),
+            "checked_at": self.checked_at.isoformat(),
+        }
+
+
+class GattCache:
+    """
+    Per-device cache of GATT tables (services, characteristics, properties and
+    handles), kept in memory and in the gatt_tables table, so characteristic
+    lookups and validation need no radio round trip.
+    A table is trusted for ttl seconds after it was last checked. The next
+    load() after that connects and compares the device's Database Hash or,
+    without one, its Firmware Revision with the cached value: when they match,
+    the table is only marked as checked; otherwise, and for devices exposing
+    neither, it is rebuilt from the services of the connection.
+    :param persist: Store tables in the database as well as in memory.
+    """
+
+    def __init__(self, manager, ttl=86400.0, persist=True):
+        self.manager = manager
+        self.ttl = ttl
+        self.persist = persist
+        self._tables = {}
+
+    def peek(self, address_or_device):
+        """Cached table of a device, however old, from memory or the database. Blocking."""
+        address = device_address(address_or_device)
+        table = self._tables.get(address)
+        if table is None and self.persist:
+            with db_session_scope(readonly=True) as session:
+                row = session.query(GattTable).filter_by(address=address).first()
+                if row is not None:
+                    table = CachedTable(
+                        address, json.loads(row.services), row.database_hash, row.firmware,
+                        row.discovered_at, row.checked_at,
+                    )
+            if table is not None:
+                self._tables[address] = table
+        return table
+
+    def is_fresh(self, table):
+        return (datetime.utcnow() - table.checked_at).total_seconds() < self.ttl
+
+    async def load(self, address_or_device, refresh=False):
+        """
+        GATT table of a device: the cached one while it is fresh, otherwise revalidated or
+        rediscovered over the pooled link.
+        :param refresh: Rediscover even if the cached table is fresh.
+        :return: CachedTable.
+        """
+        address = device_address(address_or_device)
+        cached = await self._run_blocking(self.peek, address)
+        if cached is not None and not refresh and self.is_fresh(cached):
+            return cached
+        async with self.manager.connection(address) as client:
+            if cached is not None and not refresh:
+                markers = await self._read_markers(client, cached)
+                if any(markers) and markers == (cached.database_hash, cached.firmware):
+                    cached.checked_at = datetime.utcnow()
+                    await self._run_blocking(self._store, cached)
+                    logger.info(f"GATT table of {address} unchanged; revalidated")
+                    return cached
+            table = CachedTable(address, serialize_services(client.services))
+            table.database_hash, table.firmware = await self._read_markers(client, table)
+        if cached is None:
+            logger.info(f"Discovered GATT table of {address}: {len(table.characteristic_uuids())} characteristics")
+        elif cached.attribute_hash != table.attribute_hash:
+            logger.info(f"GATT table of {address} changed; replaced cached table from {cached.discovered_at.isoformat()}")
+        else:
+            table.discovered_at = cached.discovered_at
+        await self._run_blocking(self._store, table)
+        return table
+
+    async def has_characteristic(self, address_or_device, uuid):
+        table = await self.load(address_or_device)
+        return table.characteristic(uuid) is not None
+
+    async def _read_markers(self, client, table):
+        markers = []
+        for uuid in (DATABASE_HASH_UUID, FIRMWARE_REVISION_UUID):
+            value = None
+            if table.characteristic(uuid) is not None:
+                try:
+                    data = await client.read_gatt_char(uuid)
+                    value = data.hex() if uuid == DATABASE_HASH_UUID else bytes(data).decode("utf-8", "replace").strip("\x00 ")
+                except Exception as e:
+                    logger.warning(f"Reading {uuid} of {table.address} failed: {e}")
+            markers.append(value)
+        return tuple(markers)
+
+    def _store(self, table):
+        self._tables[table.address] = table
+        if not self.persist:
+            return
+        with db_session_scope() as session:
+            row = session.query(GattTable).filter_by(address=table.address).first()
+            if row is None:
+                row = GattTable(address=table.address)
+                session.add(row)
+            row.services = json.dumps(table.services, separators=(",", ":"))
+            row.attribute_hash = table.attribute_hash
+            row.database_hash = table.database_hash
+            row.firmware = table.firmware
+            row.discovered_at = table.discovered_at
+            row.checked_at = table.checked_at
+
+    def invalidate(self, address_or_device):
+        """Forget a device's table so the next load() rediscovers it. Blocking."""
+        address = device_address(address_or_device)
+        self._tables.pop(address, None)
+        if self.persist:
+            with db_session_scope() as session:
+                session.query(GattTable).filter_by(address=address).delete()
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+gatt_cache = GattCache(ble_connections, ttl=config.GATT_CACHE_TTL)
+
+
+def benchmark(devices=20, lookups=5, connect_delay=0.5):
+    """
+    Look up a characteristic of every fake device lookups times, once connecting
+    and enumerating services each time (as get_all_characteristics did) and once
+    through a GattCache.
+    :return: List of (case, seconds, connects).
+    """
+    from ble_connections import BleConnectionManager
+    from ble_fake import FakeBleakBackend
+
+    uuid = "00002a6e-0000-1000-8000-00805f9b34fb"
+    addresses = [f"AA:BB:CC:DD:{i // 256:02X}:{i % 256:02X}" for i in range(devices)]
+
+    def backend():
+        fake = FakeBleakBackend(max_connections=devices + 1, connect_delay=connect_delay)
+        for address in addresses:
+            fake.add_device(address, {uuid: b"\x15\x2d", FIRMWARE_REVISION_UUID: b"1.0.3"})
+        return fake
+
+    async def uncached(fake):
+        for _ in range(lookups):
+            for address in addresses:
+                async with fake.client(address) as client:
+                    assert any(char.uuid == uuid for service in client.services for char in service.characteristics)
+
+    async def cached(fake):
+        manager = BleConnectionManager(fake.client, max_connections=devices + 1)
+        cache = GattCache(manager, persist=False)
+        for _ in range(lookups):
+            for address in addresses:
+                assert await cache.has_characteristic(address, uuid)
+        await manager.close()
+
+    results = []
+    for case, run in (("no cache", uncached), ("gatt cache", cached)):
+        fake = backend()
+        started = time.perf_counter()
+        asyncio.run(run(fake))
+        results.append((case, time.perf_counter() - started, sum(device.connects for device in fake.devices.values())))
+    return results
+
+
+if __name__ == "__main__":
+    # python gatt_cache.py bench [devices]    fake adapter, no radio needed
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "bench":
+        print(f"{'case':<11} {'seconds':>8} {'connects':>9}")
+        for case, elapsed, connects in benchmark(*[int(arg) for arg in sys.argv[2:3]]):
+            print(f"{case:<11} {elapsed:>8.2f} {connects:>9}")
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -0,0 +1,293 @@
+from concurrent.futures import Future
+from datetime import datetime
+import asyncio
+import json
+import logging
+import threading
+
+from data_helpers import validate_reading
+from database import db_session_scope
+from models import Device
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ("receive", "decode", "validate", "enrich", "persist")
+
+
+class PipelineOverloaded(Exception):
+    """Raised to producers when the pipeline cannot take more readings right now."""
+
+    def __init__(self, message, retry_after=1, status_code=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class _Envelope:
+    __slots__ = ("payload", "source", "future", "batch")
+
+    def __init__(self, payload, source, future, batch=False):
+        self.payload = payload
+        self.source = source
+        self.future = future
+        self.batch = batch
+
+
+class IngestPipeline:
+    """
+    Staged in-process ingest: receive -> decode -> validate -> enrich -> persist.
+    Stages are connected by bounded asyncio queues and each stage runs its own
+    number of workers. When the receive queue is full, submit() raises
+    PipelineOverloaded instead of dropping the reading, and every reading that
+    enters the pipeline ends up counted as persisted, rejected or failed.
+    """
+
+    def __init__(self, persist, concurrency=None, queue_size=1000, persist_batch_size=500, retry_after=1):
+        """
+        :param persist: Blocking callable taking a list of validated readings and writing them as one unit.
+        :param concurrency: Dict of stage name to worker count.
+        :param queue_size: Capacity of each inter-stage queue.
+        :param persist_batch_size: Max readings handed to persist in one call.
+        :param retry_after: Seconds producers are told to wait when overloaded.
+        """
+        self.persist = persist
+        self.concurrency = {"decode": 1, "validate": 1, "enrich": 1, "persist": 1}
+        self.concurrency.update(concurrency or {})
+        self.queue_size = queue_size
+        self.persist_batch_size = persist_batch_size
+        self.retry_after = retry_after
+        self._loop = None
+        self._thread = None
+        self._queues = {}
+        self._workers = []
+        self._device_ids = {}
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            "received": 0,
+            "refused": 0,
+            "decode_errors": 0,
+            "rejected": 0,
+            "persisted": 0,
+            "failed": 0,
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self.is_running():
+                return
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop, args=(ready,), name="ingest-pipeline", daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"Ingest pipeline started with concurrency {self.concurrency}")
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive() and self._loop and self._loop.is_running())
+
+    def stop(self, timeout=10):
+        """Let queued readings drain through persist, then stop the loop thread."""
+        if not self.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._drain(), self._loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.warning(f"Ingest pipeline did not drain within {timeout}s: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        logger.info(f"Ingest pipeline stopped: {self.stats()}")
+
+    def submit(self, payload, source="http"):
+        """
+        Offer a raw reading (dict, JSON str or bytes) from any thread without blocking.
+        :return: concurrent.futures.Future resolved with True once persisted, or with an exception.
+        :raises PipelineOverloaded: When the receive queue is full or the pipeline is not running.
+        """
+        return self._offer(_Envelope(payload, source, Future()), "receive")
+
+    def submit_batch(self, readings, source="http"):
+        """Offer already validated readings that must be persisted together as one unit."""
+        return self._offer(_Envelope(list(readings), source, Future(), batch=True), "persist", count=len(readings))
+
+    def pressure(self):
+        """Fill ratio of the fullest stage queue, from 0.0 to 1.0."""
+        if not self._queues:
+            return 0.0
+        return max(q.qsize() / self.queue_size for q in self._queues.values())
+
+    def poll_delay_factor(self):
+        """Multiplier that pollers should apply to their interval while the pipeline is under pressure."""
+        pressure = self.pressure()
+        if pressure >= 0.9:
+            return 4
+        if pressure >= 0.5:
+            return 2
+        return 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats["queued"] = {name: q.qsize() for name, q in self._queues.items()}
+        stats["pressure"] = round(self.pressure(), 3)
+        stats["running"] = self.is_running()
+        return stats
+
+    def _offer(self, envelope, stage, count=1):
+        if not self.is_running():
+            self.start()
+        future = asyncio.run_coroutine_threadsafe(self._put_nowait(stage, envelope), self._loop)
+        if not future.result():
+            self._count("refused", count)
+            # A full persist queue means storage is behind, not that this producer is too fast.
+            status_code = 503 if stage == "persist" else 429
+            raise PipelineOverloaded(f"Ingest {stage} queue is full", retry_after=self.retry_after, status_code=status_code)
+        self._count("received", count)
+        return envelope.future
+
+    async def _put_nowait(self, stage, envelope):
+        try:
+            self._queues[stage].put_nowait(envelope)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _run_loop(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queues = {stage: asyncio.Queue(self.queue_size) for stage in STAGES}
+        self._workers = []
+        handlers = {
+            "decode": (self._decode, "receive", "decode"),
+            "validate": (self._validate, "decode", "validate"),
+            "enrich": (self._enrich, "validate", "enrich"),
+        }
+        for stage, (handler, source, target) in handlers.items():
+            for _ in range(self.concurrency[stage]):
+                self._workers.append(self._loop.create_task(self._stage_worker(handler, source, target)))
+        # Enriched readings and pre-validated batches both feed persist.
+        self._workers.append(self._loop.create_task(self._stage_worker(self._passthrough, "enrich", "persist")))
+        for _ in range(self.concurrency["persist"]):
+            self._workers.append(self._loop.create_task(self._persist_worker()))
+        self._loop.call_soon(ready.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            for task in self._workers:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*self._workers, return_exceptions=True))
+            self._loop.close()
+
+    async def _drain(self):
+        for stage in STAGES:
+            await self._queues[stage].join()
+
+    async def _stage_worker(self, handler, source, target):
+        inbound = self._queues[source]
+        outbound = self._queues[target]
+        while True:
+            envelope = await inbound.get()
+            try:
+                result = await handler(envelope)
+                if result is not None:
+                    # Waiting here is what pushes back on the stages before it.
+                    await outbound.put(result)
+            except Exception as e:
+                logger.error(f"Ingest stage {handler.__name__} failed: {e}")
+                self._fail(envelope, e, "failed")
+            finally:
+                inbound.task_done()
+
+    async def _passthrough(self, envelope):
+        return envelope
+
+    async def _decode(self, envelope):
+        payload = envelope.payload
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode("utf-8")
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except ValueError as e:
+                self._fail(envelope, ValueError(f"Invalid JSON: {e}"), "decode_errors")
+                return None
+        envelope.payload = payload
+        return envelope
+
+    async def _validate(self, envelope):
+        reading, error = validate_reading(envelope.payload)
+        if reading is None:
+            self._fail(envelope, ValueError(error), "rejected")
+            return None
+        envelope.payload = reading
+        return envelope
+
+    async def _enrich(self, envelope):
+        reading = envelope.payload
+        reading["source"] = envelope.source
+        reading.setdefault("received_at", datetime.utcnow().isoformat())
+        address = reading.get("device_address")
+        if address and reading.get("device_id") is None:
+            reading["device_id"] = await self._resolve_device_id(address)
+        return envelope
+
+    async def _resolve_device_id(self, address):
+        if address in self._device_ids:
+            return self._device_ids[address]
+        device_id = await self._run_blocking(_lookup_device_id, address)
+        # Unknown addresses are looked up again, so a device registered later is picked up.
+        if device_id is not None:
+            self._device_ids[address] = device_id
+        return device_id
+
+    async def _persist_worker(self):
+        inbound = self._queues["persist"]
+        while True:
+            envelopes = [await inbound.get()]
+            size = len(envelopes[0].payload) if envelopes[0].batch else 1
+            while size < self.persist_batch_size and not inbound.empty():
+                envelope = inbound.get_nowait()
+                envelopes.append(envelope)
+                size += len(envelope.payload) if envelope.batch else 1
+            readings = []
+            for envelope in envelopes:
+                readings.extend(envelope.payload if envelope.batch else [envelope.payload])
+            try:
+                await self._run_blocking(self.persist, readings)
+                self._count("persisted", len(readings))
+                for envelope in envelopes:
+                    if not envelope.future.done():
+                        envelope.future.set_result(True)
+            except Exception as e:
+                logger.error(f"Persisting {len(readings)} readings failed: {e}")
+                for envelope in envelopes:
+                    self._fail(envelope, e, "failed")
+            finally:
+                for _ in envelopes:
+                    inbound.task_done()
+
+    async def _run_blocking(self, func, *args):
+        try:
+            future = self._loop.run_in_executor(None, func, *args)
+        except RuntimeError:
+            # The default executor refuses work once interpreter shutdown has begun;
+            # finish the drain on the loop thread rather than losing the readings.
+            return func(*args)
+        # Errors raised by func itself propagate; it must not be run a second time.
+        return await future
+
+    def _fail(self, envelope, error, counter):
+        self._count(counter, len(envelope.payload) if envelope.batch else 1)
+        if not envelope.future.done():
+            envelope.future.set_exception(error)
+
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            self._counters[counter] += amount
+
+
+def _lookup_device_id(address):
+    with db_session_scope(readonly=True) as session:
+        device = session.query(Device).filter_by(address=address).first()
+        return device.id if device else None
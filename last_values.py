@@ -0,0 +1,236 @@
+from datetime import datetime, timedelta
+import logging
+import threading
+
+import redis
+from sqlalchemy import and_, func
+
+from config import config
+from database import db_session_scope
+from metric_dictionary import metric_dictionary
+from models import SensorData, SensorSample
+from samples import SAMPLE_METRICS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+NO_DEVICE = "none"
+
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def newest_entries(rows):
+    """
+    Reduce SensorData mappings to the newest reading per (device_id, metric).
+    :return: Dict of (device_id, metric) -> (epoch micros, value, unit).
+    """
+    newest = {}
+    for row in rows:
+        timestamp, value = row.get("timestamp"), row.get("value")
+        if timestamp is None or value is None:
+            continue
+        key = (row.get("device_id"), row.get("metric"))
+        micros = to_micros(timestamp)
+        current = newest.get(key)
+        if current is None or micros >= current[0]:
+            newest[key] = (micros, value, row.get("unit"))
+    return newest
+
+
+class LocalBackend:
+    """Last values held in this process. Only sees writes made by this process."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def update(self, entries):
+        with self._lock:
+            for (device_id, metric), entry in entries.items():
+                metrics = self._values.setdefault(device_id, {})
+                current = metrics.get(metric)
+                if current is None or entry[0] >= current[0]:
+                    metrics[metric] = entry
+
+    def get(self, device_id=None):
+        """:return: Dict of device_id -> {metric: (epoch micros, value, unit)}."""
+        with self._lock:
+            if device_id is not None:
+                return {device_id: dict(self._values.get(device_id, {}))}
+            return {device: dict(metrics) for device, metrics in self._values.items()}
+
+
+class RedisBackend:
+    """
+    Last values shared by every worker process: one Redis hash per device
+    (metric -> "micros|value|unit") and a set of known devices. Updates are
+    compare-and-set in a Lua script, so a late or replayed reading never
+    overwrites a newer one.
+    """
+
+    UPDATE_SCRIPT = """
+for i = 2, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(string.match(current, '^[^|]+')) <= tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+    end
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+return 0
+"""
+
+    def __init__(self, client, prefix="iot:last"):
+        self.client = client
+        self.prefix = prefix
+        self._update = client.register_script(self.UPDATE_SCRIPT)
+
+    def _device_key(self, token):
+        return f"{self.prefix}:device:{token}"
+
+    @property
+    def _devices_key(self):
+        return f"{self.prefix}:devices"
+
+    def update(self, entries):
+        by_device = {}
+        for (device_id, metric), (micros, value, unit) in entries.items():
+            token = NO_DEVICE if device_id is None else str(device_id)
+            by_device.setdefault(token, []).extend((metric or "", micros, f"{micros}|{value!r}|{unit or ''}"))
+        pipe = self.client.pipeline(transaction=False)
+        for token, args in by_device.items():
+            self._update(keys=[self._device_key(token), self._devices_key], args=[token] + args, client=pipe)
+        pipe.execute()
+
+    def get(self, device_id=None):
+        if device_id is not None:
+            tokens = [str(device_id)]
+        else:
+            tokens = sorted(t.decode() for t in self.client.smembers(self._devices_key))
+        pipe = self.client.pipeline(transaction=False)
+        for token in tokens:
+            pipe.hgetall(self._device_key(token))
+        values = {}
+        for token, fields in zip(tokens, pipe.execute()):
+            metrics = {}
+            for metric, payload in fields.items():
+                micros, value, unit = payload.decode().split("|", 2)
+                metrics[metric.decode() or None] = (int(micros), float(value), unit or None)
+            values[None if token == NO_DEVICE else int(token)] = metrics
+        return values
+
+
+class LastValueCache:
+    """
+    Newest reading per device and metric, updated from committed bulk writer
+    batches and warmed from the database with one grouped query. Reads are a
+    dict lookup (local) or one hash read per device (Redis). If Redis fails,
+    reads and writes fall back to the local copy, which every write also updates.
+    """
+
+    def __init__(self, backend=None):
+        self.local = LocalBackend()
+        self.backend = backend
+        self._warmed = False
+        self._warm_lock = threading.Lock()
+
+    def apply_rows(self, rows):
+        """Bulk writer commit listener."""
+        entries = newest_entries(rows)
+        if not entries:
+            return
+        self.local.update(entries)
+        if self.backend is not None:
+            try:
+                self.backend.update(entries)
+            except Exception as e:
+                logger.error(f"Last-value backend update failed, keeping local copy only: {e}")
+
+    def warm(self):
+        """
+        Load the newest reading of every series from the database, sensor_data
+        rows and each sample column alike.
+        :return: Number of readings loaded (at most one per series and table).
+        """
+        with self._warm_lock:
+            with db_session_scope(readonly=True) as session:
+                latest = session.query(
+                    SensorData.device_id,
+                    SensorData.metric_id,
+                    func.max(SensorData.timestamp).label("timestamp"),
+                ).group_by(SensorData.device_id, SensorData.metric_id).subquery()
+                rows = session.query(
+                    SensorData.device_id, SensorData.metric_id, SensorData.timestamp, SensorData.value
+                ).join(latest, and_(
+                    SensorData.device_id.is_not_distinct_from(latest.c.device_id),
+                    SensorData.metric_id.is_not_distinct_from(latest.c.metric_id),
+                    SensorData.timestamp == latest.c.timestamp,
+                )).all()
+                entries = [
+                    dict(zip(("metric", "unit"), metric_dictionary.lookup(row.metric_id)),
+                         device_id=row.device_id, timestamp=row.timestamp, value=row.value)
+                    for row in rows
+                ]
+                for metric, unit in SAMPLE_METRICS.items():
+                    column = getattr(SensorSample, metric)
+                    latest = session.query(
+                        SensorSample.device_id, func.max(SensorSample.timestamp).label("timestamp")
+                    ).filter(column.isnot(None)).group_by(SensorSample.device_id).subquery()
+                    entries.extend(
+                        {"device_id": device_id, "metric": metric, "unit": unit, "timestamp": timestamp, "value": value}
+                        for device_id, timestamp, value in session.query(
+                            SensorSample.device_id, SensorSample.timestamp, column
+                        ).join(latest, and_(
+                            SensorSample.device_id.is_not_distinct_from(latest.c.device_id),
+                            SensorSample.timestamp == latest.c.timestamp,
+                        )).filter(column.isnot(None))
+                    )
+            self.apply_rows(entries)
+            self._warmed = True
+        logger.info(f"Last-value cache warmed with {len(entries)} readings")
+        return len(entries)
+
+    def latest(self, device_id=None):
+        """
+        :param device_id: Only this device, or None for every device.
+        :return: Dict of device_id -> {metric: (epoch micros, value, unit)}.
+        """
+        if not self._warmed:
+            self.warm()
+        if self.backend is not None:
+            try:
+                return self.backend.get(device_id)
+            except Exception as e:
+                logger.error(f"Last-value backend read failed, serving local copy: {e}")
+        return self.local.get(device_id)
+
+    def as_records(self, device_id=None):
+        """Latest values as a flat list of JSON-ready dicts."""
+        records = []
+        for device, metrics in self.latest(device_id).items():
+            for metric, (micros, value, unit) in metrics.items():
+                records.append({
+                    "device_id": device,
+                    "metric": metric,
+                    "timestamp": from_micros(micros).isoformat(),
+                    "value": value,
+                    "unit": unit,
+                })
+        return records
+
+
+def create_backend(name, redis_url):
+    if name == "redis":
+        return RedisBackend(redis.Redis.from_url(redis_url))
+    if name != "local":
+        raise ValueError(f"Unknown last-value backend: {name}")
+    return None
+
+
+last_value_cache = LastValueCache(create_backend(config.LAST_VALUE_BACKEND, config.LAST_VALUE_REDIS_URL))
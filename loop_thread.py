@@ -0,0 +1,155 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+import asyncio
+import contextvars
+import logging
+import signal
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def handle_asyncio_exception(loop, context):
+    msg = context.get("exception", context["message"])
+    logger.error(f"Caught exception: {msg}")
+
+
+async def _in_context(context, coro):
+    # A task copies the context it is created in, so create it inside the caller's.
+    return await context.run(asyncio.ensure_future, coro)
+
+
+class BackgroundLoop:
+    """
+    One asyncio event loop on a daemon thread, shared by all sync code.
+    Loop-bound state such as pooled BLE links and notification subscriptions
+    lives on it for the life of the process, so Flask routes, APScheduler jobs
+    and Celery tasks all reuse it instead of creating loops of their own:
+        future = background_loop.submit(coro)       # concurrent.futures.Future
+        result = background_loop.run(coro, timeout=10)
+    The thread starts on first use. stop() awaits the shutdown hooks on the
+    loop, cancels whatever is still running and joins the thread.
+    """
+
+    def __init__(self, name="asyncio-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._shutdown_hooks = []
+
+    @property
+    def loop(self):
+        self.start()
+        return self._loop
+
+    def start(self):
+        with self._start_lock:
+            if self.is_running():
+                return
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"Background asyncio loop started on thread {self.name}")
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive() and self._loop and self._loop.is_running())
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self._thread
+
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_exception_handler(handle_asyncio_exception)
+        self._loop = loop
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the loop from any other thread. It runs in a copy
+        of the caller's context, so Flask's current_app and request stay available.
+        :return: concurrent.futures.Future with the coroutine's result.
+        :raises RuntimeError: When called from the loop thread itself, where waiting would deadlock.
+        """
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("Called from the background loop thread; await the coroutine instead")
+        self.start()
+        return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), self._loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the loop and block until it finishes.
+        :param timeout: Seconds to wait, or None to wait as long as it takes.
+        :raises TimeoutError: When it does not finish in time; the coroutine is then cancelled.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Coroutine did not finish within {timeout}s")
+
+    def add_shutdown_hook(self, hook):
+        """Register a coroutine function for stop() to await on the loop; hooks run last added first."""
+        self._shutdown_hooks.append(hook)
+
+    async def _run_shutdown_hooks(self):
+        for hook in reversed(self._shutdown_hooks):
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Shutdown hook {getattr(hook, '__qualname__', hook)} failed: {e}")
+
+    def stop(self, timeout=10):
+        """Await the shutdown hooks, then stop the loop and join its thread."""
+        if not self.is_running() or self.in_loop_thread():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._run_shutdown_hooks(), self._loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.warning(f"Shutdown hooks did not finish within {timeout}s: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        logger.info("Background asyncio loop stopped")
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        """
+        Stop the loop cleanly on SIGTERM/SIGINT, then hand the signal to the
+        previous handler, or exit so atexit handlers drain the writers.
+        Only possible from the main thread.
+        :return: True if the handlers were installed.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("Signal handlers can only be installed from the main thread")
+            return False
+        for signum in signals:
+            previous = signal.getsignal(signum)
+            if getattr(previous, "func", None) == self._handle_signal:
+                continue
+            signal.signal(signum, partial(self._handle_signal, previous))
+        return True
+
+    def _handle_signal(self, previous, signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}; shutting down gracefully...")
+        self.stop()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            raise SystemExit(0)
+
+
+background_loop = BackgroundLoop()
@@ -2,6 +2,8 @@ from utils import setup_logging, logger
 from database import db_session_scope, Session as db
 from config import TARGET_MAC_ADDRESS, DEVICE_NAME, SQLALCHEMY_TRACK_MODIFICATIONS, SQLALCHEMY_DATABASE_URI
 from discovery import discover_devices, get_discovered_data
+from loop_thread import background_loop
+from config import config
 from __init__ import create_app
 from web_routes import web
 from api_routes import api 
@@ -37,9 +39,12 @@ def configure_app(app):
 
 configure_app(app)
 
+# BLE work runs on the shared background loop; SIGINT/SIGTERM stop it before the process exits.
+background_loop.install_signal_handlers()
+
 def run_discovery_on_startup():
     try:
-        discovered_data = get_discovered_data()
+        discovered_data = background_loop.run(get_discovered_data(), config.ASYNC_CALL_TIMEOUT)
         if validate_data(discovered_data):
             with db_session_scope() as session:
                 session.add(discovered_data)
@@ -57,7 +62,7 @@ def continuous_discovery():
 def discover_and_store_data():
     with app.app_context():
         try:
-            discovered_data = get_discovered_data()
+            discovered_data = background_loop.run(get_discovered_data(), config.ASYNC_CALL_TIMEOUT)
             if validate_data(discovered_data):
                 with db_session_scope() as session:  # Using the context manager
                     session.add(discovered_data)
@@ -70,7 +75,7 @@ def validate_data(data, retries=0):
     if "error" in data and retries < MAX_RETRIES:
         retries += 1
         logger.info("Discovery started...")
-        discovered_data = get_discovered_data()
+        discovered_data = background_loop.run(get_discovered_data(), config.ASYNC_CALL_TIMEOUT)
         logger.info(f"Discovered data: {discovered_data}")
         return validate_data(discovered_data, retries)
     elif retries >= MAX_RETRIES:
@@ -79,7 +84,7 @@ def validate_data(data, retries=0):
     else:
         return True
 try:
-    discovered_data = get_discovered_data()
+    discovered_data = background_loop.run(get_discovered_data(), config.ASYNC_CALL_TIMEOUT)
     if validate_data(discovered_data):
         with db_session_scope() as session:
             session.add(discovered_data)
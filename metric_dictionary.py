@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from config import config
+from database import engine, read_engine
+from models import Metric
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MetricDictionary:
+    """
+    In-process cache of the metrics table, mapping (metric, unit) pairs to the
+    integer ids stored on sensor_data rows.
+    Ids never change once assigned, so id -> pair lookups are always served
+    from the cache after one reload on a miss. Name -> ids lookups used by read
+    filters reload at most every ttl seconds, so a unit first written by
+    another process shows up in filters within that time.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._by_id = {}
+        self._by_pair = {}
+        self._by_name = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with read_engine.connect() as connection:
+            entries = connection.execute(select(Metric.id, Metric.name, Metric.unit)).all()
+        with self._lock:
+            for metric_id, name, unit in entries:
+                self._add(metric_id, name, unit)
+            self._loaded_at = time.monotonic()
+        return len(entries)
+
+    def _add(self, metric_id, name, unit):
+        if metric_id in self._by_id:
+            return
+        self._by_id[metric_id] = (name, unit)
+        self._by_pair.setdefault((name, unit), metric_id)
+        self._by_name.setdefault(name, []).append(metric_id)
+
+    def _stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def id_for(self, name, unit):
+        """Id of a (metric, unit) pair, created in its own committed transaction when new."""
+        metric_id = self._by_pair.get((name, unit))
+        if metric_id is not None:
+            return metric_id
+        self.load()
+        metric_id = self._by_pair.get((name, unit))
+        if metric_id is not None:
+            return metric_id
+        try:
+            with engine.begin() as connection:
+                metric_id = connection.execute(insert(Metric).values(name=name, unit=unit)).inserted_primary_key[0]
+            logger.info(f"Registered metric {name!r} ({unit!r}) as id {metric_id}")
+            with self._lock:
+                self._add(metric_id, name, unit)
+        except IntegrityError:
+            # Another process registered it first.
+            self.load()
+            metric_id = self._by_pair[(name, unit)]
+        return metric_id
+
+    def find_id(self, name, unit):
+        """Id of a (metric, unit) pair, or None when it was never registered. Never writes, so safe on read paths."""
+        metric_id = self._by_pair.get((name, unit))
+        if metric_id is None:
+            self.load()
+            metric_id = self._by_pair.get((name, unit))
+        return metric_id
+
+    def ids(self, name):
+        """Ids of every unit recorded for a metric name, for read filters."""
+        if self._stale() or name not in self._by_name:
+            self.load()
+        return list(self._by_name.get(name, ()))
+
+    def lookup(self, metric_id):
+        """:return: (metric, unit) of an id, (None, None) for rows without one (None or -1)."""
+        if metric_id is None or metric_id < 0:
+            return None, None
+        if metric_id not in self._by_id:
+            self.load()
+        return self._by_id.get(metric_id, (None, None))
+
+    def names(self, metric_ids):
+        """Metric names for an int64 array of ids (-1 for none), as an object array."""
+        unique, inverse = np.unique(np.asarray(metric_ids, dtype=np.int64), return_inverse=True)
+        names = np.empty(len(unique), dtype=object)
+        names[:] = [self.lookup(int(metric_id))[0] for metric_id in unique]
+        return names[inverse]
+
+    def to_storage(self, rows):
+        """Turn SensorData mappings with metric/unit strings into insert mappings with metric_id."""
+        return [
+            {
+                "timestamp": row["timestamp"],
+                "device_id": row.get("device_id"),
+                "metric_id": self.id_for(row.get("metric"), row.get("unit")),
+                "value": row.get("value"),
+            }
+            for row in rows
+        ]
+
+
+metric_dictionary = MetricDictionary(config.METRIC_DICTIONARY_TTL)
@@ -0,0 +1,319 @@
+from datetime import datetime, timedelta
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import (
+    Column, DateTime, Float, Index, Integer, MetaData, String, Table, create_engine, insert, inspect, select, text,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+# Indexes for time-range and latest-value reads on sensor_data.
+# ix_sensor_data_series serves per-device/metric ranges and latest-per-series lookups;
+# ix_sensor_data_time_covering serves global time ranges and ORDER BY timestamp DESC
+# without visiting the table.
+SENSOR_DATA_INDEXES = {
+    "ix_sensor_data_series": "sensor_data (device_id, metric, timestamp)",
+    "ix_sensor_data_time_covering": "sensor_data (timestamp, device_id, metric, value)",
+}
+
+
+def create_indexes(connection, indexes):
+    """
+    Create indexes on an existing database.
+    On PostgreSQL they are built CONCURRENTLY so writers are not blocked. SQLite has no
+    online index build; in WAL mode readers keep going while the build holds the write
+    lock, and ingest waits in the pipeline/spool until it finishes.
+    """
+    dialect = connection.dialect.name
+    for name, target in indexes.items():
+        if dialect == "postgresql":
+            connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}"))
+        else:
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+        logger.info(f"Ensured index {name} on {target}")
+
+
+def sensor_data_columns(connection):
+    return {column["name"] for column in inspect(connection).get_columns("sensor_data")}
+
+
+def add_sensor_data_indexes(connection):
+    # Tables created in the dictionary layout (migration 3) get their indexes from the model.
+    if "metric_id" in sensor_data_columns(connection):
+        return
+    create_indexes(connection, SENSOR_DATA_INDEXES)
+
+
+def add_keyset_index(connection):
+    create_indexes(connection, {"ix_sensor_data_timestamp_id": "sensor_data (timestamp, id)"})
+
+
+def normalize_sensor_data(connection):
+    """
+    Move sensor_data to the dictionary layout: metric/unit strings become a
+    metric_id into metrics, timestamps become epoch milliseconds and the
+    created_at/updated_at columns are dropped. Neither SQLite nor the model can
+    change a column type in place, so the table is rebuilt in one transaction:
+    the old table is renamed, the new one created from the model and filled by
+    a single INSERT ... SELECT. Needs free disk space for a second copy of the
+    table while it runs; ingest waits in the pipeline/spool meanwhile.
+    """
+    from models import Metric, SensorData
+
+    if "metric_id" in sensor_data_columns(connection):
+        return
+    if connection.dialect.name == "postgresql":
+        millis = "CAST(FLOOR(EXTRACT(EPOCH FROM s.timestamp) * 1000) AS BIGINT)"
+        same = "IS NOT DISTINCT FROM"
+    else:
+        millis = "CAST(strftime('%s', s.timestamp) AS INTEGER) * 1000 + CAST(substr(strftime('%f', s.timestamp), 4, 3) AS INTEGER)"
+        same = "IS"
+    connection.execute(text("BEGIN"))
+    try:
+        Metric.__table__.create(connection, checkfirst=True)
+        connection.execute(text(
+            "INSERT INTO metrics (name, unit) SELECT DISTINCT s.metric, s.unit FROM sensor_data s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM metrics m WHERE m.name {same} s.metric AND m.unit {same} s.unit)"
+        ))
+        for index in SensorData.__table__.indexes:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        connection.execute(text("ALTER TABLE sensor_data RENAME TO sensor_data_legacy"))
+        SensorData.__table__.create(connection)
+        moved = connection.execute(text(
+            f"INSERT INTO sensor_data (id, timestamp, value, metric_id, device_id) "
+            f"SELECT s.id, {millis}, s.value, m.id, s.device_id FROM sensor_data_legacy s "
+            f"LEFT JOIN metrics m ON m.name {same} s.metric AND m.unit {same} s.unit"
+        )).rowcount
+        connection.execute(text("DROP TABLE sensor_data_legacy"))
+        if connection.dialect.name == "postgresql":
+            connection.execute(text(
+                "SELECT setval(pg_get_serial_sequence('sensor_data', 'id'), COALESCE(MAX(id), 1)) FROM sensor_data"
+            ))
+        connection.execute(text("COMMIT"))
+    except Exception:
+        connection.execute(text("ROLLBACK"))
+        raise
+    logger.info(f"Rebuilt sensor_data with {moved} rows in the metric dictionary layout")
+
+
+def register_sample_metrics(connection):
+    """
+    Give every sample column its metrics row, so the long-shape reads of
+    sensor_samples only ever look metric ids up instead of inserting them.
+    """
+    from models import SAMPLE_METRICS, Metric
+
+    Metric.__table__.create(connection, checkfirst=True)
+    existing = {tuple(row) for row in connection.execute(select(Metric.name, Metric.unit))}
+    missing = [{"name": name, "unit": unit} for name, unit in SAMPLE_METRICS.items() if (name, unit) not in existing]
+    if missing:
+        connection.execute(insert(Metric), missing)
+        logger.info(f"Registered sample metrics {[row['name'] for row in missing]}")
+
+
+# Ordered list of (version, name, upgrade). Append only; never renumber.
+MIGRATIONS = [
+    (1, "sensor_data_time_series_indexes", add_sensor_data_indexes),
+    (2, "sensor_data_keyset_index", add_keyset_index),
+    (3, "sensor_data_metric_dictionary", normalize_sensor_data),
+    (4, "register_sample_metrics", register_sample_metrics),
+]
+
+
+def applied_versions(connection):
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} "
+        "(version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+    return {row[0] for row in connection.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))}
+
+
+def run_migrations(engine):
+    """
+    Apply pending migrations in version order. Each migration runs on its own
+    autocommit connection, so a failure leaves earlier versions recorded.
+    :return: List of versions applied by this call.
+    """
+    applied = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        done = applied_versions(connection)
+        for version, name, upgrade in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            upgrade(connection)
+            connection.execute(
+                text(f"INSERT INTO {MIGRATIONS_TABLE} (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": name, "applied_at": datetime.utcnow()},
+            )
+            applied.append(version)
+    return applied
+
+
+def explain(connection, sql, params=None):
+    """
+    Return the query plan for a SQL statement as a list of strings.
+    Uses EXPLAIN QUERY PLAN on SQLite and EXPLAIN elsewhere.
+    """
+    prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    return [" ".join(str(column) for column in row) for row in connection.execute(text(prefix + sql), params or {})]
+
+
+# Hot read queries and the index each one must use.
+INDEXED_QUERIES = [
+    (
+        "filter_data time range",
+        "SELECT timestamp, value FROM sensor_data WHERE timestamp BETWEEN :start AND :end",
+        "ix_sensor_data_time_covering",
+    ),
+    (
+        "latest_data",
+        "SELECT timestamp, device_id, metric_id, value FROM sensor_data ORDER BY timestamp DESC LIMIT 1",
+        "ix_sensor_data_time_covering",
+    ),
+    (
+        "per-device series range",
+        "SELECT timestamp, value FROM sensor_data WHERE device_id = :device_id AND metric_id = :metric_id "
+        "AND timestamp BETWEEN :start AND :end ORDER BY timestamp",
+        "ix_sensor_data_series",
+    ),
+    (
+        "latest per device/metric",
+        "SELECT timestamp, value FROM sensor_data WHERE device_id = :device_id AND metric_id = :metric_id "
+        "ORDER BY timestamp DESC LIMIT 1",
+        "ix_sensor_data_series",
+    ),
+    (
+        "keyset page",
+        "SELECT id, timestamp, value FROM sensor_data WHERE timestamp <= :end AND (timestamp < :end OR id < :id) "
+        "ORDER BY timestamp DESC, id DESC LIMIT 11",
+        "ix_sensor_data_timestamp_id",
+    ),
+]
+
+
+def verify_indexes(engine):
+    """
+    EXPLAIN the hot read queries and check each plan uses its index.
+    :return: List of (query name, plan, ok) tuples.
+    """
+    params = {"start": 946684800000, "end": 4102444800000, "device_id": 1, "metric_id": 1, "id": 1}
+    results = []
+    with engine.connect() as connection:
+        for name, sql, index in INDEXED_QUERIES:
+            plan = explain(connection, sql, params)
+            ok = any(index in line for line in plan)
+            results.append((name, plan, ok))
+            if not ok:
+                logger.warning(f"Query '{name}' does not use {index}: {plan}")
+    return results
+
+
+def legacy_sensor_data(metadata):
+    """sensor_data as it was before migration 3, for the layout benchmark."""
+    return Table(
+        "sensor_data", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("timestamp", DateTime),
+        Column("value", Float),
+        Column("metric", String),
+        Column("unit", String),
+        Column("device_id", Integer),
+        Column("created_at", DateTime),
+        Column("updated_at", DateTime),
+        Index("ix_sensor_data_series", "device_id", "metric", "timestamp"),
+        Index("ix_sensor_data_time_covering", "timestamp", "device_id", "metric", "value"),
+        Index("ix_sensor_data_timestamp_id", "timestamp", "id"),
+    )
+
+
+def benchmark(rows=1_000_000, batch_size=500, devices=50):
+    """
+    Insert the same readings into the legacy and the dictionary layout of
+    sensor_data, each in a scratch SQLite file with the configured pragmas and
+    in bulk-writer sized transactions. Only the inserts are timed.
+    :return: List of (layout, rows per second, file bytes, bytes per row).
+    """
+    from config import config
+    from database import apply_sqlite_pragmas
+    from models import Metric, SensorData
+
+    metrics = [("temperature", "C"), ("humidity", "%")]
+    start = datetime(2024, 1, 1)
+
+    def batches():
+        for offset in range(0, rows, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, rows)):
+                # One temperature and one humidity reading per sample, every 10 s per device.
+                sample = i // 2
+                metric, unit = metrics[i % 2]
+                batch.append((
+                    start + timedelta(seconds=sample // devices * 10, milliseconds=sample * 7919 % 1000),
+                    round(20 + (i * 7 % 100) / 10, 1), metric, unit, sample % devices,
+                ))
+            yield batch
+
+    results = []
+    for layout in ("legacy", "dictionary"):
+        path = os.path.join(tempfile.mkdtemp(), f"{layout}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        apply_sqlite_pragmas(engine, config.SQLITE_PRAGMAS)
+        if layout == "legacy":
+            table = legacy_sensor_data(MetaData())
+            table.metadata.create_all(engine)
+        else:
+            table = SensorData.__table__
+            table.metadata.create_all(engine, tables=[Metric.__table__, table])
+            with engine.begin() as connection:
+                connection.execute(insert(Metric), [{"id": i, "name": n, "unit": u} for i, (n, u) in enumerate(metrics, 1)])
+        ids = {pair: i for i, pair in enumerate(metrics, 1)}
+        elapsed = 0.0
+        for batch in batches():
+            if layout == "legacy":
+                now = datetime.utcnow()
+                mappings = [
+                    {"timestamp": t, "value": v, "metric": m, "unit": u, "device_id": d, "created_at": now, "updated_at": now}
+                    for t, v, m, u, d in batch
+                ]
+            else:
+                mappings = [
+                    {"timestamp": t, "value": v, "metric_id": ids[(m, u)], "device_id": d} for t, v, m, u, d in batch
+                ]
+            started = time.perf_counter()
+            with engine.begin() as connection:
+                connection.execute(insert(table), mappings)
+            elapsed += time.perf_counter() - started
+        engine.dispose()
+        size = os.path.getsize(path)
+        results.append((layout, rows / elapsed, size, size / rows))
+        os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        print(f"Applied migrations: {run_migrations(engine) or 'none pending'}")
+    elif command == "verify":
+        results = verify_indexes(engine)
+        for name, plan, ok in results:
+            print(f"{'OK  ' if ok else 'FAIL'} {name}: {' | '.join(plan)}")
+        sys.exit(0 if all(ok for _, _, ok in results) else 1)
+    elif command == "bench":
+        # python migrations.py bench [rows]
+        print(f"{'layout':<12} {'rows/s':>10} {'file bytes':>14} {'bytes/row':>10}")
+        for layout, rate, size, per_row in benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000):
+            print(f"{layout:<12} {rate:>10,.0f} {size:>14,} {per_row:>10.1f}")
+    else:
+        print("Usage: python migrations.py [upgrade|verify|bench [rows]]")
+        sys.exit(2)
@@ -1,9 +1,31 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, Boolean, func
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Float, DateTime, Boolean, Index, LargeBinary, Text, UniqueConstraint, func
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from base import Base
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Boolean, DateTime
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1)
+
+# Metrics stored as columns of sensor_samples and the unit a reading must carry to go there.
+# Order matters: a sample's long-shape id is -(sample id * len(SAMPLE_METRICS) + slot + 1).
+SAMPLE_METRICS = {"temperature": "C", "humidity": "%"}
+
+class EpochMillis(TypeDecorator):
+    """Naive UTC datetimes stored as integer epoch milliseconds; aware ones are converted to UTC."""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return (value - EPOCH) // timedelta(milliseconds=1)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else EPOCH + timedelta(milliseconds=value)
 
 class Device(Base):
     __tablename__ = 'devices'
@@ -20,20 +42,101 @@ class Device(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     device_detail = relationship('DeviceDetail', uselist=False, back_populates='device')
 
+class Metric(Base):
+    __tablename__ = 'metrics'
+
+    # Dictionary of (metric, unit) pairs referenced by sensor_data rows; see metric_dictionary.py.
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    unit = Column(String)
+
+    __table_args__ = (
+        UniqueConstraint('name', 'unit', name='uq_metrics_name_unit'),
+    )
+
 class SensorData(Base):
     __tablename__ = 'sensor_data'
 
+    # Readings are immutable, so there are no audit columns; metric and unit live in metrics.
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime)
+    timestamp = Column(EpochMillis)
     value = Column(Float)
-    metric = Column(String)
-    unit = Column(String)
+    metric_id = Column(Integer, ForeignKey('metrics.id'))
     device_id = Column(Integer, ForeignKey('devices.id'))
 
     device = relationship('Device', back_populates='sensor_data')
 
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Existing databases get these through migrations.py.
+    __table_args__ = (
+        Index('ix_sensor_data_series', 'device_id', 'metric_id', 'timestamp'),
+        Index('ix_sensor_data_time_covering', 'timestamp', 'device_id', 'metric_id', 'value'),
+        Index('ix_sensor_data_timestamp_id', 'timestamp', 'id'),
+    )
+
+class SensorSample(Base):
+    __tablename__ = 'sensor_samples'
+
+    # One row per device and timestamp carrying every metric of SAMPLE_METRICS
+    # as a column (NULL when the reading did not include it); other metrics stay in sensor_data.
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(EpochMillis)
+    device_id = Column(Integer, ForeignKey('devices.id'))
+    temperature = Column(Float)
+    humidity = Column(Float)
+
+    __table_args__ = (
+        Index('ix_sensor_samples_device_time', 'device_id', 'timestamp'),
+        Index('ix_sensor_samples_timestamp_id', 'timestamp', 'id'),
+    )
+
+class SensorRollup(Base):
+    __tablename__ = 'sensor_rollups'
+
+    # Bucket width in seconds (60, 3600 or 86400) and bucket start as epoch seconds.
+    resolution = Column(Integer, primary_key=True)
+    device_id = Column(Integer, primary_key=True)  # 0 for readings without a device
+    metric = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    last = Column(Float, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+
+class SensorBlock(Base):
+    __tablename__ = 'sensor_blocks'
+
+    # Compacted readings of one series (device, metric, unit) within one block span,
+    # Gorilla-encoded by gorilla.encode_block. Times are epoch microseconds, inclusive.
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer)
+    metric = Column(String)
+    unit = Column(String)
+    start_us = Column(BigInteger, nullable=False)
+    end_us = Column(BigInteger, nullable=False)
+    count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index('ix_sensor_blocks_series', 'metric', 'device_id', 'start_us'),
+        Index('ix_sensor_blocks_start', 'start_us'),
+    )
+
+class GattTable(Base):
+    __tablename__ = 'gatt_tables'
+
+    # Cached GATT table of one peripheral as JSON (see gatt_cache.py). database_hash and
+    # firmware are the values the device reported, compared to decide whether it changed.
+    id = Column(Integer, primary_key=True)
+    address = Column(String, unique=True, nullable=False)
+    services = Column(Text, nullable=False)
+    attribute_hash = Column(String(64), nullable=False)
+    database_hash = Column(String)
+    firmware = Column(String)
+    discovered_at = Column(DateTime, nullable=False)
+    checked_at = Column(DateTime, nullable=False)
 
 class DeviceDetail(Base):
     __tablename__ = 'device_details'
@@ -0,0 +1,113 @@
+from datetime import datetime
+import base64
+import json
+
+from sqlalchemy import or_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+    pass
+
+
+def encode_cursor(timestamp, row_id, direction):
+    """
+    Build an opaque cursor pointing at a (timestamp, id) position.
+    :param direction: "next" for older rows, "prev" for newer rows.
+    """
+    raw = json.dumps([timestamp.isoformat(), row_id, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    :return: Tuple of (timestamp, id, direction).
+    :raises InvalidCursor: When the token is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        timestamp, row_id, direction = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ("next", "prev") or not isinstance(row_id, int):
+            raise ValueError("bad cursor fields")
+        return datetime.fromisoformat(timestamp), row_id, direction
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+
+def clamp_limit(limit, default, maximum):
+    if not limit or limit < 1:
+        return default
+    return min(limit, maximum)
+
+
+def _seek(query, timestamp_column, id_column, limit, cursor):
+    """Rows of one query past the cursor in page order, at most limit + 1 of them."""
+    direction = "next"
+    if cursor:
+        timestamp, row_id, direction = decode_cursor(cursor)
+        if direction == "next":
+            # The redundant bound on timestamp lets the planner seek the index
+            # instead of expanding the OR into two scans.
+            query = query.filter(
+                timestamp_column <= timestamp,
+                or_(timestamp_column < timestamp, id_column < row_id),
+            )
+        else:
+            query = query.filter(
+                timestamp_column >= timestamp,
+                or_(timestamp_column > timestamp, id_column > row_id),
+            )
+    if direction == "next":
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(timestamp_column.asc(), id_column.asc())
+    return query.limit(limit + 1).all(), direction
+
+
+def _page(rows, limit, direction, cursor):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+    first, last = rows[0], rows[-1]
+    more_older = has_more if direction == "next" else True
+    more_newer = bool(cursor) if direction == "next" else has_more
+    next_cursor = encode_cursor(last.timestamp, last.id, "next") if more_older else None
+    prev_cursor = encode_cursor(first.timestamp, first.id, "prev") if more_newer else None
+    return rows, next_cursor, prev_cursor
+
+
+def keyset_page(query, timestamp_column, id_column, limit, cursor=None):
+    """
+    Fetch one page of rows ordered newest first by (timestamp, id).
+    Seeks past the cursor position instead of using OFFSET, so every page
+    costs the same and rows inserted meanwhile do not shift page contents.
+    :return: Tuple of (rows, next_cursor, prev_cursor); a cursor is None when there is nothing that way.
+    """
+    rows, direction = _seek(query, timestamp_column, id_column, limit, cursor)
+    return _page(rows, limit, direction, cursor)
+
+
+def merged_keyset_page(sources, limit, cursor=None, seekers=()):
+    """
+    keyset_page over several queries whose rows share one (timestamp, id) order,
+    such as the branches of samples.reading_selects. Each query is seeked on its
+    own index and the pages are merged here, which stays cheap where sorting the
+    UNION of the queries in SQL would read the whole range.
+    :param sources: List of (query, timestamp column, id column).
+    :param seekers: Callables for rows that do not come from a query, such as compacted
+        blocks: seeker(limit, timestamp, row_id, direction) returns at most limit rows past
+        the position (timestamp and row_id are None on the first page) in page order.
+    """
+    rows, direction = [], "next"
+    for query, timestamp_column, id_column in sources:
+        found, direction = _seek(query, timestamp_column, id_column, limit, cursor)
+        rows.extend(found)
+    if seekers:
+        timestamp, row_id, direction = decode_cursor(cursor) if cursor else (None, None, "next")
+        for seek in seekers:
+            rows.extend(seek(limit + 1, timestamp, row_id, direction))
+    rows.sort(key=lambda row: (row.timestamp, row.id), reverse=direction == "next")
+    return _page(rows[:limit + 1], limit, direction, cursor)
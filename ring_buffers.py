@@ -0,0 +1,209 @@
+from datetime import datetime, timedelta
+import logging
+import threading
+
+import numpy as np
+
+from config import config
+from watermarks import device_scope, ingest_watermarks, now_micros
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+class SeriesRing:
+    """
+    Fixed-capacity ring of one series: int64 epoch-microsecond timestamps and
+    float32 values, oldest to newest from tail to head. covered_from is the
+    earliest timestamp from which the ring holds every reading of the series.
+    """
+
+    def __init__(self, capacity, covered_from):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+        self.covered_from = covered_from
+        self.updated = 0
+
+    @property
+    def newest(self):
+        if not self.size:
+            return None
+        return int(self.timestamps[(self.start + self.size - 1) % self.capacity])
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+    def append(self, timestamps, values, window):
+        """
+        Append readings sorted by time. A reading older than the newest one
+        held cannot be placed, so coverage moves past it instead.
+        """
+        for timestamp, value in zip(timestamps.tolist(), values.tolist()):
+            newest = self.newest
+            if newest is not None and timestamp < newest:
+                self.covered_from = max(self.covered_from, timestamp + 1)
+                continue
+            end = (self.start + self.size) % self.capacity
+            self.timestamps[end] = timestamp
+            self.values[end] = value
+            if self.size == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+                self.covered_from = max(self.covered_from, int(self.timestamps[self.start]))
+            else:
+                self.size += 1
+        if self.size:
+            self.evict_before(self.newest - window)
+
+    def evict_before(self, cutoff):
+        """Drop readings older than cutoff (epoch micros)."""
+        if not self.size:
+            return
+        ordered = self._ordered_timestamps()
+        drop = int(np.searchsorted(ordered, cutoff, side="left"))
+        if drop:
+            self.start = (self.start + drop) % self.capacity
+            self.size -= drop
+        self.covered_from = max(self.covered_from, cutoff)
+
+    def reset(self, covered_from):
+        self.start = 0
+        self.size = 0
+        self.covered_from = covered_from
+
+    def _ordered_timestamps(self):
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.timestamps[self.start:end]
+        return np.concatenate((self.timestamps[self.start:], self.timestamps[:end - self.capacity]))
+
+    def _ordered_values(self):
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.values[self.start:end]
+        return np.concatenate((self.values[self.start:], self.values[:end - self.capacity]))
+
+    def slice(self, start_us, end_us):
+        """Readings with start_us <= timestamp <= end_us, as (timestamps, values) copies."""
+        timestamps = self._ordered_timestamps()
+        lo = int(np.searchsorted(timestamps, start_us, side="left"))
+        hi = int(np.searchsorted(timestamps, end_us, side="right"))
+        return timestamps[lo:hi].copy(), self._ordered_values()[lo:hi].copy()
+
+
+class RecentWindow:
+    """
+    Per (device, metric) ring buffers of the last window_seconds of readings,
+    filled from committed bulk writer batches.
+
+    A ring only answers while this process made the latest write for its
+    device: each batch's watermark bump returns the previous mark, and if that
+    is not the mark this process last saw, another process wrote in between and
+    the device's rings start over from the current time. Reads compare the
+    shared watermark the same way and fall back to the database on mismatch.
+    """
+
+    def __init__(self, window_seconds=1800, capacity=4096, max_series=1000):
+        self.window = window_seconds * 1_000_000
+        self.capacity = capacity
+        self.max_series = max_series
+        self._rings = {}
+        self._device_marks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_series = 0
+
+    def apply_rows(self, rows, marks):
+        """
+        Add a committed batch.
+        :param marks: Result of ingest_watermarks.apply_rows for the same batch.
+        """
+        by_series = {}
+        for row in rows:
+            if row.get("timestamp") is None or row.get("value") is None:
+                continue
+            by_series.setdefault((row.get("device_id"), row.get("metric")), []).append(
+                (to_micros(row["timestamp"]), row["value"])
+            )
+        now = now_micros()
+        with self._lock:
+            for device_id in {device_id for device_id, _ in by_series}:
+                previous, new = marks.get(device_scope(device_id), (None, None))
+                known = self._device_marks.get(device_id)
+                if new is None or previous is None or previous != known:
+                    # Someone else wrote this device (or history is unknown): nothing before now is covered.
+                    for (ring_device, _), ring in self._rings.items():
+                        if ring_device == device_id:
+                            ring.reset(now + 1)
+                self._device_marks[device_id] = new
+            for key, points in by_series.items():
+                ring = self._rings.get(key)
+                if ring is None:
+                    if len(self._rings) >= self.max_series:
+                        self._evict_stalest()
+                    ring = self._rings[key] = SeriesRing(self.capacity, covered_from=now + 1)
+                points.sort()
+                timestamps = np.fromiter((p[0] for p in points), dtype=np.int64, count=len(points))
+                values = np.fromiter((p[1] for p in points), dtype=np.float32, count=len(points))
+                ring.append(timestamps, values, self.window)
+                ring.updated = now
+            self._evict_idle(now)
+
+    def query(self, device_id, metric, start, end):
+        """
+        Readings of one series in [start, end] if the ring covers the range.
+        :return: Tuple of (epoch-micro timestamps, float32 values), or None to read the database.
+        """
+        start_us, end_us = to_micros(start), to_micros(end)
+        if not ingest_watermarks.shared:
+            # Writes of other workers would not show up in the mark compared below.
+            with self._lock:
+                self.misses += 1
+            return None
+        shared = ingest_watermarks.get(device_scope(device_id))
+        with self._lock:
+            ring = self._rings.get((device_id, metric))
+            if ring is not None and shared == self._device_marks.get(device_id) and start_us >= ring.covered_from:
+                self.hits += 1
+                return ring.slice(start_us, end_us)
+            self.misses += 1
+        return None
+
+    def _evict_stalest(self):
+        key = min(self._rings, key=lambda k: self._rings[k].updated)
+        del self._rings[key]
+        self.evicted_series += 1
+
+    def _evict_idle(self, now):
+        idle = [key for key, ring in self._rings.items() if ring.updated < now - self.window]
+        for key in idle:
+            del self._rings[key]
+        self.evicted_series += len(idle)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "series": len(self._rings),
+                "points": sum(ring.size for ring in self._rings.values()),
+                "bytes": sum(ring.nbytes for ring in self._rings.values()),
+                "max_bytes": self.max_series * self.capacity * (8 + 4),
+                "window_seconds": self.window // 1_000_000,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted_series": self.evicted_series,
+            }
+
+
+recent_window = RecentWindow(
+    config.RECENT_WINDOW_SECONDS, config.RECENT_WINDOW_CAPACITY, config.RECENT_WINDOW_MAX_SERIES
+)
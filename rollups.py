@@ -0,0 +1,291 @@
+from datetime import datetime, timedelta
+import itertools
+import logging
+import math
+import sys
+
+import numpy as np
+from sqlalchemy import case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from blocks import iter_block_rows
+from database import db_session_scope
+from metric_dictionary import metric_dictionary
+from models import SensorRollup
+from samples import readings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rollup bucket widths in seconds, finest first.
+RESOLUTIONS = (60, 3600, 86400)
+NO_DEVICE = 0
+EPOCH = datetime(1970, 1, 1)
+# Buckets per INSERT: 10 bound parameters each stays under SQLite's 32766 variable limit.
+UPSERT_CHUNK = 3000
+
+
+def to_epoch(timestamp):
+    return int((timestamp - EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def bucket_start(timestamp, resolution):
+    """Epoch second at which the bucket containing timestamp starts."""
+    return to_epoch(timestamp) // resolution * resolution
+
+
+def aggregate_rows(rows, resolutions=RESOLUTIONS):
+    """
+    Fold SensorData mappings into per-bucket partial aggregates.
+    :return: Dict of (resolution, device_id, metric, bucket) -> aggregate dict.
+    """
+    buckets = {}
+    for row in rows:
+        timestamp, value = row["timestamp"], row["value"]
+        if timestamp is None or value is None:
+            continue
+        device_id = row.get("device_id") or NO_DEVICE
+        for resolution in resolutions:
+            key = (resolution, device_id, row["metric"], bucket_start(timestamp, resolution))
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = {
+                    "count": 1, "sum": value, "min": value, "max": value,
+                    "last": value, "last_timestamp": timestamp,
+                }
+                continue
+            agg["count"] += 1
+            agg["sum"] += value
+            agg["min"] = min(agg["min"], value)
+            agg["max"] = max(agg["max"], value)
+            if timestamp >= agg["last_timestamp"]:
+                agg["last"], agg["last_timestamp"] = value, timestamp
+    return buckets
+
+
+def upsert_aggregates(session, buckets):
+    """
+    Merge partial aggregates into sensor_rollups with INSERT ... ON CONFLICT, UPSERT_CHUNK
+    buckets per statement. Dialects without it get a read-modify-write merge instead.
+    """
+    if not buckets:
+        return
+    values = [
+        dict(agg, resolution=resolution, device_id=device_id, metric=metric, bucket=bucket)
+        for (resolution, device_id, metric, bucket), agg in buckets.items()
+    ]
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        insert, least, greatest = pg_insert, func.least, func.greatest
+    elif dialect == "sqlite":
+        # SQLite's multi-argument min()/max() are scalar functions.
+        insert, least, greatest = sqlite_insert, func.min, func.max
+    else:
+        for start in range(0, len(values), UPSERT_CHUNK):
+            _merge_aggregates(session, values[start:start + UPSERT_CHUNK])
+        return
+    for start in range(0, len(values), UPSERT_CHUNK):
+        session.execute(_upsert_statement(insert(SensorRollup).values(values[start:start + UPSERT_CHUNK]), least, greatest))
+
+
+def _merge_aggregates(session, values):
+    """
+    Portable merge: lock the existing buckets, fold the new aggregates into
+    them and insert the rest. The filter may match a few unrelated buckets,
+    which are left as they are.
+    """
+    pending = {(v["resolution"], v["device_id"], v["metric"], v["bucket"]): v for v in values}
+    existing = session.query(SensorRollup).filter(
+        SensorRollup.resolution.in_({key[0] for key in pending}),
+        SensorRollup.device_id.in_({key[1] for key in pending}),
+        SensorRollup.metric.in_({key[2] for key in pending}),
+        SensorRollup.bucket.between(min(key[3] for key in pending), max(key[3] for key in pending)),
+    ).with_for_update()
+    for rollup in existing:
+        agg = pending.pop((rollup.resolution, rollup.device_id, rollup.metric, rollup.bucket), None)
+        if agg is None:
+            continue
+        rollup.count += agg["count"]
+        rollup.sum += agg["sum"]
+        rollup.min = min(rollup.min, agg["min"])
+        rollup.max = max(rollup.max, agg["max"])
+        if agg["last_timestamp"] >= rollup.last_timestamp:
+            rollup.last, rollup.last_timestamp = agg["last"], agg["last_timestamp"]
+    if pending:
+        session.bulk_insert_mappings(SensorRollup, list(pending.values()))
+    session.flush()
+
+
+def _upsert_statement(stmt, least, greatest):
+    table = SensorRollup.__table__
+    newer = stmt.excluded.last_timestamp >= table.c.last_timestamp
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["resolution", "device_id", "metric", "bucket"],
+        set_={
+            "count": table.c.count + stmt.excluded.count,
+            "sum": table.c.sum + stmt.excluded.sum,
+            "min": least(table.c.min, stmt.excluded.min),
+            "max": greatest(table.c.max, stmt.excluded.max),
+            "last": case((newer, stmt.excluded.last), else_=table.c.last),
+            "last_timestamp": case((newer, stmt.excluded.last_timestamp), else_=table.c.last_timestamp),
+        },
+    )
+    return stmt
+
+
+def apply_rows(session, rows):
+    """Bulk writer listener: fold a freshly inserted batch into the rollups in the same transaction."""
+    upsert_aggregates(session, aggregate_rows(rows))
+
+
+def backfill(start=None, end=None, chunk_size=10000):
+    """
+    Rebuild rollups from stored readings (sensor_data and sample rows) and compacted blocks.
+    The range is widened to whole days so no bucket is left half rebuilt. Rows
+    ingested into the range while the backfill runs are counted twice, so run it
+    over ranges that are no longer receiving data (or with ingest paused).
+    :return: Number of readings folded in.
+    """
+    coarsest = max(RESOLUTIONS)
+    start_bucket = bucket_start(start, coarsest) if start else None
+    end_bucket = bucket_start(end, coarsest) + coarsest if end else None
+    with db_session_scope() as session:
+        query = session.query(SensorRollup)
+        if start_bucket is not None:
+            query = query.filter(SensorRollup.bucket >= start_bucket)
+        if end_bucket is not None:
+            query = query.filter(SensorRollup.bucket < end_bucket)
+        deleted = query.delete(synchronize_session=False)
+    logger.info(f"Backfill cleared {deleted} rollup rows")
+
+    folded = 0
+    with db_session_scope(readonly=True) as reader:
+        stored = readings(
+            None if start_bucket is None else from_epoch(start_bucket),
+            None if end_bucket is None else from_epoch(end_bucket),
+        )
+        query = reader.query(stored.c.device_id, stored.c.metric_id, stored.c.timestamp, stored.c.value)
+        compacted = iter_block_rows(
+            reader,
+            -(1 << 62) if start_bucket is None else start_bucket * 1_000_000,
+            (1 << 62) if end_bucket is None else end_bucket * 1_000_000 - 1,
+        )
+        chunk = []
+        raw = (
+            (device_id, metric_dictionary.lookup(metric_id)[0], timestamp, value)
+            for device_id, metric_id, timestamp, value in query.yield_per(chunk_size)
+        )
+        for device_id, metric, timestamp, value in itertools.chain(
+            raw, ((device_id, metric, timestamp, value) for timestamp, device_id, metric, value, _ in compacted)
+        ):
+            chunk.append({"device_id": device_id, "metric": metric, "timestamp": timestamp, "value": value})
+            if len(chunk) >= chunk_size:
+                folded += _fold_chunk(chunk)
+                chunk = []
+        folded += _fold_chunk(chunk)
+    logger.info(f"Backfill folded {folded} readings into rollups")
+    return folded
+
+
+def _fold_chunk(rows):
+    if not rows:
+        return 0
+    with db_session_scope() as session:
+        apply_rows(session, rows)
+    return len(rows)
+
+
+def choose_resolution(start, end, resolution=None, max_points=None):
+    """
+    Pick the rollup to answer a range query from.
+    With a resolution (seconds per point), this is the coarsest rollup no wider than it.
+    With only max_points, it is the finest rollup that keeps the range within max_points.
+    :return: A value from RESOLUTIONS, or None when raw rows are needed (or fit).
+    """
+    if resolution:
+        fitting = [r for r in RESOLUTIONS if r <= resolution]
+        return max(fitting) if fitting else None
+    if max_points:
+        needed = math.ceil((end - start).total_seconds() / max_points)
+        if needed <= 1:
+            return None
+        wide_enough = [r for r in RESOLUTIONS if r >= needed]
+        return min(wide_enough) if wide_enough else max(RESOLUTIONS)
+    return None
+
+
+def rollup_query(session, start, end, resolution, device_id=None, metric=None):
+    """Query rollup buckets overlapping [start, end] at one resolution, in series order."""
+    query = session.query(SensorRollup).filter(
+        SensorRollup.resolution == resolution,
+        SensorRollup.bucket >= bucket_start(start, resolution),
+        SensorRollup.bucket <= bucket_start(end, resolution),
+    )
+    if device_id is not None:
+        query = query.filter(SensorRollup.device_id == device_id)
+    if metric is not None:
+        query = query.filter(SensorRollup.metric == metric)
+    return query.order_by(SensorRollup.device_id, SensorRollup.metric, SensorRollup.bucket)
+
+
+def fetch_rollups(start, end, resolution, device_id=None, metric=None):
+    """
+    Read rollup buckets overlapping [start, end] at one resolution.
+    :return: List of dicts with timestamp, device_id, metric, count, avg, min, max and last.
+    """
+    with db_session_scope(readonly=True) as session:
+        return [
+            {
+                "timestamp": from_epoch(r.bucket),
+                "device_id": None if r.device_id == NO_DEVICE else r.device_id,
+                "metric": r.metric,
+                "count": r.count,
+                "avg": r.sum / r.count,
+                "min": r.min,
+                "max": r.max,
+                "last": r.last,
+            }
+            for r in rollup_query(session, start, end, resolution, device_id, metric)
+        ]
+
+
+def fetch_rollup_columns(start, end, resolution, device_id=None, metric=None):
+    """
+    Same buckets as fetch_rollups, as column arrays for binary responses.
+    :return: Dict with t (int64 epoch seconds), device_id (int64, -1 for none), metric (object)
+        and count, avg, min, max, last arrays.
+    """
+    columns = (
+        SensorRollup.bucket, SensorRollup.device_id, SensorRollup.metric, SensorRollup.count,
+        SensorRollup.sum, SensorRollup.min, SensorRollup.max, SensorRollup.last,
+    )
+    with db_session_scope(readonly=True) as session:
+        rows = rollup_query(session, start, end, resolution, device_id, metric).with_entities(*columns).all()
+    buckets, device_ids, metrics, counts, sums, mins, maxes, lasts = zip(*rows) if rows else ((),) * 8
+    device_ids = np.array(device_ids, dtype=np.int64)
+    counts = np.array(counts, dtype=np.int64)
+    return {
+        "t": np.array(buckets, dtype=np.int64),
+        "device_id": np.where(device_ids == NO_DEVICE, -1, device_ids),
+        "metric": np.array(metrics, dtype=object),
+        "count": counts,
+        "avg": np.array(sums, dtype=np.float64) / np.maximum(counts, 1),
+        "min": np.array(mins, dtype=np.float64),
+        "max": np.array(maxes, dtype=np.float64),
+        "last": np.array(lasts, dtype=np.float64),
+    }
+
+
+if __name__ == "__main__":
+    # python rollups.py backfill [start] [end]   (ISO timestamps)
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("Usage: python rollups.py backfill [start] [end]")
+        sys.exit(2)
+    start_arg = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    end_arg = datetime.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else None
+    print(f"Folded {backfill(start_arg, end_arg)} rows")
@@ -0,0 +1,218 @@
+from datetime import datetime, timedelta
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import Integer, create_engine, insert, literal, select, union_all
+
+from metric_dictionary import metric_dictionary
+from models import SAMPLE_METRICS, Device, Metric, SensorData, SensorSample
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def split_rows(rows):
+    """
+    Pivot SensorData mappings into sensor_samples rows where they fit.
+    Rows of a sample metric in its canonical unit are grouped by (device_id, timestamp)
+    into one sample. Everything else stays a long row for sensor_data, including
+    readings without a value and a second value for a metric already set on a sample.
+    :return: Tuple of (sample mappings, remaining SensorData mappings).
+    """
+    samples = {}
+    remaining = []
+    for row in rows:
+        metric = row.get("metric")
+        if metric not in SAMPLE_METRICS or row.get("unit") != SAMPLE_METRICS[metric] or row.get("value") is None:
+            remaining.append(row)
+            continue
+        key = (row.get("device_id"), row["timestamp"])
+        sample = samples.get(key)
+        if sample is None:
+            sample = samples[key] = {"timestamp": row["timestamp"], "device_id": key[0], **dict.fromkeys(SAMPLE_METRICS)}
+        if sample[metric] is not None:
+            remaining.append(row)
+            continue
+        sample[metric] = row["value"]
+    return list(samples.values()), remaining
+
+
+def reading_selects(start=None, end=None, device_id=None, metric=None, end_inclusive=False, session=None):
+    """
+    Long-shape selects of (id, timestamp, device_id, metric_id, value): one over
+    sensor_data and one per sample column, each already filtered so the planner
+    can use that table's indexes. Sample readings get negative ids, so
+    (timestamp, id) stays unique and totally ordered across the branches.
+    :param end_inclusive: Keep readings at exactly end (a closed range).
+    :param session: Build ORM queries on this session instead of Core selects.
+    :return: List of (select or query, timestamp column, id column).
+    """
+    # Migration 4 registers the sample metrics, so these are lookups, never inserts.
+    slot_ids = {name: metric_dictionary.find_id(name, unit) for name, unit in SAMPLE_METRICS.items()}
+    wanted = None if metric is None else metric_dictionary.ids(metric)
+    branches = [(
+        SensorData.id, SensorData.timestamp, SensorData.device_id, SensorData.metric_id, SensorData.value,
+        [] if wanted is None else [SensorData.metric_id.in_(wanted)],
+    )]
+    for slot, name in enumerate(SAMPLE_METRICS):
+        if wanted is not None and slot_ids[name] not in wanted:
+            continue
+        value = getattr(SensorSample, name)
+        branches.append((
+            -(SensorSample.id * len(SAMPLE_METRICS) + slot + 1), SensorSample.timestamp, SensorSample.device_id,
+            literal(slot_ids[name], Integer), value, [value.isnot(None)],
+        ))
+
+    selects = []
+    for row_id, timestamp, device, metric_id, value, criteria in branches:
+        if start is not None:
+            criteria.append(timestamp >= start)
+        if end is not None:
+            criteria.append(timestamp <= end if end_inclusive else timestamp < end)
+        if device_id is not None:
+            criteria.append(device == device_id)
+        columns = (
+            row_id.label("id"), timestamp.label("timestamp"), device.label("device_id"),
+            metric_id.label("metric_id"), value.label("value"),
+        )
+        if session is not None:
+            statement = session.query(*columns).filter(*criteria)
+        else:
+            statement = select(*columns).where(*criteria)
+        selects.append((statement, timestamp, row_id))
+    return selects
+
+
+def readings(start=None, end=None, device_id=None, metric=None, end_inclusive=False):
+    """
+    Every stored reading in long shape, sensor_data and sensor_samples alike, as
+    a UNION ALL subquery with columns id, timestamp, device_id, metric_id and value.
+    Filters are applied inside each branch rather than on the subquery.
+    """
+    selects = reading_selects(start, end, device_id, metric, end_inclusive)
+    return union_all(*[statement for statement, _, _ in selects]).subquery("readings")
+
+
+def pivot_wide(columns, metrics=None):
+    """
+    Pivot long column arrays (timestamp_ms, device_id, metric, value) into one
+    row per (device_id, timestamp_ms), oldest first.
+    :param metrics: Metric names to turn into columns; defaults to SAMPLE_METRICS.
+        Readings of other metrics are dropped.
+    :return: Dict with timestamp_ms and device_id (int64) arrays plus one float64
+        array per metric, NaN where a row has no value for it.
+    """
+    metrics = list(metrics or SAMPLE_METRICS)
+    keep = np.isin(columns["metric"], metrics)
+    timestamps = columns["timestamp_ms"][keep]
+    devices = columns["device_id"][keep]
+    names = columns["metric"][keep]
+    values = columns["value"][keep]
+    order = np.lexsort((devices, timestamps))
+    timestamps, devices, names, values = timestamps[order], devices[order], names[order], values[order]
+    first = np.ones(len(timestamps), dtype=bool)
+    first[1:] = (timestamps[1:] != timestamps[:-1]) | (devices[1:] != devices[:-1])
+    row = np.cumsum(first) - 1
+    wide = {"timestamp_ms": timestamps[first], "device_id": devices[first]}
+    for name in metrics:
+        column = np.full(int(first.sum()), np.nan)
+        mask = names == name
+        column[row[mask]] = values[mask]
+        wide[name] = column
+    return wide
+
+
+def pivot_long(wide):
+    """
+    Inverse of pivot_wide: one reading per non-NaN cell, ordered by time.
+    :return: Dict with timestamp_ms, device_id, metric and value arrays.
+    """
+    metrics = [name for name in wide if name not in ("timestamp_ms", "device_id")]
+    parts = []
+    for name in metrics:
+        present = ~np.isnan(wide[name])
+        parts.append((wide["timestamp_ms"][present], wide["device_id"][present],
+                      np.full(int(present.sum()), name, dtype=object), wide[name][present]))
+    if not parts:
+        return {
+            "timestamp_ms": np.empty(0, dtype=np.int64),
+            "device_id": np.empty(0, dtype=np.int64),
+            "metric": np.empty(0, dtype=object),
+            "value": np.empty(0, dtype=np.float64),
+        }
+    long = {
+        key: np.concatenate([part[i] for part in parts])
+        for i, key in enumerate(("timestamp_ms", "device_id", "metric", "value"))
+    }
+    order = np.argsort(long["timestamp_ms"], kind="stable")
+    return {name: values[order] for name, values in long.items()}
+
+
+def benchmark(samples=500_000, batch_size=250, devices=50):
+    """
+    Store the same temperature/humidity samples one row per metric in
+    sensor_data and one row per sample in sensor_samples, each in a scratch
+    SQLite file with the configured pragmas and in bulk-writer sized
+    transactions. Only the inserts are timed.
+    :return: List of (layout, rows, readings per second, file bytes, bytes per reading).
+    """
+    from config import config
+    from database import apply_sqlite_pragmas
+
+    start = datetime(2024, 1, 1)
+    readings = samples * len(SAMPLE_METRICS)
+    results = []
+    for layout in ("metric rows", "sample rows"):
+        path = os.path.join(tempfile.mkdtemp(), "samples-bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        apply_sqlite_pragmas(engine, config.SQLITE_PRAGMAS)
+        SensorData.metadata.create_all(
+            engine, tables=[Device.__table__, Metric.__table__, SensorData.__table__, SensorSample.__table__]
+        )
+        with engine.begin() as connection:
+            connection.execute(insert(Metric), [
+                {"id": i, "name": name, "unit": unit} for i, (name, unit) in enumerate(SAMPLE_METRICS.items(), 1)
+            ])
+        elapsed = 0.0
+        for offset in range(0, samples, batch_size):
+            batch = [
+                (start + timedelta(seconds=i // devices * 10, milliseconds=i * 7919 % 1000), i % devices,
+                 round(20 + (i * 7 % 100) / 10, 1), float(40 + i * 13 % 50))
+                for i in range(offset, min(offset + batch_size, samples))
+            ]
+            if layout == "metric rows":
+                table = SensorData.__table__
+                mappings = [
+                    {"timestamp": t, "device_id": d, "metric_id": metric_id, "value": v}
+                    for t, d, *values in batch for metric_id, v in enumerate(values, 1)
+                ]
+            else:
+                table = SensorSample.__table__
+                mappings = [
+                    {"timestamp": t, "device_id": d, **dict(zip(SAMPLE_METRICS, values))} for t, d, *values in batch
+                ]
+            started = time.perf_counter()
+            with engine.begin() as connection:
+                connection.execute(insert(table), mappings)
+            elapsed += time.perf_counter() - started
+        engine.dispose()
+        size = os.path.getsize(path)
+        rows = readings if layout == "metric rows" else samples
+        results.append((layout, rows, readings / elapsed, size, size / readings))
+        os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    # python samples.py bench [samples]    storage and insert rate of metric rows vs sample rows
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "bench":
+        print(f"{'layout':<12} {'rows':>10} {'readings/s':>12} {'file bytes':>14} {'bytes/reading':>14}")
+        for layout, rows, rate, size, per_reading in benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 500_000):
+            print(f"{layout:<12} {rows:>10,} {rate:>12,.0f} {size:>14,} {per_reading:>14.1f}")
+    else:
+        sys.exit(f"Unknown command: {command}")
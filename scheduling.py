@@ -2,6 +2,11 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 import datetime
 from discovery import get_discovered_data
+from data_ops import ingest_pipeline, start_sensor_streaming
+from ingest_pipeline import PipelineOverloaded
+from blocks import compact
+from config import config
+from loop_thread import background_loop
 import logging
 import atexit
 
@@ -11,14 +16,52 @@ logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
+SAMPLE_INTERVAL_SECONDS = 10
+current_interval = SAMPLE_INTERVAL_SECONDS
+
+def adjust_polling_interval():
+    """Stretch the BLE polling interval while the ingest pipeline is under pressure and restore it afterwards."""
+    global current_interval
+    interval = SAMPLE_INTERVAL_SECONDS * ingest_pipeline.poll_delay_factor()
+    if interval != current_interval:
+        scheduler.reschedule_job('sample_job', trigger=IntervalTrigger(seconds=interval))
+        logger.info(f"Sample job interval changed from {current_interval}s to {interval}s")
+        current_interval = interval
+
 def sample_job():
     try:
-        data = get_discovered_data()
+        data = background_loop.run(get_discovered_data(), config.ASYNC_CALL_TIMEOUT)
+        if data:
+            ingest_pipeline.submit(data, source="ble")
         logger.info(f"Sample job executed at {datetime.datetime.now()}")
+    except PipelineOverloaded as e:
+        logger.warning(f"Ingest pipeline overloaded, BLE sample refused: {e}")
     except Exception as e:
         logger.error(f"Error during sample job execution: {e}")
+    finally:
+        adjust_polling_interval()
+
+def streaming_job():
+    """Subscribe devices stored since the last run; subscribed ones are left alone."""
+    try:
+        start_sensor_streaming()
+    except Exception as e:
+        logger.error(f"Error starting BLE notification streaming: {e}")
+
+if config.BLE_COLLECTION_MODE == "notify":
+    # Notifications replace the periodic read; devices that cannot notify are polled by the stream.
+    streaming_job()
+    scheduler.add_job(streaming_job, trigger=IntervalTrigger(minutes=1), id='streaming_job', replace_existing=True, coalesce=True)
+else:
+    job = scheduler.add_job(sample_job, trigger=IntervalTrigger(seconds=SAMPLE_INTERVAL_SECONDS), id='sample_job', replace_existing=True)
+
+def compaction_job():
+    try:
+        compact()
+    except Exception as e:
+        logger.error(f"Error during block compaction: {e}")
 
-job = scheduler.add_job(sample_job, trigger=IntervalTrigger(seconds=10), id='sample_job', replace_existing=True)
+scheduler.add_job(compaction_job, trigger=IntervalTrigger(seconds=config.COMPACT_INTERVAL_SECONDS), id='compaction_job', replace_existing=True, coalesce=True)
 
 scheduler.start()
 
@@ -1,10 +1,19 @@
 
+from functools import partial
 import logging
-import asyncio
+
+import numpy as np
+from sqlalchemy import BigInteger, type_coerce
 
 from models import SensorData
-from data_ops import connect_to_gateway
-from database import Session as db
+from data_ops import bulk_writer, connect_to_gateway
+from database import ReadSession, db_session_scope
+from pagination import merged_keyset_page
+from ring_buffers import recent_window, to_micros
+from blocks import block_columns, seek_block_rows
+from metric_dictionary import metric_dictionary
+from samples import SAMPLE_METRICS, pivot_wide, reading_selects, readings
+from loop_thread import background_loop
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,18 +40,101 @@ def validate_data(data):
     return True
 
 def add_new_device_record(temperature, humidity):
-    with db() as session:
-        new_record = SensorData(temperature=temperature, humidity=humidity)
-        session.add(new_record)
+    """Store one temperature/humidity reading as a single sample row, bypassing the write queue."""
+    bulk_writer.write_batch([{"temperature": temperature, "humidity": humidity}])
         
 def fetch_all_sensor_data():
-    with db() as session:
+    with ReadSession() as session:
         return session.query(SensorData).all()
     
-def fetch_filtered_sensor_data(start_time, end_time):
-    return SensorData.query.filter(SensorData.timestamp.between(start_time, end_time)).all()
+def serialize_sensor_data(record):
+    metric, unit = metric_dictionary.lookup(record.metric_id)
+    return {
+        "id": record.id,
+        "timestamp": record.timestamp.isoformat(),
+        "device_id": record.device_id,
+        "metric": metric,
+        "value": record.value,
+        "unit": unit,
+    }
+
+def fetch_sensor_data_page(limit, cursor=None):
+    """
+    Fetch one keyset page of sensor data, sample and compacted readings, newest first.
+    :return: Tuple of (serialized rows, next_cursor, prev_cursor).
+    :raises InvalidCursor: When the cursor is malformed.
+    """
+    with db_session_scope(readonly=True) as session:
+        rows, next_cursor, prev_cursor = merged_keyset_page(
+            reading_selects(session=session), limit, cursor, seekers=[partial(seek_block_rows, session)]
+        )
+        return [serialize_sensor_data(r) for r in rows], next_cursor, prev_cursor
+
+def fetch_sensor_data_columns(start_time, end_time, device_id=None, metric=None):
+    """
+    Read a time range into column arrays without building ORM objects or per-row dicts.
+    :return: Dict with timestamp_ms (int64 epoch ms), device_id (int64, -1 for none),
+        metric (object) and value (float64, NaN for none) arrays. A single series
+        whose range is held in the recent-window rings is served from memory;
+        otherwise raw rows are merged with compacted blocks.
+    """
+    if device_id is not None and metric is not None:
+        recent = recent_window.query(device_id, metric, start_time, end_time)
+        if recent is not None:
+            timestamps, values = recent
+            return {
+                "timestamp_ms": timestamps // 1000,
+                "device_id": np.full(len(timestamps), device_id, dtype=np.int64),
+                "metric": np.full(len(timestamps), metric, dtype=object),
+                "value": values.astype(np.float64),
+            }
+    with db_session_scope(readonly=True) as session:
+        stored = readings(start_time, end_time, device_id, metric, end_inclusive=True)
+        # Epoch milliseconds straight from the column, without building datetimes.
+        rows = session.query(
+            type_coerce(stored.c.timestamp, BigInteger), stored.c.device_id, stored.c.metric_id, stored.c.value
+        ).order_by(stored.c.timestamp, stored.c.id).all()
+        compacted = block_columns(session, to_micros(start_time), to_micros(end_time), device_id, metric)
+    timestamps, device_ids, metric_ids, values = zip(*rows) if rows else ((), (), (), ())
+    columns = {
+        "timestamp_ms": np.array(timestamps, dtype=np.int64),
+        "device_id": np.nan_to_num(np.array(device_ids, dtype=np.float64), nan=-1).astype(np.int64),
+        "metric": metric_dictionary.names(np.nan_to_num(np.array(metric_ids, dtype=np.float64), nan=-1)),
+        "value": np.array(values, dtype=np.float64),
+    }
+    if not len(compacted["timestamp_us"]):
+        return columns
+    compacted["timestamp_ms"] = compacted["timestamp_us"] // 1000
+    merged = {name: np.concatenate((compacted[name], values)) for name, values in columns.items()}
+    order = np.argsort(merged["timestamp_ms"], kind="stable")
+    return {name: values[order] for name, values in merged.items()}
+
+def fetch_sample_columns(start_time, end_time, device_id=None, metrics=None):
+    """
+    Read a time range in sample shape: one row per device and timestamp with a
+    column per metric, whether the readings were stored as samples, as
+    sensor_data rows or in compacted blocks.
+    :param metrics: Metric names to pivot into columns; defaults to the sample metrics.
+    :return: Dict with timestamp_ms and device_id (int64) arrays plus one float64 array per metric.
+    """
+    metrics = list(metrics or SAMPLE_METRICS)
+    if len(metrics) == 1:
+        return pivot_wide(fetch_sensor_data_columns(start_time, end_time, device_id, metrics[0]), metrics)
+    return pivot_wide(fetch_sensor_data_columns(start_time, end_time, device_id), metrics)
+
+def fetch_sample_records(start_time, end_time, device_id=None):
+    """Sample-shape rows as JSON-ready dicts with timestamp, device_id and one key per sample metric."""
+    wide = fetch_sample_columns(start_time, end_time, device_id)
+    timestamps = wide["timestamp_ms"].astype("datetime64[ms]").tolist()
+    devices = wide["device_id"].tolist()
+    columns = {name: wide[name].tolist() for name in SAMPLE_METRICS}
+    return [
+        dict(
+            {"timestamp": timestamp.isoformat(), "device_id": None if device < 0 else device},
+            **{name: None if values[i] != values[i] else values[i] for name, values in columns.items()},
+        )
+        for i, (timestamp, device) in enumerate(zip(timestamps, devices))
+    ]
 
 def get_sensor_data():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(connect_to_gateway())
\ No newline at end of file
+    return background_loop.run(connect_to_gateway())
\ No newline at end of file
@@ -0,0 +1,240 @@
+from datetime import date, datetime
+from decimal import Decimal
+import gzip
+import json
+import logging
+import math
+import sys
+import time
+
+import numpy as np
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from config import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/vnd.iotserver.columns",
+    "text/csv",
+    "text/html",
+    "text/plain",
+)
+
+
+def default(obj):
+    """Encode the types the standard json module rejects."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj) if np.isfinite(obj) else None
+    if isinstance(obj, np.ndarray):
+        return [None if isinstance(v, float) and not math.isfinite(v) else v for v in obj.tolist()]
+    if isinstance(obj, Decimal):
+        return finite(float(obj))
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def finite(obj):
+    """Copy obj with NaN and infinite floats replaced by None, as orjson encodes them."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [finite(value) for value in obj]
+    return obj
+
+
+class StdlibSerializer:
+    """json: non-finite floats become null so the output matches orjson and stays valid JSON."""
+    name = "json"
+
+    def dumps(self, obj):
+        try:
+            text = json.dumps(obj, default=default, separators=(",", ":"), allow_nan=False)
+        except ValueError:
+            # Rare: only payloads carrying NaN/inf pay for the sanitising copy.
+            text = json.dumps(finite(obj), default=default, separators=(",", ":"), allow_nan=False)
+        return text.encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer:
+    """orjson: datetimes and NumPy arrays are encoded natively, NaN becomes null."""
+    name = "orjson"
+    OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=default, option=self.OPTIONS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+SERIALIZERS = {
+    "json": StdlibSerializer,
+    "orjson": OrjsonSerializer,
+}
+
+
+def get_serializer(name="auto"):
+    """
+    :param name: "json", "orjson", or "auto" for the fastest one installed.
+    """
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("JSON_SERIALIZER is orjson but orjson is not installed")
+    return SERIALIZERS[name]()
+
+
+serializer = get_serializer(config.JSON_SERIALIZER)
+
+
+class FastJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by the configured serializer, so jsonify() and
+    request.get_json() use it everywhere. Output is always compact, also in debug.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return serializer.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return serializer.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serializer.dumps(obj), mimetype="application/json")
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encodings):
+    """
+    Pick a content coding the client accepts, preferring brotli.
+    :param accept_encodings: werkzeug Accept from request.accept_encodings.
+    """
+    for encoding in available_encodings():
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=config.COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=config.COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response):
+    """
+    after_request hook: compress buffered responses of at least COMPRESS_MIN_BYTES
+    with the best encoding the client accepts. Streamed responses handle their own encoding.
+    """
+    from flask import request
+
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < config.COMPRESS_MIN_BYTES:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # Each encoding is a different representation and needs its own strong ETag.
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def init_app(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+    logger.info(f"JSON serializer: {serializer.name}; compression: {', '.join(available_encodings())}")
+
+
+def benchmark(rows=100_000, repeat=3):
+    """
+    Compare payload build time for a rows-long response: row dicts and a
+    columnar NumPy payload, through each installed serializer and compressor.
+    :return: List of (case, milliseconds, bytes).
+    """
+    base = datetime(2024, 1, 1)
+    timestamps = np.arange(rows, dtype=np.int64) * 1_000_000 + int(base.timestamp() * 1_000_000)
+    values = np.random.default_rng(0).normal(21.0, 2.0, rows)
+    records = [
+        {"timestamp": datetime.utcfromtimestamp(t / 1_000_000), "device_id": i % 40, "metric": "temperature", "value": float(v), "unit": "C"}
+        for i, (t, v) in enumerate(zip(timestamps.tolist(), values.tolist()))
+    ]
+    columns = {"timestamp_us": timestamps, "value": values}
+
+    def timed(fn):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            out = fn()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best, out
+
+    results = []
+    encoded = {}
+    for name in SERIALIZERS:
+        if name == "orjson" and orjson is None:
+            continue
+        impl = SERIALIZERS[name]()
+        ms, out = timed(lambda: impl.dumps({"data": records}))
+        results.append((f"{name} rows", ms, len(out)))
+        encoded[name] = out
+        ms, out = timed(lambda: impl.dumps(columns))
+        results.append((f"{name} columns", ms, len(out)))
+    ms, out = timed(lambda: json.dumps(
+        {"data": [dict(r, timestamp=r["timestamp"].isoformat()) for r in records]}, indent=2
+    ).encode())
+    results.append(("jsonify-style (stdlib, indent=2)", ms, len(out)))
+    payload = encoded.get("orjson") or encoded["json"]
+    for encoding in available_encodings():
+        ms, out = timed(lambda: compress(payload, encoding))
+        results.append((f"{encoding} of rows payload", ms, len(out)))
+    return results
+
+
+if __name__ == "__main__":
+    # python serializers.py [rows]
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{'case':<36} {'ms':>10} {'bytes':>12}")
+    for case, ms, size in benchmark(row_count):
+        print(f"{case:<36} {ms:>10.1f} {size:>12,}")
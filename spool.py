@@ -0,0 +1,304 @@
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from bulk_writer import reading_to_mappings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Record framing: payload length and CRC32 of the payload.
+FRAME = struct.Struct("<II")
+# Payload head: epoch microseconds, value, device id (-1 for none), metric and unit byte lengths.
+# The metric and unit strings (UTF-8) follow the head.
+HEAD = struct.Struct("<qdiBB")
+
+SEGMENT_PATTERN = re.compile(r"^(\d{12})\.spool$")
+CHECKPOINT_FILE = "checkpoint.json"
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_row(row):
+    """Encode one SensorData mapping into a framed spool record."""
+    metric = (row.get("metric") or "").encode("utf-8")[:255]
+    unit = (row.get("unit") or "").encode("utf-8")[:255]
+    device_id = row.get("device_id")
+    timestamp = row["timestamp"]
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    micros = (timestamp - EPOCH) // timedelta(microseconds=1)
+    payload = HEAD.pack(micros, row["value"], -1 if device_id is None else device_id, len(metric), len(unit)) + metric + unit
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(buffer, offset=0):
+    """
+    Decode consecutive records from a bytes-like buffer.
+    Stops at the end of the buffer or at the first torn or corrupt record.
+    :return: Tuple of (rows, ends), where ends[i] is the offset just past the record of rows[i].
+    """
+    rows = []
+    ends = []
+    end = len(buffer)
+    while offset + FRAME.size <= end:
+        length, crc = FRAME.unpack_from(buffer, offset)
+        start = offset + FRAME.size
+        if length < HEAD.size or start + length > end:
+            break
+        payload = bytes(buffer[start:start + length])
+        if zlib.crc32(payload) != crc:
+            break
+        micros, value, device_id, metric_len, unit_len = HEAD.unpack_from(payload)
+        metric = payload[HEAD.size:HEAD.size + metric_len].decode("utf-8")
+        unit = payload[HEAD.size + metric_len:HEAD.size + metric_len + unit_len].decode("utf-8")
+        rows.append({
+            "timestamp": EPOCH + timedelta(microseconds=micros),
+            "value": value,
+            "device_id": None if device_id < 0 else device_id,
+            "metric": metric or None,
+            "unit": unit or None,
+        })
+        offset = start + length
+        ends.append(offset)
+    return rows, ends
+
+
+class Spool:
+    """
+    Segmented append-only spool of SensorData rows.
+    append() returns only after the records are written (and fsynced when
+    fsync is on), so callers may acknowledge readings as soon as it returns.
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync=True, use_mmap=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.use_mmap = use_mmap
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self._active_seq = segments[-1] if segments else 1
+        self._file = None
+        self._open_active()
+
+    def segments(self):
+        """Sequence numbers of the segments on disk, oldest first."""
+        found = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    def segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.spool")
+
+    @property
+    def active_seq(self):
+        return self._active_seq
+
+    def append(self, readings):
+        """
+        Durably append readings.
+        :return: Number of SensorData rows appended.
+        """
+        records = []
+        for reading in readings:
+            records.extend(encode_row(row) for row in reading_to_mappings(reading))
+        if not records:
+            return 0
+        data = b"".join(records)
+        with self._lock:
+            if self._file.tell() and self._file.tell() + len(data) > self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        return len(records)
+
+    def read_segment(self, seq, offset=0):
+        """
+        Read the good records of a segment starting at offset.
+        :return: Tuple of (rows, ends), where ends[i] is the segment offset just past rows[i].
+        """
+        path = self.segment_path(seq)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return [], []
+            if self.use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    return decode_records(buffer, offset)
+            f.seek(offset)
+            rows, ends = decode_records(f.read())
+            return rows, [offset + end for end in ends]
+
+    def rotate(self):
+        with self._lock:
+            if self._file.tell():
+                self._rotate()
+
+    def remove_segment(self, seq):
+        if seq == self._active_seq:
+            raise ValueError("Cannot remove the active spool segment")
+        os.remove(self.segment_path(seq))
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        self._active_seq += 1
+        self._open_active()
+        logger.info(f"Spool rotated to segment {self._active_seq}")
+
+    def _open_active(self):
+        path = self.segment_path(self._active_seq)
+        if os.path.exists(path):
+            # Cut off a record torn by a crash so new appends stay readable.
+            with open(path, "rb") as f:
+                _, ends = decode_records(f.read())
+            good = ends[-1] if ends else 0
+            if good < os.path.getsize(path):
+                logger.warning(f"Truncating torn tail of spool segment {self._active_seq} at offset {good}")
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+        self._file = open(path, "ab")
+
+
+def _reading_key(row):
+    return row["device_id"], row["timestamp"]
+
+
+class SpoolReplayer:
+    """
+    Background loader that moves spooled rows into the database.
+    Progress is checkpointed as (segment, offset) after every committed
+    batch and fully loaded segments are deleted, so a failed load is retried
+    from the batch that failed. Delivery is at-least-once: a crash between a
+    commit and its checkpoint replays that batch.
+    """
+
+    def __init__(self, spool, load, batch_size=5000, interval=0.5):
+        """
+        :param spool: Spool to drain.
+        :param load: Callable writing a list of SensorData mappings in one transaction.
+        :param batch_size: Rows per load call; a batch runs past it to the end of the reading it
+            stopped in, so a sample is never split across two transactions.
+        :param interval: Seconds to sleep when the spool is drained.
+        """
+        self.spool = spool
+        self.load = load
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.replayed = 0
+        self._checkpoint_path = os.path.join(spool.directory, CHECKPOINT_FILE)
+        self.segment, self.offset = self._read_checkpoint()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+        self._thread.start()
+        logger.info(f"Spool replayer resuming at segment {self.segment} offset {self.offset}")
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # It is still inside replay_once(); a second pass would load the same rows again.
+                logger.warning(f"Spool replayer did not stop within {timeout}s; leaving the rest to the next start")
+                return
+        self.replay_once()
+
+    def replay_once(self):
+        """
+        Load everything currently in the spool.
+        :return: Number of rows loaded.
+        """
+        loaded = 0
+        for seq in self.spool.segments():
+            if seq < self.segment:
+                self._remove(seq)
+                continue
+            if seq > self.segment:
+                self.segment, self.offset = seq, 0
+            # A segment closed before the drain starts cannot grow during it, so draining it reaches
+            # its real end. One still active may be rotated and appended to meanwhile: keep it.
+            closed = seq < self.spool.active_seq
+            while True:
+                rows, ends = self.spool.read_segment(seq, self.offset)
+                if not rows:
+                    break
+                for start, stop in self._batches(rows):
+                    self.load(rows[start:stop])
+                    loaded += stop - start
+                    self.offset = ends[stop - 1]
+                    self._write_checkpoint()
+            if closed:
+                size = os.path.getsize(self.spool.segment_path(seq))
+                if self.offset < size:
+                    logger.warning(f"Discarding {size - self.offset} corrupt bytes at the end of spool segment {seq}")
+                self._remove(seq)
+        self.replayed += loaded
+        return loaded
+
+    def _batches(self, rows):
+        """(start, stop) index ranges of about batch_size rows that end on a reading boundary."""
+        start = 0
+        while start < len(rows):
+            stop = min(start + self.batch_size, len(rows))
+            # A reading's rows are appended together and share device and timestamp.
+            while stop < len(rows) and _reading_key(rows[stop]) == _reading_key(rows[stop - 1]):
+                stop += 1
+            yield start, stop
+            start = stop
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.replay_once():
+                    self._stop.wait(self.interval)
+            except Exception as e:
+                logger.error(f"Spool replay failed at segment {self.segment} offset {self.offset}: {e}")
+                self._stop.wait(self.interval)
+
+    def _remove(self, seq):
+        self.spool.remove_segment(seq)
+        logger.info(f"Spool segment {seq} replayed and removed")
+
+    def _read_checkpoint(self):
+        try:
+            with open(self._checkpoint_path) as f:
+                checkpoint = json.load(f)
+            return checkpoint["segment"], checkpoint["offset"]
+        except FileNotFoundError:
+            segments = self.spool.segments()
+            return (segments[0] if segments else 1), 0
+        except (ValueError, KeyError) as e:
+            logger.error(f"Unreadable spool checkpoint, replaying from the oldest segment: {e}")
+            segments = self.spool.segments()
+            return (segments[0] if segments else 1), 0
+
+    def _write_checkpoint(self):
+        tmp_path = self._checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": self.segment, "offset": self.offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._checkpoint_path)
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The application modules are flat files in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules importing database get a scratch SQLite file instead of the development database.
+os.environ.setdefault("ENVIRONMENT", "testing")
+os.environ.setdefault("TEST_SQLALCHEMY_DATABASE_URI", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from ble_connections import CONNECTED, BleConnectionManager, SubscriptionLimitReached
+from ble_fake import FakeBleakBackend
+
+UUID = "00002a6e-0000-1000-8000-00805f9b34fb"
+
+
+def address(index):
+    return f"AA:BB:CC:DD:EE:{index:02X}"
+
+
+def setup(devices, max_connections=2, adapter_limit=7, **options):
+    fake = FakeBleakBackend(max_connections=adapter_limit)
+    for index in range(devices):
+        fake.add_device(address(index), {UUID: b"\x15\x2d"}, **options)
+    manager = BleConnectionManager(fake.client, max_connections=max_connections, idle_timeout=60, connect_timeout=5)
+    return fake, manager
+
+
+def connected(manager):
+    return sorted(link["address"] for link in manager.states() if link["state"] == CONNECTED)
+
+
+def test_links_are_reused():
+    fake, manager = setup(1)
+
+    async def scenario():
+        assert await manager.read(address(0), UUID) == b"\x15\x2d"
+        assert await manager.read(address(0), UUID) == b"\x15\x2d"
+        await manager.close()
+
+    asyncio.run(scenario())
+    assert fake.device(address(0)).connects == 1
+
+
+def test_least_recently_used_idle_link_is_evicted_at_the_limit():
+    fake, manager = setup(3)
+
+    async def scenario():
+        await manager.read(address(0), UUID)
+        await manager.read(address(1), UUID)
+        await manager.read(address(0), UUID)
+        await manager.read(address(2), UUID)
+        assert manager._open_links() == 2
+        assert connected(manager) == [address(0), address(2)]
+        assert manager.states(address(1))[0]["evictions"] == 1
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_new_device_waits_for_a_busy_slot():
+    fake, manager = setup(2, max_connections=1)
+    events = []
+
+    async def hold():
+        async with manager.connection(address(0)):
+            events.append("held")
+            await asyncio.sleep(0.1)
+            events.append("released")
+
+    async def scenario():
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        await manager.read(address(1), UUID)
+        events.append("read")
+        await holder
+        assert connected(manager) == [address(1)]
+        await manager.close()
+
+    asyncio.run(scenario())
+    assert events == ["held", "released", "read"]
+
+
+def test_idle_links_are_disconnected():
+    fake, manager = setup(1)
+
+    async def scenario():
+        await manager.read(address(0), UUID)
+        assert await manager.evict_idle(now=time.monotonic() + 30) == 0
+        assert await manager.evict_idle(now=time.monotonic() + 61) == 1
+        assert manager._open_links() == 0
+        await manager.read(address(0), UUID)
+        await manager.close()
+
+    asyncio.run(scenario())
+    assert fake.device(address(0)).connects == 2
+
+
+def test_dropped_link_reconnects_on_next_use():
+    fake, manager = setup(1)
+
+    async def scenario():
+        await manager.read(address(0), UUID)
+        fake.drop(address(0))
+        assert manager._open_links() == 0
+        assert await manager.read(address(0), UUID) == b"\x15\x2d"
+        assert manager.states(address(0))[0]["drops"] == 1
+        await manager.close()
+
+    asyncio.run(scenario())
+    assert fake.device(address(0)).connects == 2
+
+
+def test_subscribed_links_are_pinned_and_resubscribed():
+    fake, manager = setup(3)
+    received = []
+
+    async def scenario():
+        await manager.subscribe(address(0), UUID, lambda characteristic, data: received.append(bytes(data)))
+        with pytest.raises(SubscriptionLimitReached):
+            await manager.subscribe(address(1), UUID, lambda characteristic, data: None)
+        await manager.read(address(1), UUID)
+        await manager.read(address(2), UUID)
+        assert connected(manager) == [address(0), address(2)]
+
+        await fake.notify(address(0), UUID, b"\x01")
+        fake.drop(address(0))
+        # The background resubscriber retries after one second.
+        for _ in range(30):
+            await asyncio.sleep(0.1)
+            if address(0) in connected(manager):
+                break
+        await fake.notify(address(0), UUID, b"\x02")
+        assert manager.states(address(0))[0]["subscriptions"] == [UUID]
+
+        await manager.unsubscribe(address(0), UUID)
+        await fake.notify(address(0), UUID, b"\x03")
+        await manager.close()
+
+    asyncio.run(scenario())
+    assert received == [b"\x01", b"\x02"]
+    assert fake.device(address(0)).connects == 2
+
+
+def test_cancelled_connects_release_their_slots():
+    fake, manager = setup(4)
+    for index in (0, 1):
+        fake.device(address(index)).connect_delay = 0.5
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(asyncio.wait_for(manager.connect(address(index)), 0.1) for index in (0, 1)), return_exceptions=True
+        )
+        assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+        assert manager._open_links() == 0
+        await asyncio.wait_for(manager.read(address(2), UUID), 1)
+        await asyncio.wait_for(manager.read(address(3), UUID), 1)
+        assert connected(manager) == [address(2), address(3)]
+        await manager.close()
+
+    asyncio.run(scenario())
+    assert fake.pending == 0
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import blocks
+from database import db_session_scope, init_db
+from metric_dictionary import metric_dictionary
+from models import Device, SensorBlock, SensorData, SensorSample
+from ring_buffers import to_micros
+
+START = datetime(2024, 1, 1)
+STEP = timedelta(seconds=blocks.SPAN_US // 1_000_000 // 4 + 7)
+POINTS = 10
+
+
+@pytest.fixture
+def device_id():
+    init_db()
+    with db_session_scope() as session:
+        for model in (SensorBlock, SensorData, SensorSample, Device):
+            session.query(model).delete()
+        device = Device(address="AA:BB:CC:DD:EE:FF", name="kitchen")
+        session.add(device)
+        session.flush()
+        device_id = device.id
+    metric_id = metric_dictionary.id_for("co2", "ppm")
+    with db_session_scope() as session:
+        for i in range(POINTS):
+            timestamp = START + i * STEP
+            session.add(SensorData(timestamp=timestamp, value=400.0 + i, metric_id=metric_id, device_id=device_id))
+            session.add(SensorSample(
+                timestamp=timestamp, device_id=device_id, temperature=20.0 + i, humidity=None if i % 3 else 50.0 + i,
+            ))
+    return device_id
+
+
+def compacted(metric):
+    # compact() keeps the newest reading of every series raw.
+    if metric == "co2":
+        return [(START + i * STEP, 400.0 + i) for i in range(POINTS - 1)]
+    if metric == "temperature":
+        return [(START + i * STEP, 20.0 + i) for i in range(POINTS - 1)]
+    return [(START + i * STEP, 50.0 + i) for i in range(0, POINTS - 1, 3)]
+
+
+def test_compact_moves_all_but_the_newest_reading(device_id):
+    written, points = blocks.compact(older_than=START + timedelta(days=365))
+
+    with db_session_scope(readonly=True) as session:
+        assert session.query(SensorData).count() == 1
+        assert [row.timestamp for row in session.query(SensorSample)] == [START + (POINTS - 1) * STEP]
+        assert session.query(SensorBlock).count() == written
+        end_us = to_micros(START + POINTS * STEP)
+        columns = blocks.block_columns(session, 0, end_us, device_id=device_id)
+        rows = list(blocks.iter_block_rows(session, 0, end_us, device_id=device_id))
+
+    expected = sorted(
+        (timestamp, metric, value) for metric in ("co2", "temperature", "humidity") for timestamp, value in compacted(metric)
+    )
+    assert points == len(expected)
+    assert np.all(np.diff(columns["timestamp_us"]) >= 0)
+    assert sorted(zip(
+        columns["timestamp_us"].astype("datetime64[us]").tolist(), columns["metric"].tolist(), columns["value"].tolist(),
+    )) == expected
+    assert sorted((timestamp, metric, value) for timestamp, _, metric, value, _ in rows) == expected
+    assert {device for _, device, _, _, _ in rows} == {device_id}
+
+
+def test_block_columns_clips_to_the_range(device_id):
+    blocks.compact(older_than=START + timedelta(days=365))
+    with db_session_scope(readonly=True) as session:
+        columns = blocks.block_columns(session, to_micros(START + 2 * STEP), to_micros(START + 4 * STEP), metric="co2")
+    assert columns["value"].tolist() == [402.0, 403.0, 404.0]
+
+
+def test_seek_block_rows_pages_both_ways(device_id):
+    blocks.compact(older_than=START + timedelta(days=365))
+    pages, position = [], (None, None)
+    with db_session_scope(readonly=True) as session:
+        while True:
+            page = blocks.seek_block_rows(session, 4, *position)
+            if not page:
+                break
+            pages.append(page)
+            position = (page[-1].timestamp, page[-1].id)
+        newest_first = [row for page in pages for row in page]
+        back = blocks.seek_block_rows(session, 4, newest_first[-1].timestamp, newest_first[-1].id, direction="prev")
+
+    keys = [(row.timestamp, row.id) for row in newest_first]
+    assert keys == sorted(keys, reverse=True)
+    assert len(set(keys)) == len(keys) == sum(len(compacted(metric)) for metric in ("co2", "temperature", "humidity"))
+    assert all(row.id <= -blocks.BLOCK_ID_BASE for row in newest_first)
+    assert back == newest_first[-5:-1][::-1]
+
+
+def test_corrupt_block_is_reported(device_id):
+    blocks.compact(older_than=START + timedelta(days=365))
+    with db_session_scope() as session:
+        block = session.query(SensorBlock).filter(SensorBlock.metric == "co2").order_by(SensorBlock.start_us).first()
+        block.data = block.data[:-2]
+    with db_session_scope(readonly=True) as session:
+        with pytest.raises(ValueError):
+            blocks.block_columns(session, 0, to_micros(START + POINTS * STEP), metric="co2")
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from gorilla import HEADER, decode_block, encode_block
+
+
+def round_trip(timestamps, values):
+    decoded_times, decoded_values = decode_block(encode_block(timestamps, values))
+    assert decoded_times.tolist() == list(timestamps)
+    # Compare bit patterns so NaN and -0.0 must come back exactly.
+    assert decoded_values.view(np.uint64).tolist() == np.asarray(values, dtype=np.float64).view(np.uint64).tolist()
+
+
+def test_round_trip_irregular_series():
+    rng = np.random.default_rng(0)
+    steps = rng.integers(1, 10_000_000, 500)
+    steps[100] = 86_400_000_000 * 30  # month-long gap
+    steps[101] = 1  # then back to microseconds
+    timestamps = (1_704_067_200_000_000 + np.cumsum(steps)).tolist()
+    values = np.round(21 + np.cumsum(rng.normal(0, 0.1, 500)), 2)
+    values[[3, 4, 50]] = np.nan
+    values[[60, 61]] = 21.0
+    values[70], values[71], values[72] = np.inf, -np.inf, -0.0
+    round_trip(timestamps, values)
+
+
+def test_round_trip_edge_cases():
+    round_trip([], [])
+    round_trip([5], [np.nan])
+    # Timestamps before the epoch and deltas overflowing every narrow bucket.
+    round_trip([-(2 ** 62), 0, 2 ** 62, 2 ** 62 + 1], [1.0, 2.0, 1e300, -1e-300])
+
+
+def test_truncated_block_raises():
+    data = encode_block(np.arange(50, dtype=np.int64) * 1_000_003, np.linspace(0, 1, 50) ** 2)
+    for size in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_block(data[:size])
+
+
+def test_empty_header_only():
+    assert len(encode_block([], [])) == HEADER.size
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import MetaData, create_engine, insert, text
+
+from migrations import MIGRATIONS, legacy_sensor_data, run_migrations, verify_indexes
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'scratch.db'}")
+    yield engine
+    engine.dispose()
+
+
+def test_legacy_table_is_migrated_and_indexed(engine):
+    table = legacy_sensor_data(MetaData())
+    table.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(table), [
+            {"timestamp": datetime(2024, 1, 1, 0, 0, 0, 250000), "value": 21.5, "metric": "temperature", "unit": "C", "device_id": 1},
+            {"timestamp": datetime(2024, 1, 1, 0, 0, 10), "value": 40.0, "metric": "humidity", "unit": "%", "device_id": 1},
+        ])
+
+    assert run_migrations(engine) == [version for version, _, _ in MIGRATIONS]
+    assert run_migrations(engine) == []
+
+    results = verify_indexes(engine)
+    assert [name for name, _, ok in results if not ok] == []
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT s.timestamp, s.value, m.name, m.unit FROM sensor_data s JOIN metrics m ON m.id = s.metric_id ORDER BY s.id"
+        )).fetchall()
+    assert [tuple(row) for row in rows] == [
+        (1704067200250, 21.5, "temperature", "C"),
+        (1704067210000, 40.0, "humidity", "%"),
+    ]
+
+
+def test_fresh_schema_needs_no_rebuild(engine):
+    from base import Base
+    import models
+
+    Base.metadata.create_all(engine)
+    run_migrations(engine)
+
+    results = verify_indexes(engine)
+    assert [name for name, _, ok in results if not ok] == []
+    with engine.connect() as connection:
+        metrics = {tuple(row) for row in connection.execute(text("SELECT name, unit FROM metrics"))}
+    assert metrics == set(models.SAMPLE_METRICS.items())
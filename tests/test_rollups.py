@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import rollups
+from database import db_session_scope, init_db
+from models import SensorRollup
+
+
+def batch(offset, values):
+    start = datetime(2024, 1, 1) + timedelta(minutes=offset)
+    return [
+        {"timestamp": start + timedelta(seconds=20 * i), "device_id": 1, "metric": "temperature", "value": value}
+        for i, value in enumerate(values)
+    ]
+
+
+def stored(session):
+    return sorted(
+        (r.resolution, r.device_id, r.metric, r.bucket, r.count, r.sum, r.min, r.max, r.last, r.last_timestamp)
+        for r in session.query(SensorRollup)
+    )
+
+
+@pytest.fixture
+def session():
+    init_db()
+    with db_session_scope() as session:
+        session.query(SensorRollup).delete()
+    with db_session_scope() as session:
+        yield session
+        session.rollback()
+
+
+def test_portable_merge_matches_upsert(session, monkeypatch):
+    batches = [batch(0, [20.0, 21.5, 19.0]), batch(1, [22.0, 18.5]), batch(0, [30.0])]
+    for rows in batches:
+        rollups.apply_rows(session, rows)
+    session.flush()
+    expected = stored(session)
+    session.query(SensorRollup).delete()
+
+    # A dialect without INSERT ... ON CONFLICT takes the read-modify-write path.
+    monkeypatch.setattr(session.get_bind().dialect, "name", "mssql")
+    for rows in batches:
+        rollups.apply_rows(session, rows)
+    session.flush()
+    assert stored(session) == expected
+    minute = [row for row in expected if row[0] == 60 and row[3] == rollups.to_epoch(datetime(2024, 1, 1))]
+    assert minute[0][4:8] == (4, 90.5, 19.0, 30.0)
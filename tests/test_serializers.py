@@ -0,0 +1,37 @@
+from datetime import datetime
+from decimal import Decimal
+import json
+import math
+
+import numpy as np
+import pytest
+
+from serializers import OrjsonSerializer, StdlibSerializer, orjson
+
+PAYLOAD = {
+    "timestamp": datetime(2024, 1, 1, 12, 30),
+    "values": [1.5, math.nan, math.inf, -math.inf],
+    "nested": {"series": (2.0, math.nan), "reading": Decimal("NaN")},
+    "array": np.array([0.5, np.nan, np.inf]),
+    "scalar": np.float64(np.inf),
+    "count": np.int64(3),
+}
+EXPECTED = {
+    "timestamp": "2024-01-01T12:30:00",
+    "values": [1.5, None, None, None],
+    "nested": {"series": [2.0, None], "reading": None},
+    "array": [0.5, None, None],
+    "scalar": None,
+    "count": 3,
+}
+
+
+def test_stdlib_emits_null_for_non_finite_floats():
+    data = StdlibSerializer().dumps(PAYLOAD)
+    assert b"NaN" not in data and b"Infinity" not in data
+    assert json.loads(data) == EXPECTED
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+def test_stdlib_matches_orjson():
+    assert StdlibSerializer().dumps(PAYLOAD) == OrjsonSerializer().dumps(PAYLOAD)
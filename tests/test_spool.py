@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from spool import Spool, SpoolReplayer
+
+
+def sample(minute, device_id=1):
+    return {
+        "timestamp": datetime(2024, 1, 1) + timedelta(minutes=minute),
+        "device_id": device_id,
+        "temperature": 20.0 + minute,
+        "humidity": 40.0 + minute,
+    }
+
+
+def keys(rows):
+    return [(row["device_id"], row["timestamp"], row["metric"]) for row in rows]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), fsync=False)
+    yield spool
+    spool.close()
+
+
+def test_round_trip(spool):
+    aware = datetime(2024, 1, 1, 2, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert spool.append([sample(0), {"timestamp": aware, "metric": "co2", "unit": "ppm", "value": 412.5}]) == 3
+    loaded = []
+    assert SpoolReplayer(spool, loaded.extend).replay_once() == 3
+    assert loaded == [
+        {"timestamp": datetime(2024, 1, 1), "value": 20.0, "device_id": 1, "metric": "temperature", "unit": "C"},
+        {"timestamp": datetime(2024, 1, 1), "value": 40.0, "device_id": 1, "metric": "humidity", "unit": "%"},
+        {"timestamp": datetime(2024, 1, 1), "value": 412.5, "device_id": None, "metric": "co2", "unit": "ppm"},
+    ]
+
+
+def test_failed_load_is_retried_without_duplicates(spool):
+    spool.append([sample(minute) for minute in range(10)])
+    stored = []
+    calls = {"n": 0}
+
+    def flaky_load(rows):
+        calls["n"] += 1
+        if calls["n"] == 3:
+            raise RuntimeError("database is locked")
+        stored.extend(rows)
+
+    replayer = SpoolReplayer(spool, flaky_load, batch_size=4)
+    with pytest.raises(RuntimeError):
+        replayer.replay_once()
+    replayer.replay_once()
+    assert len(keys(stored)) == len(set(keys(stored))) == 20
+
+
+def test_batches_do_not_split_a_reading(spool):
+    spool.append([sample(minute) for minute in range(5)])
+    batches = []
+    SpoolReplayer(spool, batches.append, batch_size=3).replay_once()
+    for batch in batches:
+        assert len({(row["device_id"], row["timestamp"]) for row in batch}) * 2 == len(batch)
+    assert sum(len(batch) for batch in batches) == 10
+
+
+def test_checkpoint_survives_restart_and_segments_are_removed(tmp_path):
+    directory = str(tmp_path / "spool")
+    spool = Spool(directory, segment_bytes=256, fsync=False)
+    for minute in range(6):
+        spool.append([sample(minute)])
+    assert len(spool.segments()) > 1
+    first = []
+    SpoolReplayer(spool, first.extend).replay_once()
+    assert spool.segments() == [spool.active_seq]
+    spool.close()
+
+    spool = Spool(directory, segment_bytes=256, fsync=False)
+    spool.append([sample(10)])
+    second = []
+    SpoolReplayer(spool, second.extend).replay_once()
+    spool.close()
+    assert len(first) == 12
+    assert keys(second) == [(1, datetime(2024, 1, 1, 0, 10), "temperature"), (1, datetime(2024, 1, 1, 0, 10), "humidity")]
+
+
+def test_torn_tail_is_cut_off_on_reopen(tmp_path):
+    directory = str(tmp_path / "spool")
+    spool = Spool(directory, fsync=False)
+    spool.append([sample(0)])
+    path = spool.segment_path(spool.active_seq)
+    spool.close()
+    with open(path, "ab") as f:
+        f.write(b"\x30\x00\x00\x00torn")
+
+    spool = Spool(directory, fsync=False)
+    spool.append([sample(1)])
+    loaded = []
+    SpoolReplayer(spool, loaded.extend).replay_once()
+    spool.close()
+    assert [row["timestamp"].minute for row in loaded] == [0, 0, 1, 1]
@@ -1,4 +1,5 @@
-from bokeh.models import ColumnDataSource, NumeralTickFormatter, HoverTool
+from bokeh.models import AjaxDataSource, ColumnDataSource, CustomJS, NumeralTickFormatter, HoverTool
+from bokeh.palettes import Category10_10
 from bokeh.plotting import figure
 
 def create_bar_chart(data: list, x_axis: str, y_axis: str, title: str) -> figure:
@@ -38,4 +39,55 @@ def create_bar_chart(data: list, x_axis: str, y_axis: str, title: str) -> figure
         p.text(x=[0], y=[0], text=["Error creating chart"], text_color=["black"], text_font_size="20pt", text_baseline="middle", text_align="center")
         return p
 
+# Moves the since= parameter of an AjaxDataSource URL past the last point received,
+# so each poll only returns newer points.
+ADVANCE_SINCE_JS = """
+const response = cb_data.response;
+if (response.x.length) {
+    const url = new URL(cb_obj.data_url, window.location.href);
+    url.searchParams.set("since", response.x[response.x.length - 1]);
+    cb_obj.data_url = url.toString();
+}
+return response;
+"""
 
+def create_line_chart(series: list, title: str, y_label: str = "value", update_urls: list = None,
+                      polling_interval: int = 5000, max_size: int = None) -> figure:
+    """
+    Build a datetime-axis line chart with one line per series.
+    :param series: List of (label, x, y) where x is epoch milliseconds or datetime64 and y is floats.
+    :param update_urls: Optional list aligned with series; a line with a URL polls it for newer
+        points ({"x": [...], "y": [...]}) and appends them, keeping at most max_size points.
+    """
+    p = figure(title=title, x_axis_type="datetime", height=400, sizing_mode="stretch_width")
+    if not any(len(x) for _, x, _ in series) and not any(update_urls or []):
+        p.text(
+            x=[0],
+            y=[0],
+            text=["No data available"],
+            text_color=["black"],
+            text_font_size="20pt",
+            text_baseline="middle",
+            text_align="center",
+        )
+        return p
+    for i, (label, x, y) in enumerate(series):
+        url = update_urls[i] if update_urls else None
+        if url:
+            source = AjaxDataSource(
+                data={"x": x, "y": y},
+                data_url=url,
+                method="GET",
+                mode="append",
+                polling_interval=polling_interval,
+                max_size=max_size,
+                adapter=CustomJS(code=ADVANCE_SINCE_JS),
+            )
+        else:
+            source = ColumnDataSource({"x": x, "y": y})
+        p.line(x="x", y="y", source=source, legend_label=label, color=Category10_10[i % 10], line_width=1.5)
+    p.yaxis.axis_label = y_label
+    p.legend.click_policy = "hide"
+    hover = HoverTool(tooltips=[("time", "@x{%F %T}"), (y_label, "@y{0.00}")], formatters={"@x": "datetime"}, mode="vline")
+    p.add_tools(hover)
+    return p
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+import redis
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from config import config
+from models import Device, DeviceDetail
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Scope bumped by every sensor data write, whatever the device.
+ALL = "*"
+# Scope bumped when device records change.
+DEVICES = "devices"
+NO_DEVICE = "none"
+
+
+def now_micros():
+    return time.time_ns() // 1000
+
+
+def device_scope(device_id):
+    return NO_DEVICE if device_id is None else str(device_id)
+
+
+class LocalWatermarks:
+    """Watermarks held in this process; correct only when one process does all the writes."""
+
+    def __init__(self):
+        self._marks = {}
+        self._lock = threading.Lock()
+        self._started = now_micros()
+
+    def bump(self, scopes):
+        now = now_micros()
+        bumped = {}
+        with self._lock:
+            for scope in scopes:
+                previous = self._marks.get(scope)
+                self._marks[scope] = max(now, (self._started if previous is None else previous) + 1)
+                bumped[scope] = (previous, self._marks[scope])
+        return bumped
+
+    def get(self, scope):
+        with self._lock:
+            return self._marks.get(scope, self._started)
+
+
+class RedisWatermarks:
+    """Watermarks shared by every worker process in one Redis hash."""
+
+    BUMP_SCRIPT = """
+local now = tonumber(ARGV[1])
+local result = {}
+for i = 2, #ARGV do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '-1')
+    local bumped = math.max(now, current + 1)
+    redis.call('HSET', KEYS[1], ARGV[i], bumped)
+    table.insert(result, current)
+    table.insert(result, bumped)
+end
+return result
+"""
+
+    def __init__(self, client, key="iot:watermarks"):
+        self.client = client
+        self.key = key
+        self._bump = client.register_script(self.BUMP_SCRIPT)
+
+    def bump(self, scopes):
+        scopes = list(scopes)
+        result = self._bump(keys=[self.key], args=[now_micros()] + scopes)
+        return {
+            scope: (None if result[2 * i] < 0 else result[2 * i], result[2 * i + 1])
+            for i, scope in enumerate(scopes)
+        }
+
+    def get(self, scope):
+        value = self.client.hget(self.key, scope)
+        if value is None:
+            # Unknown scope: start it now, so every process agrees on one value.
+            self.client.hsetnx(self.key, scope, now_micros())
+            value = self.client.hget(self.key, scope)
+        return int(value)
+
+
+class IngestWatermarks:
+    """
+    Per-scope change markers for conditional GET: epoch microseconds of the
+    last committed write, strictly increasing per scope. Reading one is a dict
+    or hash lookup and never touches the database.
+    :param processes: Number of processes serving the app. Marks are only shared when
+        there is one of them or the backend is shared; readers must check shared first.
+    """
+
+    def __init__(self, backend, processes=1):
+        self.backend = backend
+        self.shared = processes <= 1 or not isinstance(backend, LocalWatermarks)
+        if not self.shared:
+            logger.warning(
+                f"Local ingest watermarks with {processes} processes; conditional responses are disabled. "
+                "Set INGEST_WATERMARK_BACKEND=redis to enable them."
+            )
+
+    def apply_rows(self, rows):
+        """
+        Bulk writer commit listener: bump every device in the batch and ALL.
+        :return: Dict of scope -> (previous mark or None, new mark); empty if the bump failed.
+        """
+        scopes = {device_scope(row.get("device_id")) for row in rows}
+        scopes.add(ALL)
+        return self.bump(scopes)
+
+    def bump(self, scopes):
+        try:
+            return self.backend.bump(scopes)
+        except Exception as e:
+            logger.error(f"Failed to bump watermarks {sorted(scopes)}: {e}")
+            return {}
+
+    def get(self, scope=ALL):
+        return self.backend.get(scope)
+
+
+def create_backend(name, redis_url):
+    if name == "redis":
+        return RedisWatermarks(redis.Redis.from_url(redis_url))
+    if name != "local":
+        raise ValueError(f"Unknown watermark backend: {name}")
+    return LocalWatermarks()
+
+
+ingest_watermarks = IngestWatermarks(
+    create_backend(config.INGEST_WATERMARK_BACKEND, config.INGEST_WATERMARK_REDIS_URL),
+    processes=config.WEB_WORKERS,
+)
+
+DEVICE_MODELS = (Device, DeviceDetail)
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _note_device_changes(session, flush_context):
+    if any(isinstance(obj, DEVICE_MODELS) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["devices_changed"] = True
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _bump_device_watermark(session):
+    if session.info.pop("devices_changed", False):
+        ingest_watermarks.bump([DEVICES])
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _forget_device_changes(session):
+    session.info.pop("devices_changed", None)
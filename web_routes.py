@@ -1,8 +1,17 @@
-from models import SensorData
+from datetime import datetime, timedelta
 import logging
+
+from aggregation import parse_duration
+from database import db_session_scope
+from models import Device
 from discovery import initialize_discovery, start_discovery, get_discovered_devices
 
 from services import get_sensor_data
+from sensor_service import fetch_sample_records, fetch_sensor_data_page
+from pagination import clamp_limit
+from config import config
+from last_values import last_value_cache
+from conditional import conditional_get, scope_from_device_arg
 
 from concurrent.futures import ThreadPoolExecutor
 from flask_wtf import FlaskForm
@@ -43,12 +52,21 @@ def select_device_web():
     return redirect(url_for('index'))
     
 @web.route("/devices/<device_name>/data", methods=["GET"])
-def get_data():
-    selected_device_name = current_app.config.get('SELECTED_DEVICE_NAME')
-    if not selected_device_name:
-        return redirect(url_for('select_device')) 
-    sensor_data_for_device = SensorData.query.filter_by(device_name=selected_device_name).all()
-    data_list = [{"timestamp": data.timestamp, "temperature": data.temperature, "humidity": data.humidity} for data in sensor_data_for_device]
+def get_data(device_name):
+    """
+    Readings of one device in sample shape over window (e.g. '24h', default
+    CHART_WINDOW_DEFAULT) ending at end (ISO timestamp, default now).
+    """
+    try:
+        window = parse_duration(request.args.get("window", config.CHART_WINDOW_DEFAULT))
+        end = datetime.fromisoformat(request.args["end"]) if "end" in request.args else datetime.utcnow()
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    with db_session_scope(readonly=True) as session:
+        device_id = session.query(Device.id).filter(Device.name == device_name).scalar()
+    if device_id is None:
+        return jsonify(success=False, error=f"Unknown device: {device_name}"), 404
+    data_list = fetch_sample_records(end - timedelta(seconds=window), end, device_id)
     return jsonify(success=True, data=data_list)
 
 @web.route('/collect_data')
@@ -62,15 +80,13 @@ def collect_data():
         return "Error collecting data", 500
 
 @web.route('/latest_data')
+@conditional_get(scope=scope_from_device_arg)
 def latest_data():
     try:
-        latest_entry = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-        logger.info(f"Successfully retrieved latest data with timestamp: {latest_entry.timestamp}.")
-        return jsonify({
-            'timestamp': latest_entry.timestamp,
-            'temperature': latest_entry.temperature,
-            'humidity': latest_entry.humidity
-        })
+        device_id = request.args.get('device_id', type=int)
+        records = last_value_cache.as_records(device_id)
+        logger.info(f"Served {len(records)} latest values from the last-value cache.")
+        return jsonify({'data': records})
     except Exception as e:
         logger.error(f"Error retrieving latest sensor data: {e}")
         return jsonify({'error': 'An error occurred while fetching the latest data.'})
@@ -78,12 +94,12 @@ def latest_data():
 @web.route('/display_data', methods=['GET'])
 def display_data():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = 10  
-        data = SensorData.query.order_by(SensorData.timestamp.desc()).paginate(page, per_page, False)
-        logger.info(f"Fetched {len(data.items)} records for page {page}.")
-        data_list = [{'timestamp': record.timestamp, 'temperature': record.temperature, 'humidity': record.humidity} for record in data]
-        return render_template('display_data.html', data=data_list)
+        cursor = request.args.get('cursor')
+        per_page = request.args.get('limit', request.args.get('per_page', type=int), type=int)
+        per_page = clamp_limit(per_page, config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX)
+        data_list, next_cursor, prev_cursor = fetch_sensor_data_page(per_page, cursor)
+        logger.info(f"Fetched {len(data_list)} records for display.")
+        return render_template('display_data.html', data=data_list, next_cursor=next_cursor, prev_cursor=prev_cursor)
     except Exception as e:
         logger.error(f"Error displaying sensor data: {e}")
         return render_template('error.html', message='An error occurred while displaying data.')